@@ -1,8 +1,23 @@
 """
 Cloud Simulator Flask Application
 
-This module sets up a Flask web application to manage virtual machines (VMs) using
-multiprocessing. It provides routes to start, stop, monitor, and display VMs.
+This module sets up a Flask web application to manage virtual machines (VMs) whose state
+lives in a shared-memory VM table. It provides routes to start, stop, monitor, and display VMs.
+
+create_app builds the application. `python app.py` runs it on Flask's development
+server with the engine in the same process. For production it is served by
+gunicorn with gunicorn.conf.py: `gunicorn -c gunicorn.conf.py 'app:create_app()'`.
+The gunicorn master then starts one engine process holding the VM, network,
+metrics, autoscaler and CDN state, and each worker connects to it. Each worker
+serves up to its number of threads of requests at a time. Blocking disk reads and
+writes happen on those threads, and psutil is only sampled by the engine's
+scheduler thread, so a slow request ties up one thread rather than the whole
+worker.
+
+VM and network state is journaled to the directory named by CLOUD_SIM_STATE_DIR,
+"state" when served by gunicorn or `python app.py`, and recovered on restart.
+CLOUD_SIM_VM_BACKEND selects what runs the VMs: the pooled scheduler by default,
+or one process or cgroup per VM, which /monitor_vm then reports the real usage of.
 
 Routes:
     / - Home route that returns a message indicating the Cloud Simulator is running.
@@ -10,24 +25,130 @@ Routes:
     /stop_vm/<int:vm_id> - Route to stop a VM with the given ID.
     /monitor_vm/<int:vm_id> - Route to monitor a VM with the given ID.
     /display_vms - Route to display all running VMs.
+    /scaling_groups/<group_name> - Route to create or delete an autoscaling group.
+    /scaling_groups - Route to show every autoscaling group.
+    /metrics/<int:vm_id> - Route to show the CPU and memory history of a VM.
+    /metrics - Route to show CPU and memory aggregates over all VMs.
+    /vpcs/<vpc_name> - Route to create, show or delete a VPC.
+    /vpcs - Route to show every VPC.
+    /vpcs/<vpc_name>/subnets/<subnet_name> - Route to add or remove a subnet.
+    /vpcs/<vpc_name>/security_groups/<group_name> - Route to set or remove a security group.
+    /vpcs/<vpc_name>/firewall - Route to replace the firewall rules of a VPC.
+    /vpcs/<vpc_name>/vms/<int:vm_id> - Route to attach a VM to a VPC or detach it.
+    /check_flow - Route to decide whether a VM may open a flow to another VM.
+    /instrumentation - Route to show per-route latency histograms and I/O and engine
+        round-trip counters.
+    /profile - Route to sample the stacks of the worker or engine process as flamegraph
+        input.
+    /start_vms, /stop_vms, /delete_vms, /monitor_vms - Routes to act on a batch of VMs,
+        given as a list of vm_ids or a start and end VM ID.
+    /initiate_upload/<bucket_name>/<file_name> - Route to start a multipart upload.
+    /upload_part/<upload_id>/<int:part_number> - Route to upload one part of a multipart upload.
+    /list_parts/<upload_id> - Route to show the parts of a multipart upload received so far.
+    /complete_upload/<upload_id> - Route to assemble a multipart upload into its file.
+    /abort_upload/<upload_id> - Route to discard a multipart upload.
+    /list_files/<bucket_name> - Route to list the files of a bucket with prefix,
+        delimiter and pagination.
+    /blob_stats - Route to show the blob store's size and the bytes saved by deduplication.
+    /collect_garbage - Route to remove blobs that no file references.
+    /download_file/<bucket_name>/<file_name> - Route to stream a file from a bucket.
+    /edge_file/<file_name>/<int:user_location> - Route to stream a file from the nearest
+        edge server.
+    /replication_status/<file_name> - Route to show the replication state of a CDN file.
+    /cdn_stats - Route to show the usage and hit ratio of the edge caches.
+    /edge_servers/<server_name> - Route to add or remove an edge server.
+    /edge_health/<server_name> - Route to report the health and load of an edge server.
 
 Dependencies:
     - Flask
-    - multiprocessing
+    - engine (custom module)
     - vm_simulator (custom module)
 """
 
-from multiprocessing import Manager
-from flask import Flask, jsonify, request
-from vm_simulator import start_vm, stop_vm, monitor_vm, delete_vm, display_vms
-from cdn import upload_to_origin, delete_from_origin, serve_from_nearest_edge
-from storage import create_bucket, upload_file, delete_file, delete_bucket
+import atexit
+import functools
+import mimetypes
+import os
+import time
+import blob_store
+import instrumentation
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request, send_file
+from vm_simulator import monitor_vm, display_vms, monitor_vms
+from engine import ENGINE_ADDRESS_ENV, ENGINE_AUTHKEY_ENV, Engine, connect_engine
+from multipart import initiate_upload, upload_part, list_parts, complete_upload, abort_upload
+from object_cache import file_etag, hot_cache
+from persistence import DEFAULT_STATE_DIR, STATE_DIR_ENV
+from vm_backends import VM_BACKEND_ENV
+from catalog import MAX_KEYS
+from storage import (create_bucket, upload_file, get_file_path, delete_file, delete_bucket,
+                     list_files)
+from streaming import spool_stream
+from vpc import DEFAULT_CIDR as DEFAULT_VPC_CIDR
+
+routes = Blueprint('cloud_simulator', __name__)
+
+MAX_BATCH_SIZE = 10000
 
-app = Flask(__name__)
+def create_app():
+    """
+    Creates the Flask application. When the environment names an engine process,
+    as under gunicorn with gunicorn.conf.py, the app connects to it and reads
+    VM records from its shared-memory table; otherwise it runs its own engine
+    in this process.
+    Returns:
+        Flask: The application.
+    """
+    app = Flask(__name__)
+    address = os.environ.get(ENGINE_ADDRESS_ENV)
+    if address:
+        engine, table = connect_engine(address, bytes.fromhex(os.environ[ENGINE_AUTHKEY_ENV]))
+        # Other workers and the engine change files behind this worker's hot
+        # cache and invalidate only their own, so every hit is re-checked.
+        hot_cache.validate = True
+    else:
+        engine = Engine(state_dir=os.environ.get(STATE_DIR_ENV) or None,
+                        backend=os.environ.get(VM_BACKEND_ENV) or None)
+        table = engine.table
+        atexit.register(engine.close)
+    app.extensions['engine'] = engine
+    app.extensions['vms'] = table
+    if instrumentation.enabled():
+        app.before_request(start_timer)
+        app.teardown_request(record_latency)
+    app.register_blueprint(routes)
+    return app
 
-manager, vms = None, None
+def start_timer():
+    """
+    Notes when the request started.
+    """
+    g.request_start = time.perf_counter()
+
+def record_latency(error):
+    """
+    Records the request's latency in the histogram of its route. Requests that
+    match no route are not recorded.
+    """
+    del error
+    start = g.pop('request_start', None)
+    if start is not None and request.url_rule is not None:
+        instrumentation.observe(f"{request.method} {request.url_rule.rule}",
+                                time.perf_counter() - start)
+
+def get_engine():
+    """
+    Returns the engine of the current app: an Engine in this process, or a proxy
+    to the engine process.
+    """
+    return current_app.extensions['engine']
 
-@app.route('/')
+def get_vms():
+    """
+    Returns the VM table of the current app, for reading VM records.
+    """
+    return current_app.extensions['vms']
+
+@routes.route('/')
 def home():
     """
     Home route that returns a message indicating the Cloud Simulator is running.
@@ -38,7 +159,7 @@ def home():
 
 # Virtual Machine Routes
 
-@app.route('/start_vm/<int:vm_id>', methods=['POST'])
+@routes.route('/start_vm/<int:vm_id>', methods=['POST'])
 def start_vm_route(vm_id):
     """
     Route to start a VM with the given ID.
@@ -47,10 +168,10 @@ def start_vm_route(vm_id):
     Returns:
         JSON response with a message indicating the result of the operation.
     """
-    message = start_vm(vm_id, vms, manager)
+    message = get_engine().start_vm(vm_id)
     return jsonify(message)
 
-@app.route('/stop_vm/<int:vm_id>', methods=['POST'])
+@routes.route('/stop_vm/<int:vm_id>', methods=['POST'])
 def stop_vm_route(vm_id):
     """
     Route to stop a VM with the given ID.
@@ -59,10 +180,10 @@ def stop_vm_route(vm_id):
     Returns:
         JSON response with a message indicating the result of the operation.
     """
-    message = stop_vm(vm_id, vms)
+    message = get_engine().stop_vm(vm_id)
     return jsonify(message)
 
-@app.route('/delete_vm/<int:vm_id>', methods=['DELETE'])
+@routes.route('/delete_vm/<int:vm_id>', methods=['DELETE'])
 def delete_vm_route(vm_id):
     """
     Route to delete a VM with the given ID.
@@ -71,10 +192,10 @@ def delete_vm_route(vm_id):
     Returns:
         JSON response with a message indicating the result of the operation.
     """
-    message = delete_vm(vm_id, vms)
+    message = get_engine().delete_vm(vm_id)
     return jsonify(message)
 
-@app.route('/monitor_vm/<int:vm_id>', methods=['GET'])
+@routes.route('/monitor_vm/<int:vm_id>', methods=['GET'])
 def monitor_vm_route(vm_id):
     """
     Route to monitor a VM with the given ID.
@@ -83,21 +204,446 @@ def monitor_vm_route(vm_id):
     Returns:
         JSON response with the status of the VM.
     """
-    return jsonify(monitor_vm(vm_id, vms))
+    return jsonify(monitor_vm(vm_id, get_vms()))
 
-@app.route('/display_vms', methods=['GET'])
+@routes.route('/display_vms', methods=['GET'])
 def display_vms_route():
     """
     Route to display all VMs.
     Returns:
         JSON response with the status of all VMs.
     """
-    return jsonify(display_vms(vms))
+    return jsonify(display_vms(get_vms()))
+
+def requested_vm_ids():
+    """
+    Returns the VM IDs a batch request names: a JSON body with a "vm_ids" list
+    or an inclusive "start"/"end" range, or the same as query arguments, with
+    vm_ids given comma-separated.
+    Returns:
+        list: The VM IDs.
+    Raises:
+        ValueError: If no valid IDs are given or there are more than MAX_BATCH_SIZE.
+    """
+    params = request.get_json(silent=True) or request.args
+    invalid = "Give a list of vm_ids or a start and end VM ID!"
+    try:
+        if 'vm_ids' in params:
+            vm_ids = params['vm_ids']
+            if isinstance(vm_ids, str):
+                vm_ids = vm_ids.split(',')
+            first, count = None, len(vm_ids)
+        else:
+            first = int(params['start'])
+            count = int(params['end']) - first + 1
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(invalid) from e
+    if first is not None and count < 1:
+        raise ValueError("The end VM ID must not be less than the start VM ID!")
+    # Checked before the IDs are built, so that a huge range costs nothing.
+    if not 1 <= count <= MAX_BATCH_SIZE:
+        raise ValueError(f"A batch must have between 1 and {MAX_BATCH_SIZE} VMs!")
+    if first is not None:
+        return list(range(first, first + count))
+    try:
+        return [int(vm_id) for vm_id in vm_ids]
+    except (TypeError, ValueError) as e:
+        raise ValueError(invalid) from e
+
+def batch_route(operation):
+    """
+    Runs a batch VM operation on the requested VM IDs.
+    Args:
+        operation (callable): Takes the list of VM IDs, such as the engine's
+            start_vms, stop_vms or delete_vms.
+    Returns:
+        JSON response with a result per VM, or an error with status 400.
+    """
+    try:
+        vm_ids = requested_vm_ids()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(operation(vm_ids))
+
+@routes.route('/start_vms', methods=['POST'])
+def start_vms_route():
+    """
+    Route to start a batch of VMs.
+    Returns:
+        JSON response with the result for each VM.
+    """
+    return batch_route(get_engine().start_vms)
+
+@routes.route('/stop_vms', methods=['POST'])
+def stop_vms_route():
+    """
+    Route to stop a batch of VMs.
+    Returns:
+        JSON response with the result for each VM.
+    """
+    return batch_route(get_engine().stop_vms)
+
+@routes.route('/delete_vms', methods=['DELETE'])
+def delete_vms_route():
+    """
+    Route to delete a batch of VMs.
+    Returns:
+        JSON response with the result for each VM.
+    """
+    return batch_route(get_engine().delete_vms)
+
+@routes.route('/monitor_vms', methods=['GET'])
+def monitor_vms_route():
+    """
+    Route to monitor a batch of VMs.
+    Returns:
+        JSON response with the status of each VM.
+    """
+    return batch_route(functools.partial(monitor_vms, vms=get_vms()))
+
+def metrics_response(vm_id=None):
+    """
+    Queries the metrics store with the start, end and resolution given in the
+    query string.
+    Args:
+        vm_id (int): The ID of the VM, or None for the whole fleet.
+    Returns:
+        JSON response with the history and aggregates, or an error.
+    """
+    try:
+        result = get_engine().query_metrics(vm_id, request.args.get('start', type=float),
+                                            request.args.get('end', type=float),
+                                            request.args.get('resolution'))
+    except KeyError:
+        return jsonify({"message": f"No metrics recorded for VM {vm_id}!"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@routes.route('/scaling_groups/<group_name>', methods=['POST'])
+def create_scaling_group(group_name):
+    """
+    Route to create or replace a scaling group. The JSON body gives its
+    "first_vm_id", "min_size", "max_size", optional initial "desired" size and
+    "policy", for example {"type": "target_tracking", "target": 60}.
+    Args:
+        group_name (str): The name of the group.
+    Returns:
+        JSON response with the group's status, or an error with status 400.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        min_size = int(body.get('min_size', 1))
+        limits = (min_size, int(body['max_size']), int(body.get('desired', min_size)))
+        status = get_engine().create_scaling_group(group_name, int(body['first_vm_id']),
+                                                   limits, body.get('policy') or {})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Scaling group {group_name} cannot be created: {e}"}), 400
+    return jsonify({"message": f"Scaling group {group_name} created!", **status})
+
+@routes.route('/scaling_groups/<group_name>', methods=['DELETE'])
+def delete_scaling_group(group_name):
+    """
+    Route to delete a scaling group and stop its VMs.
+    Args:
+        group_name (str): The name of the group.
+    Returns:
+        JSON response with the result of the operation.
+    """
+    if get_engine().remove_scaling_group(group_name):
+        return jsonify({"message": f"Scaling group {group_name} deleted!"})
+    return jsonify({"message": f"Scaling group {group_name} not found!"})
+
+@routes.route('/scaling_groups', methods=['GET'])
+def list_scaling_groups():
+    """
+    Route to show the size and policy of every scaling group.
+    Returns:
+        JSON response with the status of each group.
+    """
+    return jsonify({"groups": get_engine().scaling_groups()})
+
+@routes.route('/metrics/<int:vm_id>', methods=['GET'])
+def vm_metrics(vm_id):
+    """
+    Route to show the CPU and memory history of a VM with its average, 95th
+    percentile and maximum. Optional query arguments: start and end (seconds
+    since the epoch) and resolution (raw, 1m or 1h).
+    Args:
+        vm_id (int): The ID of the VM.
+    Returns:
+        JSON response with the VM's metrics.
+    """
+    return metrics_response(vm_id)
+
+@routes.route('/metrics', methods=['GET'])
+def fleet_metrics():
+    """
+    Route to show the average, 95th percentile and maximum CPU and memory usage
+    over all VMs. Takes the same query arguments as /metrics/<vm_id>.
+    Returns:
+        JSON response with the fleet's metrics.
+    """
+    return metrics_response()
+
+# VPC Routes
+
+def vpc_response(operation, *args):
+    """
+    Calls an engine VPC operation and turns its result or error into a response.
+    Args:
+        operation (callable): The engine method.
+        *args: Its arguments.
+    Returns:
+        JSON response with the result, or an error with status 404 or 400.
+    """
+    try:
+        result = operation(*args)
+    except KeyError as e:
+        return jsonify({"error": f"{e.args[0]} not found!"}), 404
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@routes.route('/vpcs/<vpc_name>', methods=['POST'])
+def create_vpc(vpc_name):
+    """
+    Route to create a VPC. The optional JSON body gives its "cidr".
+    Args:
+        vpc_name (str): The name of the VPC.
+    Returns:
+        JSON response with the VPC's status, or an error with status 400.
+    """
+    body = request.get_json(silent=True) or {}
+    return vpc_response(get_engine().create_vpc, vpc_name, body.get('cidr', DEFAULT_VPC_CIDR))
+
+@routes.route('/vpcs/<vpc_name>', methods=['GET'])
+def show_vpc(vpc_name):
+    """
+    Route to show the subnets, security groups, firewall and VMs of a VPC.
+    Args:
+        vpc_name (str): The name of the VPC.
+    Returns:
+        JSON response with the VPC's status, or an error with status 404.
+    """
+    return vpc_response(get_engine().vpc_status, vpc_name)
+
+@routes.route('/vpcs', methods=['GET'])
+def list_vpcs():
+    """
+    Route to show every VPC.
+    Returns:
+        JSON response with the status of each VPC.
+    """
+    return jsonify({"vpcs": get_engine().vpc_status()})
+
+@routes.route('/vpcs/<vpc_name>', methods=['DELETE'])
+def delete_vpc(vpc_name):
+    """
+    Route to delete a VPC and detach its VMs.
+    Args:
+        vpc_name (str): The name of the VPC.
+    Returns:
+        JSON response with the result of the operation.
+    """
+    if get_engine().delete_vpc(vpc_name):
+        return jsonify({"message": f"VPC {vpc_name} deleted!"})
+    return jsonify({"message": f"VPC {vpc_name} not found!"})
+
+@routes.route('/vpcs/<vpc_name>/subnets/<subnet_name>', methods=['POST', 'DELETE'])
+def vpc_subnet(vpc_name, subnet_name):
+    """
+    Route to add a subnet to a VPC, with its "cidr" in the JSON body, or to
+    remove a subnet that has no VMs.
+    Args:
+        vpc_name (str): The name of the VPC.
+        subnet_name (str): The name of the subnet.
+    Returns:
+        JSON response with the VPC's status, or an error with status 404 or 400.
+    """
+    if request.method == 'DELETE':
+        return vpc_response(get_engine().update_vpc, vpc_name, 'remove_subnet', subnet_name)
+    body = request.get_json(silent=True) or {}
+    if 'cidr' not in body:
+        return jsonify({"error": "The subnet's cidr is required."}), 400
+    return vpc_response(get_engine().update_vpc, vpc_name, 'add_subnet', subnet_name,
+                        body['cidr'])
+
+@routes.route('/vpcs/<vpc_name>/security_groups/<group_name>', methods=['POST', 'DELETE'])
+def vpc_security_group(vpc_name, group_name):
+    """
+    Route to create or replace a security group, or to remove one that has no
+    members. The JSON body gives its "ingress" and "egress" allow rules, for
+    example {"ingress": [{"protocol": "tcp", "ports": "22", "cidr": "10.0.0.0/8"}]}.
+    Args:
+        vpc_name (str): The name of the VPC.
+        group_name (str): The name of the security group.
+    Returns:
+        JSON response with the VPC's status, or an error with status 404 or 400.
+    """
+    if request.method == 'DELETE':
+        return vpc_response(get_engine().update_vpc, vpc_name, 'remove_security_group',
+                            group_name)
+    body = request.get_json(silent=True) or {}
+    return vpc_response(get_engine().update_vpc, vpc_name, 'set_security_group',
+                        group_name, body.get('ingress', []), body.get('egress', []))
+
+@routes.route('/vpcs/<vpc_name>/firewall', methods=['POST'])
+def vpc_firewall(vpc_name):
+    """
+    Route to replace the firewall rules of a VPC. The JSON body gives the
+    "rules", such as {"action": "deny", "protocol": "tcp", "source": "172.16.1.0/24",
+    "destination": "172.16.2.0/24", "ports": "22", "priority": 10}, and the
+    "default" action for flows no rule matches (allow unless given).
+    Args:
+        vpc_name (str): The name of the VPC.
+    Returns:
+        JSON response with the VPC's status, or an error with status 404 or 400.
+    """
+    body = request.get_json(silent=True) or {}
+    return vpc_response(get_engine().update_vpc, vpc_name, 'set_firewall',
+                        body.get('rules', []), body.get('default', 'allow'))
+
+@routes.route('/vpcs/<vpc_name>/vms/<int:vm_id>', methods=['POST'])
+def attach_vpc_vm(vpc_name, vm_id):
+    """
+    Route to attach a VM to a VPC. The JSON body gives the "subnet" the VM gets
+    its address in and its "security_groups" (the default group if omitted).
+    Args:
+        vpc_name (str): The name of the VPC.
+        vm_id (int): The ID of the VM.
+    Returns:
+        JSON response with the VM's address, or an error with status 404 or 400.
+    """
+    body = request.get_json(silent=True) or {}
+    if 'subnet' not in body:
+        return jsonify({"error": "The VM's subnet is required."}), 400
+    try:
+        ip = get_engine().attach_to_vpc(vpc_name, vm_id, body['subnet'],
+                                        body.get('security_groups'))
+    except KeyError as e:
+        return jsonify({"error": f"{e.args[0]} not found!"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"message": f"VM {vm_id} attached to VPC {vpc_name}!", "ip": ip})
+
+@routes.route('/vpcs/<vpc_name>/vms/<int:vm_id>', methods=['DELETE'])
+def detach_vpc_vm(vpc_name, vm_id):
+    """
+    Route to detach a VM from a VPC and release its address.
+    Args:
+        vpc_name (str): The name of the VPC.
+        vm_id (int): The ID of the VM.
+    Returns:
+        JSON response with the result of the operation.
+    """
+    if get_engine().detach_from_vpc(vpc_name, vm_id):
+        return jsonify({"message": f"VM {vm_id} detached from VPC {vpc_name}!"})
+    return jsonify({"message": f"VM {vm_id} is not attached to VPC {vpc_name}!"})
+
+@routes.route('/check_flow', methods=['POST'])
+def check_flow():
+    """
+    Route to decide whether a VM may open a flow to another VM. The JSON body
+    gives the "source_vm", "destination_vm", "protocol" (tcp, udp or icmp) and
+    destination "port".
+    Returns:
+        JSON response saying whether the flow is allowed and, if not, why, or an
+        error with status 404 or 400.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        args = (int(body['source_vm']), int(body['destination_vm']), body['protocol'],
+                int(body.get('port', 0)))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "source_vm, destination_vm and protocol are required."}), 400
+    return vpc_response(get_engine().check_flow, *args)
+
+@routes.route('/instrumentation', methods=['GET'])
+def show_instrumentation():
+    """
+    Route to show the per-route latency histograms and the counters of the
+    worker process that serves the request and, under gunicorn, of the engine
+    process. Each worker keeps its own, so repeated requests may show different
+    workers.
+    Returns:
+        JSON response with the snapshot of each process.
+    """
+    result = {"worker": instrumentation.snapshot()}
+    if not isinstance(get_engine(), Engine):
+        result["engine"] = get_engine().instrumentation_snapshot()
+    return jsonify(result)
+
+@routes.route('/profile', methods=['GET'])
+def profile():
+    """
+    Route to sample the stacks of every thread for a while and return them as
+    flamegraph input. Optional query arguments: seconds (default 5), interval
+    between samples in seconds, and process (worker or engine).
+    Returns:
+        Plain-text response with one folded stack and its sample count per line,
+        or an error with status 400 or 409.
+    """
+    seconds = request.args.get('seconds', 5.0, type=float)
+    interval = request.args.get('interval', instrumentation.SAMPLE_INTERVAL, type=float)
+    process = request.args.get('process', 'worker')
+    if not 0 < seconds <= instrumentation.MAX_PROFILE_SECONDS or interval <= 0:
+        return jsonify({"error": "seconds must be between 0 and "
+                                 f"{instrumentation.MAX_PROFILE_SECONDS:g} and interval "
+                                 "must be positive."}), 400
+    if process == 'worker':
+        stacks = instrumentation.sample_stacks(seconds, interval)
+    elif process == 'engine':
+        stacks = get_engine().profile(seconds, interval)
+    else:
+        return jsonify({"error": "process must be worker or engine."}), 400
+    if stacks is None:
+        return jsonify({"error": "A profile is already running."}), 409
+    return Response(stacks, mimetype='text/plain')
 
 
 # Storage Routes
 
-@app.route('/create_bucket/<bucket_name>', methods=['POST'])
+def stream_file(file_path, service):
+    """
+    Sends a file. Small files come from the in-memory hot object cache; larger
+    ones are streamed from disk by the WSGI server's file wrapper (sendfile where
+    available). Range and If-None-Match headers are answered with 206 and 304
+    responses either way, with the same ETag.
+    Args:
+        file_path (str): The path of the file to send.
+        service (str): "storage" or "cdn", the service whose bytes_read counter
+            counts the bytes streamed from disk.
+    Returns:
+        Response: The file response, or None if the file was removed before it
+        could be opened.
+    """
+    cached = hot_cache.load(file_path)
+    if cached is None:
+        try:
+            # send_file opens the file, so it can be removed once this returns.
+            response = send_file(os.path.abspath(file_path), conditional=True,
+                                 etag=file_etag(os.stat(file_path)))
+        except FileNotFoundError:
+            return None
+        instrumentation.count(f"{service}.bytes_read", response.content_length or 0)
+        return response
+    data, etag = cached
+    response = Response(data, mimetype=mimetypes.guess_type(file_path)[0]
+                        or 'application/octet-stream')
+    response.set_etag(etag)
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+def upload_stream():
+    """
+    Returns the body of an upload request as a readable stream: the multipart
+    'file' field if there is one, otherwise the raw request body.
+    """
+    if 'file' in request.files:
+        return request.files['file'].stream
+    return request.stream
+
+@routes.route('/create_bucket/<bucket_name>', methods=['POST'])
 def create_storage_bucket(bucket_name):
     """
     Route to create a new bucket with the specified name.
@@ -109,22 +655,38 @@ def create_storage_bucket(bucket_name):
     result = create_bucket(bucket_name)
     return jsonify(result)
 
-@app.route('/upload_file/<bucket_name>/<file_name>', methods=['POST'])
+@routes.route('/upload_file/<bucket_name>/<file_name>', methods=['POST'])
 def upload_storage_file(bucket_name, file_name):
     """
-    Route to upload a file to the specified bucket.
+    Route to upload a file to the specified bucket. The file is streamed to disk
+    in chunks rather than read into memory.
     Args:
         bucket_name (str): The name of the bucket to upload the file to.
         file_name (str): The name of the file to upload.
     Returns:
         JSON response with the result of the operation.
     """
-    file = request.files['file']
-    file_content = file.read()
-    result = upload_file(bucket_name, file_name, file_content)
+    result = upload_file(bucket_name, file_name, upload_stream())
     return jsonify(result)
 
-@app.route('/delete_file/<bucket_name>/<file_name>', methods=['DELETE'])
+@routes.route('/download_file/<bucket_name>/<file_name>', methods=['GET'])
+def download_storage_file(bucket_name, file_name):
+    """
+    Route to stream a file from the specified bucket. Supports Range requests
+    and If-None-Match/ETag revalidation.
+    Args:
+        bucket_name (str): The name of the bucket containing the file.
+        file_name (str): The name of the file to download.
+    Returns:
+        The raw file content, or a JSON error with status 404.
+    """
+    file_path = get_file_path(bucket_name, file_name)
+    response = stream_file(file_path, 'storage') if file_path is not None else None
+    if response is None:
+        return jsonify({"message": f"File {file_name} does not exist in {bucket_name}!"}), 404
+    return response
+
+@routes.route('/delete_file/<bucket_name>/<file_name>', methods=['DELETE'])
 def delete_storage_file(bucket_name, file_name):
     """
     Route to delete a file from the specified bucket.
@@ -137,48 +699,252 @@ def delete_storage_file(bucket_name, file_name):
     result = delete_file(bucket_name, file_name)
     return jsonify(result)
 
-@app.route('/delete_bucket/<bucket_name>', methods=['DELETE'])
+@routes.route('/delete_bucket/<bucket_name>', methods=['DELETE'])
 def delete_storage_bucket(bucket_name):
     """
     Route to delete a bucket with the specified name.
     Args:
         bucket_name (str): The name of the bucket to delete.
     Returns:
-        JSON response with the result of the operation.
+        JSON response with the result of the operation, or an error with status
+        400 if the bucket directory could not be removed.
     """
     result = delete_bucket(bucket_name)
+    return jsonify(result), 400 if "error" in result else 200
+
+@routes.route('/initiate_upload/<bucket_name>/<file_name>', methods=['POST'])
+def initiate_multipart_upload(bucket_name, file_name):
+    """
+    Route to start a multipart upload of a file to the specified bucket.
+    Args:
+        bucket_name (str): The name of the bucket to upload the file to.
+        file_name (str): The name of the file to upload.
+    Returns:
+        JSON response with the ID of the upload.
+    """
+    return jsonify(initiate_upload(bucket_name, file_name))
+
+@routes.route('/upload_part/<upload_id>/<int:part_number>', methods=['PUT'])
+def upload_multipart_part(upload_id, part_number):
+    """
+    Route to stream one part of a multipart upload. Parts can be sent in
+    parallel and in any order.
+    Args:
+        upload_id (str): The ID of the upload.
+        part_number (int): The position of the part.
+    Returns:
+        JSON response with the size and ETag of the part.
+    """
+    return jsonify(upload_part(upload_id, part_number, upload_stream()))
+
+@routes.route('/list_parts/<upload_id>', methods=['GET'])
+def list_multipart_parts(upload_id):
+    """
+    Route to show the parts of a multipart upload received so far.
+    Args:
+        upload_id (str): The ID of the upload.
+    Returns:
+        JSON response with the number and size of each part.
+    """
+    return jsonify(list_parts(upload_id))
+
+@routes.route('/complete_upload/<upload_id>', methods=['POST'])
+def complete_multipart_upload(upload_id):
+    """
+    Route to assemble a multipart upload into its file. The optional JSON body
+    may list the "parts" to include as {"part_number", "etag"} objects.
+    Args:
+        upload_id (str): The ID of the upload.
+    Returns:
+        JSON response with the size, checksum and ETag of the file.
+    """
+    body = request.get_json(silent=True) or {}
+    return jsonify(complete_upload(upload_id, body.get('parts')))
+
+@routes.route('/abort_upload/<upload_id>', methods=['DELETE'])
+def abort_multipart_upload(upload_id):
+    """
+    Route to discard a multipart upload and its parts.
+    Args:
+        upload_id (str): The ID of the upload.
+    Returns:
+        JSON response with the result of the operation.
+    """
+    return jsonify(abort_upload(upload_id))
+
+@routes.route('/list_files/<bucket_name>', methods=['GET'])
+def list_storage_files(bucket_name):
+    """
+    Route to list the files of a bucket a page at a time. Optional query
+    arguments: prefix, delimiter, max_keys and continuation_token.
+    Args:
+        bucket_name (str): The name of the bucket to list.
+    Returns:
+        JSON response with one page of the listing.
+    """
+    result = list_files(bucket_name, request.args.get('prefix', ''),
+                        request.args.get('delimiter') or None,
+                        request.args.get('max_keys', MAX_KEYS, type=int),
+                        request.args.get('continuation_token'))
     return jsonify(result)
 
+@routes.route('/blob_stats', methods=['GET'])
+def blob_stats():
+    """
+    Route to show how many blobs are stored and how many bytes sharing saves.
+    Returns:
+        JSON response with the blob store statistics.
+    """
+    return jsonify(blob_store.get_stats())
+
+@routes.route('/collect_garbage', methods=['POST'])
+def collect_blob_garbage():
+    """
+    Route to remove blobs that no bucket or CDN file references.
+    Returns:
+        JSON response with the number of blobs removed and bytes reclaimed.
+    """
+    return jsonify(blob_store.collect_garbage())
+
 # CDN Routes
 
-@app.route('/upload_to_origin/<file_name>', methods=['POST'])
+def query_flag(name):
+    """
+    Returns True if the query string argument is set to 1, true or yes.
+    """
+    return request.args.get(name, 'false').lower() in ('1', 'true', 'yes')
+
+def query_coords():
+    """
+    Returns the (lat, lon) given in the query string, or None if either is missing.
+    """
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return None
+    return lat, lon
+
+@routes.route('/upload_to_origin/<file_name>', methods=['POST'])
 def upload_to_origin_server(file_name):
     """
-    Route to upload a file to the origin server.
+    Route to upload a file to the origin server. The file is streamed to disk
+    in chunks rather than read into memory. Edges fetch it on their next miss;
+    with ?replicate=true it is pre-filled into every edge cache, and with
+    ?async=true that happens in the background after the response.
     Args:
         file_name (str): The name of the file to upload.
     Returns:
         JSON response with the result of the operation.
     """
-    file = request.files['file']
-    file_content = file.read()
-    result = upload_to_origin(file_name, file_content)
+    # The upload is written to disk here; the engine only links it into place.
+    staged = spool_stream(upload_stream(), blob_store.STAGING_DIR)
+    instrumentation.count("cdn.bytes_written", staged[1])
+    result = get_engine().publish_to_origin(file_name, staged, query_flag('replicate'),
+                                            query_flag('async'))
     return jsonify(result)
 
-@app.route('/get_file/<file_name>/<int:user_location>', methods=['GET'])
+@routes.route('/get_file/<file_name>/<int:user_location>', methods=['GET'])
 def get_file_from_nearest_edge(file_name, user_location):
     """
     Route to serve a file from the nearest edge server based on the user's location.
+    Optional ?lat=&lon= query arguments route by distance instead.
     Args:
         file_name (str): The name of the file to serve.
         user_location (int): The location of the user.
     Returns:
         JSON response with the content of the file and the server it was served from.
     """
-    result = serve_from_nearest_edge(file_name, user_location)
+    result = get_engine().serve_from_nearest_edge(file_name, user_location, query_coords())
     return jsonify(result)
 
-@app.route('/delete_from_origin/<file_name>', methods=['DELETE'])
+@routes.route('/edge_file/<file_name>/<int:user_location>', methods=['GET'])
+def stream_from_nearest_edge(file_name, user_location):
+    """
+    Route to stream a file from the nearest edge server based on the user's location.
+    Optional ?lat=&lon= query arguments route by distance instead. Supports Range
+    requests and If-None-Match/ETag revalidation.
+    Args:
+        file_name (str): The name of the file to serve.
+        user_location (int): The location of the user.
+    Returns:
+        The raw file content with the serving edge in the X-Edge-Server header,
+        or a JSON error with status 404.
+    """
+    # An edge copy evicted or invalidated before it is opened is looked up again.
+    for _ in range(2):
+        server, edge_path = get_engine().edge_file_path(file_name, user_location,
+                                                        query_coords())
+        if edge_path is None:
+            break
+        response = stream_file(edge_path, 'cdn')
+        if response is not None:
+            response.headers['X-Edge-Server'] = server
+            return response
+    return jsonify({"message": f"File {file_name} not found."}), 404
+
+@routes.route('/replication_status/<file_name>', methods=['GET'])
+def replication_status(file_name):
+    """
+    Route to show the replication state and lag of a file on each edge server.
+    Args:
+        file_name (str): The name of the file.
+    Returns:
+        JSON response with the state of each edge server.
+    """
+    return jsonify(get_engine().replication_status(file_name))
+
+@routes.route('/cdn_stats', methods=['GET'])
+def cdn_stats():
+    """
+    Route to show the usage, hit, miss and eviction counters of every edge cache.
+    Returns:
+        JSON response with the statistics of each edge server.
+    """
+    return jsonify(get_engine().cdn_stats())
+
+@routes.route('/edge_servers/<server_name>', methods=['POST'])
+def add_edge(server_name):
+    """
+    Route to add an edge server. The optional JSON body may give its "lat",
+    "lon" and cache "capacity" in bytes.
+    Args:
+        server_name (str): The name of the edge server.
+    Returns:
+        JSON response with the result of the operation, or an error with status
+        400 if the name or a field is invalid.
+    """
+    body = request.get_json(silent=True) or {}
+    location = (body['lat'], body['lon']) if 'lat' in body and 'lon' in body else None
+    result = get_engine().add_edge_server(server_name, location, body.get('capacity'))
+    return jsonify(result), 400 if "error" in result else 200
+
+@routes.route('/edge_servers/<server_name>', methods=['DELETE'])
+def remove_edge(server_name):
+    """
+    Route to remove an edge server.
+    Args:
+        server_name (str): The name of the edge server.
+    Returns:
+        JSON response with the result of the operation.
+    """
+    return jsonify(get_engine().remove_edge_server(server_name))
+
+@routes.route('/edge_health/<server_name>', methods=['POST'])
+def edge_health(server_name):
+    """
+    Route to report the health of an edge server. The JSON body may set
+    "healthy" (bool) and "load" (utilization from 0 to 1).
+    Args:
+        server_name (str): The name of the edge server.
+    Returns:
+        JSON response with the result of the operation, or an error with status
+        400 if the load is invalid.
+    """
+    body = request.get_json(silent=True) or {}
+    result = get_engine().set_edge_health(server_name, body.get('healthy'), body.get('load'))
+    return jsonify(result), 400 if "error" in result else 200
+
+@routes.route('/delete_from_origin/<file_name>', methods=['DELETE'])
 def delete_from_origin_server(file_name):
     """
     Route to delete a file from the origin server and all edge servers.
@@ -187,10 +953,11 @@ def delete_from_origin_server(file_name):
     Returns:
         JSON response with the result of the operation.
     """
-    result = delete_from_origin(file_name)
+    result = get_engine().delete_from_origin(file_name)
     return jsonify(result)
 
 if __name__ == '__main__':
-    manager = Manager()
-    vms = manager.dict()
-    app.run(debug=True)
+    os.environ.setdefault(STATE_DIR_ENV, DEFAULT_STATE_DIR)
+    # The reloader would run the app, and so a second engine on the same state
+    # directory, in its watcher process too.
+    create_app().run(debug=True, use_reloader=False)
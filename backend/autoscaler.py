@@ -0,0 +1,414 @@
+"""
+Autoscaler Module
+
+This module scales groups of VMs on their CPU or memory usage. A scaling group
+owns a contiguous range of VM IDs and keeps between min_size and max_size of them
+running. On every evaluation its policy turns the group's average usage into a
+desired size, and the executor starts or stops VMs to match. A policy that has
+just scaled a group waits out its cooldown before scaling it in the same
+direction again.
+
+Two policies are provided: target tracking, which sizes the group so the average
+usage moves to a target, and step scaling, which adds or removes a fixed number
+of VMs for each usage band.
+
+Where metrics come from and how VMs are started is pluggable. The app uses the
+VM table and the batch VM functions; SimulatedFleet instead derives usage from a
+load trace and starts VMs instantly, so replay can run a day of traffic for
+thousands of groups in seconds of virtual time.
+
+Classes:
+    TargetTrackingPolicy: Sizes a group to keep its average usage at a target.
+    StepScalingPolicy: Adds or removes VMs by usage band.
+    ScalingGroup: A range of VM IDs with size limits and a policy.
+    VMExecutor: Starts and stops a group's VMs through the batch VM functions.
+    Autoscaler: Evaluates every group periodically and applies its decisions.
+    SimulatedFleet: Executor and metrics source driven by a load trace.
+
+Functions:
+    policy_from_dict(spec): Builds a policy from its JSON description.
+    replay(autoscaler, fleet, trace, step=60): Replays a load trace on virtual time.
+
+Global Variables:
+    EVALUATION_INTERVAL (float): Seconds between two evaluations of every group.
+    DEFAULT_COOLDOWN (float): Seconds a policy waits after scaling a group.
+"""
+
+import math
+import threading
+import time
+from vm_simulator import start_vms, stop_vms
+
+EVALUATION_INTERVAL = 10.0
+DEFAULT_COOLDOWN = 60.0
+
+# Target tracking leaves the group alone while usage is this close to the target.
+_TOLERANCE = 0.1
+
+class TargetTrackingPolicy:  # pylint: disable=too-few-public-methods
+    """
+    Sizes a group so that its average usage moves to the target.
+    """
+
+    def __init__(self, target, metric="cpu", cooldown=DEFAULT_COOLDOWN):
+        if not 0 < target <= 100:
+            raise ValueError("The target must be between 0 and 100.")
+        self.target = target
+        self.metric = metric
+        self.cooldown = cooldown
+
+    def desired(self, size, value):
+        """
+        Returns the size that would bring usage to the target if load stays the same.
+        Args:
+            size (int): The number of running VMs.
+            value (float): Their average usage in percent.
+        Returns:
+            int: The desired number of VMs.
+        """
+        if abs(value - self.target) <= self.target * _TOLERANCE:
+            return size
+        return math.ceil(size * value / self.target)
+
+class StepScalingPolicy:  # pylint: disable=too-few-public-methods
+    """
+    Adds or removes a fixed number of VMs depending on the usage band.
+    """
+
+    def __init__(self, steps, metric="cpu", cooldown=DEFAULT_COOLDOWN):
+        """
+        Args:
+            steps (list): (lower, upper, adjustment) bands. A band applies when
+                lower <= usage < upper; None leaves a bound open. The first band
+                that applies is used.
+            metric (str): "cpu" or "memory".
+            cooldown (float): Seconds to wait after scaling in a direction.
+        """
+        self.steps = [(lower, upper, int(adjustment)) for lower, upper, adjustment in steps]
+        self.metric = metric
+        self.cooldown = cooldown
+
+    def desired(self, size, value):
+        """
+        Returns the size after applying the adjustment of the matching band.
+        Args:
+            size (int): The number of running VMs.
+            value (float): Their average usage in percent.
+        Returns:
+            int: The desired number of VMs.
+        """
+        for lower, upper, adjustment in self.steps:
+            if (lower is None or value >= lower) and (upper is None or value < upper):
+                return size + adjustment
+        return size
+
+def policy_from_dict(spec):
+    """
+    Builds a policy from its JSON description, for example
+    {"type": "target_tracking", "target": 60} or
+    {"type": "step", "steps": [[80, null, 2], [null, 20, -1]]}. Both take an
+    optional "metric" ("cpu" or "memory") and "cooldown" in seconds.
+    Args:
+        spec (dict): The policy description.
+    Returns:
+        The policy.
+    Raises:
+        ValueError: If the description is invalid.
+    """
+    try:
+        metric = spec.get("metric", "cpu")
+        if metric not in ("cpu", "memory"):
+            raise ValueError("The metric must be cpu or memory.")
+        cooldown = float(spec.get("cooldown", DEFAULT_COOLDOWN))
+        if spec.get("type") == "target_tracking":
+            return TargetTrackingPolicy(float(spec["target"]), metric, cooldown)
+        if spec.get("type") == "step":
+            return StepScalingPolicy(spec["steps"], metric, cooldown)
+    except (AttributeError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid scaling policy: {e}") from e
+    raise ValueError("The policy type must be target_tracking or step.")
+
+class ScalingGroup:  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """
+    A range of VM IDs kept between a minimum and maximum number of running VMs.
+    """
+
+    def __init__(self, name, first_vm_id, limits, policy):
+        """
+        Args:
+            name (str): The name of the group.
+            first_vm_id (int): The first VM ID of the group. The group uses the
+                IDs first_vm_id to first_vm_id + max_size - 1.
+            limits (tuple): The min_size, max_size and initial desired size.
+            policy: The group's TargetTrackingPolicy or StepScalingPolicy.
+        Raises:
+            ValueError: If the limits are inconsistent.
+        """
+        min_size, max_size, desired = limits
+        if not 0 <= min_size <= desired <= max_size:
+            raise ValueError("Sizes must satisfy 0 <= min_size <= desired <= max_size.")
+        self.name = name
+        self.vm_ids = range(first_vm_id, first_vm_id + max_size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.desired = desired
+        self.policy = policy
+        self.members = []
+        self.last_scaled = {"out": None, "in": None}
+
+    def status(self):
+        """
+        Returns the group's configuration and size.
+        """
+        return {"name": self.name, "first_vm_id": self.vm_ids.start,
+                "min_size": self.min_size, "max_size": self.max_size,
+                "desired": self.desired, "running": len(self.members),
+                "policy": type(self.policy).__name__}
+
+class VMExecutor:
+    """
+    Starts and stops a group's VMs through the batch VM functions.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def scale_out(self, group, vm_ids):
+        """
+        Starts VMs of a group. VMs that were already running, for example
+        because they were started by hand, are not taken over by the group.
+        Returns:
+            list: The IDs of the VMs the group started.
+        """
+        del group
+        results = start_vms(vm_ids, self.table)["results"]
+        return [result["vm_id"] for result in results
+                if "error" not in result and not result["message"].endswith("already running!")]
+
+    def scale_in(self, group, vm_ids):
+        """
+        Stops VMs of a group.
+        """
+        del group
+        stop_vms(vm_ids, self.table)
+
+    def running(self, group):
+        """
+        Returns the members of a group that are still running, leaving out VMs
+        stopped or deleted outside of the autoscaler.
+        """
+        running = []
+        for vm_id in group.members:
+            vm = self.table.get(vm_id)
+            if vm is not None and vm["status"] == "running":
+                running.append(vm_id)
+        return running
+
+    def metric(self, group, name):
+        """
+        Returns the average usage of a group's running VMs, or None if none has
+        reported yet.
+        """
+        values = []
+        for vm_id in group.members:
+            vm = self.table.get(vm_id)
+            if vm is not None and vm[name] is not None:
+                values.append(vm[name])
+        return sum(values) / len(values) if values else None
+
+class Autoscaler:
+    """
+    Evaluates every scaling group periodically and resizes it.
+    """
+
+    def __init__(self, executor=None, clock=time.monotonic, interval=EVALUATION_INTERVAL):
+        """
+        Args:
+            executor: Starts and stops VMs and reports which are running and
+                their usage, such as a VMExecutor or a SimulatedFleet. Can be
+                attached later.
+            clock (callable): Returns the current time in seconds.
+            interval (float): Seconds between evaluations in the background thread.
+        """
+        self.executor = executor
+        self.clock = clock
+        self.interval = interval
+        self.groups = {}
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def attach(self, executor):
+        """
+        Sets the executor if there is none yet and starts evaluating in the
+        background, unless the background thread is already running.
+        """
+        with self._lock:
+            if self.executor is None:
+                self.executor = executor
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="autoscaler",
+                                                daemon=True)
+                self._thread.start()
+
+    def add_group(self, group):
+        """
+        Adds a scaling group, or replaces the group of the same name, and starts
+        its initial VMs.
+        Raises:
+            ValueError: If the group's VM IDs overlap another group's.
+        """
+        with self._lock:
+            old = self.groups.get(group.name)
+            for other in self.groups.values():
+                if other is not old and (group.vm_ids.start < other.vm_ids.stop
+                                         and other.vm_ids.start < group.vm_ids.stop):
+                    raise ValueError(f"VM IDs overlap with group {other.name}.")
+            if old is not None:
+                group.members = [vm_id for vm_id in old.members if vm_id in group.vm_ids]
+                gone = [vm_id for vm_id in old.members if vm_id not in group.vm_ids]
+                if gone:
+                    self.executor.scale_in(old, gone)
+            self.groups[group.name] = group
+            self._reconcile(group)
+
+    def remove_group(self, name):
+        """
+        Removes a scaling group and stops its VMs.
+        Returns:
+            bool: False if there is no such group.
+        """
+        with self._lock:
+            group = self.groups.pop(name, None)
+            if group is None:
+                return False
+            if group.members:
+                self.executor.scale_in(group, group.members)
+            return True
+
+    def evaluate(self, now=None):
+        """
+        Evaluates every group's policy once and resizes the groups. Members that
+        are no longer running are dropped first, so they are replaced and do not
+        count toward the group's size.
+        Args:
+            now (float): The current time. Defaults to the clock.
+        Returns:
+            int: The number of groups whose desired size changed.
+        """
+        now = self.clock() if now is None else now
+        changed = 0
+        with self._lock:
+            for group in self.groups.values():
+                group.members = self.executor.running(group)
+                value = None
+                if group.members:
+                    value = self.executor.metric(group, group.policy.metric)
+                if value is not None:
+                    desired = max(group.min_size, min(group.max_size,
+                                  group.policy.desired(len(group.members), value)))
+                    direction = "out" if desired > group.desired else "in"
+                    last = group.last_scaled[direction]
+                    if desired != group.desired and (
+                            last is None or now - last >= group.policy.cooldown):
+                        group.desired = desired
+                        group.last_scaled[direction] = now
+                        changed += 1
+                self._reconcile(group)
+        return changed
+
+    def status(self):
+        """
+        Returns the configuration and size of every group.
+        """
+        with self._lock:
+            return [group.status() for group in self.groups.values()]
+
+    def _reconcile(self, group):
+        missing = group.desired - len(group.members)
+        if missing > 0:
+            running = set(group.members)
+            vm_ids = [vm_id for vm_id in group.vm_ids if vm_id not in running][:missing]
+            group.members.extend(self.executor.scale_out(group, vm_ids))
+        elif missing < 0:
+            # Scale in the most recently started VMs first.
+            vm_ids = group.members[missing:]
+            del group.members[missing:]
+            self.executor.scale_in(group, vm_ids)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.evaluate()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                # A failed evaluation must not stop the ones that follow.
+                print(f"Autoscaler evaluation failed: {e!r}")
+
+class SimulatedFleet:
+    """
+    Executor and metrics source for replaying load traces. Each group has a
+    demand in CPU percent (200 means two fully busy VMs) that its running VMs
+    share evenly; VMs start and stop instantly.
+    """
+
+    def __init__(self):
+        self.demand = {}
+        self.vms = 0
+
+    def scale_out(self, group, vm_ids):
+        """
+        Starts VMs instantly.
+        """
+        del group
+        self.vms += len(vm_ids)
+        return list(vm_ids)
+
+    def scale_in(self, group, vm_ids):
+        """
+        Stops VMs instantly.
+        """
+        del group
+        self.vms -= len(vm_ids)
+
+    def running(self, group):
+        """
+        Returns every member of a group; simulated VMs only stop when scaled in.
+        """
+        return list(group.members)
+
+    def metric(self, group, name):
+        """
+        Returns the usage each running VM of a group would see under its demand.
+        """
+        del name
+        if not group.members:
+            return None
+        return min(100.0, self.demand.get(group.name, 0.0) / len(group.members))
+
+def replay(autoscaler, fleet, trace, step=60):
+    """
+    Replays a load trace on virtual time. The autoscaler must use the fleet as
+    its executor.
+    Args:
+        autoscaler (Autoscaler): The autoscaler with its groups.
+        fleet (SimulatedFleet): The fleet the trace drives.
+        trace (list): (time, group name, demand) events sorted by time.
+        step (float): Virtual seconds between evaluations.
+    Returns:
+        list: (time, running VMs, groups changed) after each evaluation.
+    """
+    timeline = []
+    if not trace:
+        return timeline
+    events = iter(trace)
+    event = next(events, None)
+    now = trace[0][0]
+    end = trace[-1][0]
+    while now <= end:
+        while event is not None and event[0] <= now:
+            fleet.demand[event[1]] = event[2]
+            event = next(events, None)
+        changed = autoscaler.evaluate(now)
+        timeline.append((now, fleet.vms, changed))
+        now += step
+    return timeline
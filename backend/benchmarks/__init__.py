@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Cloud Simulator backend.
+
+Run them from the backend directory, for example:
+    python -m benchmarks.vm_engine
+"""
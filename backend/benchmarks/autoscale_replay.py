@@ -0,0 +1,92 @@
+"""
+Autoscaling Replay Benchmark
+
+Replays a day of load for thousands of scaling groups on virtual time and reports
+how many group evaluations run per second and how much faster than real time the
+replay is. Each group follows a daily sine wave with its own phase and peak plus
+random noise, unless a trace file with "time,group,demand" lines is given.
+
+Usage:
+    python -m benchmarks.autoscale_replay [--groups N] [--hours H] [--step S]
+                                          [--policy target|step] [--trace FILE]
+"""
+
+import argparse
+import csv
+import math
+import random
+import time
+from autoscaler import (Autoscaler, ScalingGroup, SimulatedFleet, StepScalingPolicy,
+                        TargetTrackingPolicy, replay)
+
+def synthetic_trace(groups, hours, step, seed=0):
+    """
+    Builds a daily sine-wave load trace for each group.
+    Returns:
+        list: (time, group name, demand) events sorted by time.
+    """
+    rng = random.Random(seed)
+    shapes = [(f"group-{i}", rng.uniform(0, 2 * math.pi), rng.uniform(200, 2000))
+              for i in range(groups)]
+    trace = []
+    for t in range(0, int(hours * 3600) + 1, step):
+        for name, phase, peak in shapes:
+            wave = 0.55 + 0.45 * math.sin(2 * math.pi * t / 86400 + phase)
+            trace.append((t, name, peak * wave * rng.uniform(0.9, 1.1)))
+    return trace
+
+def load_trace(path):
+    """
+    Reads "time,group,demand" lines from a CSV file.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        trace = [(float(t), name, float(demand)) for t, name, demand in csv.reader(f)]
+    return sorted(trace)
+
+def build_autoscaler(trace, policy):
+    """
+    Creates a scaling group for every group in the trace, on a simulated fleet.
+    Returns:
+        tuple: The autoscaler and the fleet.
+    """
+    fleet = SimulatedFleet()
+    autoscaler = Autoscaler(fleet)
+    for i, name in enumerate(sorted({event[1] for event in trace})):
+        if policy == "target":
+            group_policy = TargetTrackingPolicy(60, cooldown=300)
+        else:
+            group_policy = StepScalingPolicy([(80, None, 2), (None, 30, -1)], cooldown=300)
+        autoscaler.add_group(ScalingGroup(name, i * 100, (1, 100, 2), group_policy))
+    return autoscaler, fleet
+
+def main():
+    """
+    Replays the trace and prints the replay speed and the fleet size over time.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--groups", type=int, default=2000)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--step", type=int, default=60)
+    parser.add_argument("--policy", choices=("target", "step"), default="target")
+    parser.add_argument("--trace")
+    args = parser.parse_args()
+
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(
+        args.groups, args.hours, args.step)
+    autoscaler, fleet = build_autoscaler(trace, args.policy)
+    start = time.perf_counter()
+    timeline = replay(autoscaler, fleet, trace, args.step)
+    elapsed = time.perf_counter() - start
+    virtual = timeline[-1][0] - timeline[0][0]
+    evaluations = len(timeline) * len(autoscaler.groups)
+    print(f"{len(autoscaler.groups)} groups, {len(timeline)} evaluations of each "
+          f"over {virtual / 3600:.1f} virtual hours")
+    print(f"{evaluations / elapsed:,.0f} group evaluations/s, "
+          f"{virtual / elapsed:,.0f}x faster than real time")
+    print(f"{'hour':>6}{'VMs':>10}{'changed':>10}")
+    per_hour = max(1, 3600 // args.step)
+    for now, running, changed in timeline[::per_hour]:
+        print(f"{now / 3600:>6.0f}{running:>10}{changed:>10}")
+
+if __name__ == "__main__":
+    main()
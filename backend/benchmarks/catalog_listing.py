@@ -0,0 +1,70 @@
+"""
+Catalog Listing Benchmark
+
+Compares bucket emptiness checks and first-page listings answered by the SQLite
+catalog with the directory scans they replace, for a bucket of N files spread
+over a number of "folders" separated by "/".
+
+Usage:
+    python -m benchmarks.catalog_listing [--files N] [--folders N] [--repeat N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from catalog import MAX_KEYS, Catalog
+
+def _timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def _folders(directory):
+    return sorted({name.split("/", 1)[0].split("-", 1)[0] for name in os.listdir(directory)})
+
+def main():
+    """
+    Fills a catalog and a directory with the same files and prints the time of
+    each operation on both.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--files", type=int, default=100000)
+    parser.add_argument("--folders", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog = Catalog(os.path.join(tmp, "catalog.db"))
+        bucket_dir = os.path.join(tmp, "bucket")
+        os.makedirs(bucket_dir)
+        catalog.create_bucket("bench")
+        keys = [f"f{i % args.folders:04d}/{i:08d}" for i in range(args.files)]
+        catalog.put_objects("bench", ((key, 0, "0-0", 0, None) for key in keys))
+        # Directory entries cannot contain "/", so folders are flattened with "-".
+        for key in keys:
+            with open(os.path.join(bucket_dir, key.replace("/", "-")), "wb"):
+                pass
+
+        operations = [
+            ("is_empty",
+             lambda: catalog.is_empty("bench"),
+             lambda: not os.listdir(bucket_dir)),
+            ("first page",
+             lambda: catalog.list_objects("bench", max_keys=MAX_KEYS),
+             lambda: sorted(os.listdir(bucket_dir))[:MAX_KEYS]),
+            ("folders",
+             lambda: catalog.list_objects("bench", delimiter="/"),
+             lambda: _folders(bucket_dir)),
+        ]
+        print(f"{args.files:,} files in {args.folders} folders")
+        print(f"{'operation':<14}{'catalog ms':>14}{'listdir ms':>14}{'speedup':>10}")
+        for label, indexed, scan in operations:
+            indexed_time = _timed(indexed, args.repeat)
+            scan_time = _timed(scan, args.repeat)
+            print(f"{label:<14}{indexed_time * 1e3:>14.3f}{scan_time * 1e3:>14.3f}"
+                  f"{scan_time / indexed_time:>9.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Edge Cache Trace Replay
+
+Replays a request trace against EdgeCache instances of several capacities and
+reports hit ratio, evictions and bytes filled from the origin. Without a trace
+file a Zipf-distributed synthetic trace with log-normal object sizes is used.
+
+A trace file has one request per line: "<object name> <size in bytes>".
+
+Usage:
+    python -m benchmarks.edge_cache_trace [--trace FILE] [--capacities MB,...]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from edge_cache import EdgeCache
+
+def synthetic_trace(requests, objects, alpha, seed):
+    """
+    Builds a Zipf-distributed request trace.
+    Args:
+        requests (int): The number of requests.
+        objects (int): The number of distinct objects.
+        alpha (float): The Zipf exponent; higher values concentrate on fewer objects.
+        seed (int): Seed for the random generator.
+    Returns:
+        list: (object name, size) pairs.
+    """
+    rng = random.Random(seed)
+    sizes = [max(1, int(rng.lognormvariate(10, 1.5))) for _ in range(objects)]
+    weights = [1 / (rank + 1) ** alpha for rank in range(objects)]
+    ranks = rng.choices(range(objects), weights=weights, k=requests)
+    return [(f"obj{rank}", sizes[rank]) for rank in ranks]
+
+def read_trace(path):
+    """
+    Reads a trace file of "<object name> <size>" lines.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [(name, int(size)) for name, size in (line.split() for line in f if line.strip())]
+
+def replay(trace, capacity, workdir):
+    """
+    Replays a trace against a fresh EdgeCache.
+    Args:
+        trace (list): (object name, size) pairs.
+        capacity (int): The cache capacity in bytes.
+        workdir (str): A scratch directory holding the origin files.
+    Returns:
+        dict: The cache statistics plus the bytes filled from the origin.
+    """
+    origin = os.path.join(workdir, 'origin')
+    cache = EdgeCache('edge', os.path.join(workdir, f'edge-{capacity}'), capacity)
+    filled = 0
+    for name, size in trace:
+        if cache.lookup(name) is None:
+            origin_path = os.path.join(origin, name)
+            if not os.path.exists(origin_path):
+                with open(origin_path, 'wb') as f:
+                    f.truncate(size)
+            if cache.fill(name, origin_path) is not None:
+                filled += size
+    stats = cache.stats()
+    stats["filled_bytes"] = filled
+    return stats
+
+def main():
+    """
+    Replays the trace for each capacity and prints one row per capacity.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--trace", help="trace file; a synthetic trace is used if omitted")
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--objects", type=int, default=10000)
+    parser.add_argument("--alpha", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--capacities", default="16,64,256,1024",
+                        help="comma-separated cache capacities in MiB")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = read_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.requests, args.objects, args.alpha, args.seed)
+    print(f"{'MiB':>6}{'hit ratio':>12}{'evictions':>12}{'filled MiB':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'origin'))
+        for mib in (int(value) for value in args.capacities.split(',')):
+            stats = replay(trace, mib * 1024 * 1024, workdir)
+            print(f"{mib:>6}{stats['hit_ratio']:>12.4f}{stats['evictions']:>12}"
+                  f"{stats['filled_bytes'] / 1024 / 1024:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Hot Object Cache Benchmark
+
+Measures requests per second for a small set of hot CDN objects with the
+in-memory hot object cache enabled and disabled, both by calling
+serve_from_nearest_edge directly and through the /edge_file route.
+
+Usage:
+    python -m benchmarks.hot_cache [--objects N] [--size BYTES] [--requests N]
+"""
+
+import argparse
+import os
+import time
+from app import create_app
+from cdn import delete_from_origin, serve_from_nearest_edge, upload_to_origin
+from object_cache import MAX_CACHE_BYTES, hot_cache
+
+def _rate(func, names, requests):
+    start = time.perf_counter()
+    for i in range(requests):
+        func(names[i % len(names)])
+    return requests / (time.perf_counter() - start)
+
+def main():
+    """
+    Uploads the hot objects, then prints requests/sec with and without the cache.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--objects", type=int, default=32)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--requests", type=int, default=50000)
+    args = parser.parse_args()
+
+    names = [f"hot-bench-{i}.txt" for i in range(args.objects)]
+    for name in names:
+        upload_to_origin(name, os.urandom(args.size // 2).hex().encode())
+    client = create_app().test_client()
+    paths = {
+        "function": lambda name: serve_from_nearest_edge(name, 0),
+        "route": lambda name: client.get(f"/edge_file/{name}/0"),
+    }
+    print(f"{'path':<10}{'cache':<10}{'req/s':>12}")
+    try:
+        for label, func in paths.items():
+            for capacity in (0, MAX_CACHE_BYTES):
+                hot_cache.capacity = capacity
+                hot_cache.clear()
+                _rate(func, names, len(names))
+                rate = _rate(func, names, args.requests)
+                print(f"{label:<10}{'on' if capacity else 'off':<10}{rate:>12,.0f}")
+    finally:
+        hot_cache.capacity = MAX_CACHE_BYTES
+        for name in names:
+            delete_from_origin(name)
+
+if __name__ == "__main__":
+    main()
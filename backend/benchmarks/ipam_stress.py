@@ -0,0 +1,63 @@
+"""
+IPAM Stress Test
+
+Allocates and frees millions of addresses in one large AddressPool and checks
+that no address is ever handed out twice.
+
+Usage:
+    python -m benchmarks.ipam_stress [--cidr CIDR] [--count N] [--rounds N]
+"""
+
+import argparse
+import random
+import time
+from ip_assignment import AddressPool, ip_to_int
+
+def _check_unique(ips, first, size):
+    """
+    Raises AssertionError if any address occurs twice, using a bitmap instead
+    of a set so millions of addresses stay cheap to check.
+    """
+    seen = bytearray((size + 7) // 8)
+    for ip in ips:
+        offset = ip_to_int(ip) - first
+        byte, bit = offset >> 3, 1 << (offset & 7)
+        if seen[byte] & bit:
+            raise AssertionError(f"{ip} allocated twice")
+        seen[byte] |= bit
+
+def main():
+    """
+    Runs allocate/free rounds and prints throughput for each phase.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--cidr", default="10.0.0.0/8")
+    parser.add_argument("--count", type=int, default=2_000_000,
+                        help="addresses to allocate per round")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pool = AddressPool(args.cidr)
+    first = ip_to_int(args.cidr.split("/")[0]) + 1
+    rng = random.Random(0)
+    print(f"{'round':<8}{'phase':<12}{'addresses':>12}{'ops/s':>14}")
+    for round_no in range(1, args.rounds + 1):
+        start = time.perf_counter()
+        ips = [pool.allocate() for _ in range(args.count // 2)]
+        ips += pool.allocate_many(args.count - len(ips))
+        elapsed = time.perf_counter() - start
+        _check_unique(ips, first, pool.size)
+        assert pool.used == args.count
+        print(f"{round_no:<8}{'allocate':<12}{len(ips):>12}{len(ips) / elapsed:>14,.0f}")
+
+        rng.shuffle(ips)
+        start = time.perf_counter()
+        for ip in ips:
+            assert pool.release(ip)
+        elapsed = time.perf_counter() - start
+        assert pool.used == 0
+        assert not pool.release(ips[0])
+        print(f"{round_no:<8}{'release':<12}{len(ips):>12}{len(ips) / elapsed:>14,.0f}")
+
+if __name__ == "__main__":
+    main()
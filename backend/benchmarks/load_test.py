@@ -0,0 +1,168 @@
+"""
+Load Test
+
+Sends a mix of requests to a running Cloud Simulator from many client threads
+for a fixed time and reports the requests per second and the median and 99th
+percentile latency of each route group: VM reads (served from the shared VM
+table), VM writes and metrics (round trips to the engine), storage reads and
+writes, and CDN edge downloads.
+
+Start the server first, for example with
+`gunicorn -c gunicorn.conf.py 'app:create_app()'` or `python app.py`.
+
+Usage:
+    python -m benchmarks.load_test [--url URL] [--clients N] [--duration S]
+                                   [--vms N] [--seed S]
+"""
+
+import argparse
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+BUCKET = "loadtest"
+SMALL_FILE = b"x" * 4096
+LARGE_FILE = b"y" * (1 << 20)
+JSON = {"Content-Type": "application/json"}
+
+def request_mix(vms):
+    """
+    Returns the route groups with their share of the traffic and a function
+    that builds a (method, path, body) request from a random generator.
+    """
+    return [
+        ("vm reads", 30, lambda rng: ("GET", f"/monitor_vm/{rng.randrange(vms)}", None)),
+        ("vm writes", 5, lambda rng: ("POST", f"/{rng.choice(('start', 'stop'))}_vm/"
+                                              f"{vms + rng.randrange(vms)}", None)),
+        ("metrics", 10, lambda rng: ("GET", f"/metrics/{rng.randrange(vms)}", None)),
+        ("storage reads", 25, lambda rng: ("GET", rng.choice(
+            (f"/download_file/{BUCKET}/small", f"/download_file/{BUCKET}/large",
+             f"/list_files/{BUCKET}?max_keys=100")), None)),
+        ("storage writes", 5, lambda rng: ("POST", f"/upload_file/{BUCKET}/"
+                                                   f"upload-{rng.randrange(100)}", SMALL_FILE)),
+        ("cdn", 25, lambda rng: ("GET", f"/edge_file/small/{rng.randrange(1000)}", None)),
+    ]
+
+class Client:
+    """
+    One keep-alive connection to the server.
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80,
+                                                     timeout=60)
+
+    def send(self, method, path, body=None, headers=None):
+        """
+        Sends a request and reads the whole response.
+        Returns:
+            tuple: The status code and the response body.
+        """
+        self.connection.request(method, path, body=body, headers=headers or {})
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.connection.close()
+
+def prepare(url, vms):
+    """
+    Starts the VMs and uploads the files the request mix reads.
+    """
+    client = Client(url)
+    client.send("POST", "/start_vms", json.dumps({"start": 0, "end": vms - 1}), JSON)
+    client.send("POST", f"/create_bucket/{BUCKET}")
+    client.send("POST", f"/upload_file/{BUCKET}/small", SMALL_FILE)
+    client.send("POST", f"/upload_file/{BUCKET}/large", LARGE_FILE)
+    client.send("POST", "/upload_to_origin/small", SMALL_FILE)
+    client.close()
+
+def cleanup(url, vms):
+    """
+    Deletes the VMs the load test started.
+    """
+    client = Client(url)
+    client.send("DELETE", "/delete_vms", json.dumps({"start": 0, "end": 2 * vms - 1}), JSON)
+    client.close()
+
+def run_client(url, mix, deadline, rng, results):
+    """
+    Sends requests drawn from the mix until the deadline and records the latency
+    of each in results[group], or None for a failed request.
+    """
+    client = Client(url)
+    weights = [weight for _, weight, _ in mix]
+    while time.perf_counter() < deadline:
+        group, _, build = rng.choices(mix, weights)[0]
+        method, path, body = build(rng)
+        start = time.perf_counter()
+        try:
+            status, _ = client.send(method, path, body)
+        except (OSError, http.client.HTTPException):
+            client.close()
+            client = Client(url)
+            status = None
+        latency = time.perf_counter() - start
+        results[group].append(latency if status is not None and status < 500 else None)
+    client.close()
+
+def percentile(ordered, p):
+    """
+    Returns the p-th quantile of a sorted list.
+    """
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+def report(results, args):
+    """
+    Prints the request count, rate, latency percentiles and errors of each group.
+    """
+    print(f"{args.clients} clients for {args.duration:g} s against {args.url}")
+    print(f"{'route group':<16}{'requests':>10}{'req/s':>10}{'p50 ms':>10}"
+          f"{'p99 ms':>10}{'errors':>8}")
+    total = 0
+    for group, latencies in results.items():
+        ok = sorted(latency for latency in latencies if latency is not None)
+        total += len(latencies)
+        p50 = f"{percentile(ok, 0.5) * 1e3:.1f}" if ok else "-"
+        p99 = f"{percentile(ok, 0.99) * 1e3:.1f}" if ok else "-"
+        print(f"{group:<16}{len(latencies):>10}{len(latencies) / args.duration:>10.0f}"
+              f"{p50:>10}{p99:>10}{len(latencies) - len(ok):>8}")
+    print(f"{'total':<16}{total:>10}{total / args.duration:>10.0f}")
+
+def main():
+    """
+    Runs the load test and prints a table per route group.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--vms", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    prepare(args.url, args.vms)
+    mix = request_mix(args.vms)
+    results = {group: [] for group, _, _ in mix}
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=run_client, args=(
+        args.url, mix, deadline, random.Random(args.seed + i), results))
+               for i in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cleanup(args.url, args.vms)
+
+    report(results, args)
+
+if __name__ == "__main__":
+    main()
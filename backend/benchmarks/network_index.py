@@ -0,0 +1,58 @@
+"""
+Network Index Benchmark
+
+Compares removing VMs from their networks with the old linear scan over every
+network against `delete_network`, which uses the vm->network reverse index.
+
+Usage:
+    python -m benchmarks.network_index [--networks N] [--deletes N]
+"""
+
+import argparse
+import time
+import ip_assignment
+from ip_assignment import attach_vm, create_network, delete_network
+
+def _legacy_delete_network(legacy_networks, vm_id):
+    """
+    The pre-index implementation: scan every network's VM list.
+    """
+    for network_id, network in list(legacy_networks.items()):
+        if vm_id in network["vms"]:
+            network["vms"].remove(vm_id)
+            if len(network["vms"]) == 0:
+                del legacy_networks[network_id]
+
+def main():
+    """
+    Builds one network per VM in both layouts and times deleting a sample of VMs.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--networks", type=int, default=20000,
+                        help="networks (one VM each) to create")
+    parser.add_argument("--deletes", type=int, default=2000,
+                        help="VMs to remove from their networks")
+    args = parser.parse_args()
+    victims = range(args.networks - args.deletes, args.networks)
+
+    legacy_networks = {vm_id: {"vms": [vm_id]} for vm_id in range(args.networks)}
+    start = time.perf_counter()
+    for vm_id in victims:
+        _legacy_delete_network(legacy_networks, vm_id)
+    legacy_time = time.perf_counter() - start
+
+    for vm_id in range(args.networks):
+        attach_vm(create_network(vm_id), vm_id)
+    start = time.perf_counter()
+    for vm_id in victims:
+        delete_network(vm_id)
+    indexed_time = time.perf_counter() - start
+    assert len(ip_assignment.networks) == args.networks - args.deletes
+
+    print(f"{'implementation':<16}{'networks':>10}{'deletes':>10}{'us/delete':>12}")
+    for name, seconds in (("linear scan", legacy_time), ("reverse index", indexed_time)):
+        print(f"{name:<16}{args.networks:>10}{args.deletes:>10}"
+              f"{seconds * 1e6 / args.deletes:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+VM Backends Benchmark
+
+Starts the same fleet of VMs on every VM backend through vm_simulator and
+reports how fast they start and stop, what one collector pass over all of them
+costs, and the spread of the CPU usage they report. Pooled VMs derive their
+usage from the host's, so their numbers follow it; process and cgroup VMs report
+their own. The cgroup backend is skipped where no cgroup v2 hierarchy is
+writable.
+
+Usage:
+    python -m benchmarks.vm_backends [--vms N] [--seconds S]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+import vm_simulator
+from vm_table import VMTable
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Sends standard output to /dev/null, including that of VM processes, which
+    inherit the descriptor rather than sys.stdout.
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def timed_pass(backend):
+    """
+    Returns the seconds one collector pass of a backend takes.
+    """
+    start = time.perf_counter()
+    backend.collect()
+    return time.perf_counter() - start
+
+def cpu_usage(table):
+    """
+    Returns the CPU usage of every VM in the table that has one.
+    """
+    return [vm["cpu"] for _, vm in table.items() if vm["cpu"] is not None]
+
+def run(name, count, seconds):
+    """
+    Starts `count` VMs on a backend, lets them run, collects their usage and
+    stops them.
+    Returns:
+        tuple: VMs started per second, VMs stopped per second, microseconds per
+        VM of the fastest of three collector passes or None, and the min, mean
+        and max CPU usage.
+    """
+    vm_simulator.use_backend(name)
+    backend = vm_simulator.get_backend()
+    # The benchmark runs the collector itself.
+    backend.tick_interval = 3600.0
+    table = VMTable(capacity=count)
+    vm_ids = list(range(count))
+    with quiet():
+        start = time.perf_counter()
+        vm_simulator.start_vms(vm_ids, table)
+        started = count / (time.perf_counter() - start)
+        time.sleep(seconds)
+        pass_time = None
+        if hasattr(backend, "collect"):
+            passes = [timed_pass(backend)]
+            cpus = cpu_usage(table)
+            # Later passes cover too short a time to read usage from.
+            passes += [timed_pass(backend) for _ in range(2)]
+            pass_time = min(passes) / count * 1e6
+        else:
+            cpus = cpu_usage(table)
+        start = time.perf_counter()
+        vm_simulator.stop_vms(vm_ids, table)
+        stopped = count / (time.perf_counter() - start)
+    table.close()
+    vm_simulator.use_backend("pooled")
+    spread = (min(cpus), sum(cpus) / len(cpus), max(cpus)) if cpus else (0.0, 0.0, 0.0)
+    return (started, stopped, pass_time) + spread
+
+def main():
+    """
+    Runs every backend and prints a comparison table.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--vms", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=7.0,
+                        help="how long the VMs run before their usage is read")
+    args = parser.parse_args()
+
+    print(f"{'backend':<10}{'VMs':>6}{'start/s':>10}{'stop/s':>10}{'us/VM pass':>12}"
+          f"{'cpu min':>9}{'mean':>7}{'max':>7}")
+    for name in ("pooled", "process", "cgroup"):
+        try:
+            started, stopped, pass_time, low, mean, high = run(name, args.vms, args.seconds)
+        except RuntimeError as e:
+            print(f"{name:<10}skipped: {e}")
+            continue
+        pass_column = "-" if pass_time is None else f"{pass_time:.1f}"
+        print(f"{name:<10}{args.vms:>6}{started:>10.0f}{stopped:>10.0f}{pass_column:>12}"
+              f"{low:>9.1f}{mean:>7.1f}{high:>7.1f}")
+
+if __name__ == "__main__":
+    main()
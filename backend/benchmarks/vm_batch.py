@@ -0,0 +1,58 @@
+"""
+Batch VM Benchmark
+
+Starts, monitors, stops and deletes a fleet of VMs through the Flask routes, once
+with one request per VM and once with the batch routes, and prints the time of
+each phase.
+
+Usage:
+    python -m benchmarks.vm_batch [--vms N]
+"""
+
+import argparse
+import time
+from app import create_app
+
+def _single(client, count):
+    timings = {}
+    for phase, method, route in (("start", "post", "/start_vm"),
+                                 ("monitor", "get", "/monitor_vm"),
+                                 ("stop", "post", "/stop_vm"),
+                                 ("delete", "delete", "/delete_vm")):
+        start = time.perf_counter()
+        for vm_id in range(count):
+            getattr(client, method)(f"{route}/{vm_id}")
+        timings[phase] = time.perf_counter() - start
+    return timings
+
+def _batch(client, count):
+    timings = {}
+    body = {"start": 0, "end": count - 1}
+    for phase, method, route in (("start", "post", "/start_vms"),
+                                 ("monitor", "get", "/monitor_vms"),
+                                 ("stop", "post", "/stop_vms"),
+                                 ("delete", "delete", "/delete_vms")):
+        start = time.perf_counter()
+        getattr(client, method)(route, json=body)
+        timings[phase] = time.perf_counter() - start
+    return timings
+
+def main():
+    """
+    Runs the fleet through both sets of routes and prints a comparison table.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--vms", type=int, default=500)
+    args = parser.parse_args()
+
+    client = create_app().test_client()
+    single = _single(client, args.vms)
+    batch = _batch(client, args.vms)
+    print(f"{args.vms} VMs")
+    print(f"{'phase':<10}{'per-VM ms':>12}{'batch ms':>12}{'speedup':>10}")
+    for phase, elapsed in single.items():
+        print(f"{phase:<10}{elapsed * 1e3:>12.1f}{batch[phase] * 1e3:>12.1f}"
+              f"{elapsed / batch[phase]:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
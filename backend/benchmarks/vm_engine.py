@@ -0,0 +1,94 @@
+"""
+VM Engine Benchmark
+
+Compares the process-per-VM model (`simulate_vm` in its own `multiprocessing.Process`)
+with the pooled `VMScheduler`. Reports VMs started per second and memory per VM.
+
+Memory for the process model is the unique set size (USS) of each child process.
+Memory for the pooled model is the growth of this process's RSS.
+
+Usage:
+    python -m benchmarks.vm_engine [--processes N] [--pooled N]
+"""
+
+import argparse
+import time
+from multiprocessing import Process
+import psutil
+from vm_simulator import simulate_vm
+from vm_scheduler import VMScheduler
+from vm_table import VMTable
+
+
+def bench_processes(count):
+    """
+    Starts `count` VMs with one OS process each.
+    Args:
+        count (int): The number of VMs to start.
+    Returns:
+        tuple: VMs started per second and bytes of memory per VM.
+    """
+    procs = []
+    start = time.perf_counter()
+    for vm_id in range(count):
+        p = Process(target=simulate_vm, args=(vm_id, {}), daemon=True)
+        p.start()
+        procs.append(p)
+    elapsed = time.perf_counter() - start
+    uss = 0
+    for p in procs:
+        try:
+            uss += psutil.Process(p.pid).memory_full_info().uss
+        except psutil.Error:
+            pass
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.join()
+    return count / elapsed, uss / count
+
+
+def bench_pooled(count):
+    """
+    Starts `count` VMs on a pooled scheduler.
+    Args:
+        count (int): The number of VMs to start.
+    Returns:
+        tuple: VMs started per second and bytes of memory per VM.
+    """
+    proc = psutil.Process()
+    scheduler = VMScheduler()
+    table = VMTable(capacity=count)
+    rss_before = proc.memory_info().rss
+    start = time.perf_counter()
+    for vm_id in range(count):
+        table.insert(vm_id, "running")
+        scheduler.add(vm_id, table)
+    elapsed = time.perf_counter() - start
+    rss_after = proc.memory_info().rss
+    for vm_id in range(count):
+        scheduler.remove(vm_id)
+    table.close()
+    return count / elapsed, max(rss_after - rss_before, 0) / count
+
+
+def main():
+    """
+    Runs both benchmarks and prints a comparison table.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--processes", type=int, default=100,
+                        help="VMs to start with one process each")
+    parser.add_argument("--pooled", type=int, default=10000,
+                        help="VMs to start on the pooled scheduler")
+    args = parser.parse_args()
+
+    rows = [("process-per-VM", args.processes) + bench_processes(args.processes),
+            ("pooled", args.pooled) + bench_pooled(args.pooled)]
+    print(f"{'model':<16}{'VMs':>8}{'VMs/s':>12}{'KiB/VM':>10}")
+    for name, count, rate, mem in rows:
+        print(f"{name:<16}{count:>8}{rate:>12.1f}{mem / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
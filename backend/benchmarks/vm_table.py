@@ -0,0 +1,73 @@
+"""
+VM Table Benchmark
+
+Times `display_vms` over VMs stored as nested `Manager().dict()` proxies and over
+the shared-memory `VMTable`.
+
+Usage:
+    python -m benchmarks.vm_table [--vms N] [--manager-vms N]
+"""
+
+import argparse
+import time
+from multiprocessing import Manager
+from vm_simulator import display_vms
+from vm_table import VMTable
+
+
+class _ManagerVMs:  # pylint: disable=too-few-public-methods
+    """
+    The pre-VMTable layout: a Manager dict of Manager dicts, read the way
+    display_vms used to read it.
+    """
+
+    def __init__(self, vms):
+        self._vms = vms
+
+    def items(self):
+        """
+        Returns (vm_id, dict) pairs, paying one IPC round trip per field.
+        """
+        return [(vm_id, {"status": vm_dict.get("status"), "pid": vm_dict.get("pid"),
+                         "ip": vm_dict.get("ip")})
+                for vm_id, vm_dict in self._vms.items()]
+
+
+def _time_display(vms):
+    start = time.perf_counter()
+    display_vms(vms)
+    return time.perf_counter() - start
+
+
+def main():
+    """
+    Fills both stores and prints the time of one display_vms call on each.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("--vms", type=int, default=10000,
+                        help="VMs to store in the shared-memory table")
+    parser.add_argument("--manager-vms", type=int, default=2000,
+                        help="VMs to store as Manager dict proxies")
+    args = parser.parse_args()
+
+    with Manager() as manager:
+        proxies = manager.dict()
+        for vm_id in range(args.manager_vms):
+            proxies[vm_id] = manager.dict({'pid': 1000 + vm_id, 'cpu': None, 'memory': None,
+                                           'status': 'running', 'ip': '10.0.0.1'})
+        manager_time = _time_display(_ManagerVMs(proxies))
+
+    table = VMTable(capacity=args.vms)
+    for vm_id in range(args.vms):
+        table.insert(vm_id, "running", pid=1000 + vm_id, ip="10.0.0.1")
+    table_time = _time_display(table)
+    table.close()
+
+    print(f"{'store':<16}{'VMs':>8}{'ms':>12}{'us/VM':>10}")
+    for name, count, seconds in (("Manager dicts", args.manager_vms, manager_time),
+                                 ("VMTable", args.vms, table_time)):
+        print(f"{name:<16}{count:>8}{seconds * 1000:>12.2f}{seconds * 1e6 / count:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Blob Store Module
+
+This module keeps the content of stored objects exactly once on disk. Every
+object is written to a blob named after the SHA-256 digest of its content, and
+bucket and CDN files are hardlinks to that blob. Identical uploads to several
+buckets, the CDN origin and its edges therefore share one copy, and files keep
+being ordinary files that can be served zero-copy and read by range.
+
+A blob's reference count is its link count minus the blob itself, so removing a
+bucket or CDN file drops a reference with no bookkeeping of its own. Blobs whose
+references are all gone are reclaimed by collect_garbage.
+
+Functions:
+- blob_path(digest): Returns the path of the blob with the given digest.
+- store(stream, dest_path): Writes a stream to its blob and links dest_path to it.
+- store_file(tmp_path, digest, dest_path): Moves a staged file to its blob and
+links dest_path to it.
+- refcount(digest): Returns the number of files referencing a blob.
+- collect_garbage(): Removes blobs that no file references.
+- get_stats(): Returns the number of blobs and references and the bytes saved.
+
+Global Variables:
+- ROOT_BLOB_DIR: The directory holding the blobs. It must be on the same
+filesystem as the storage and CDN directories for files to share blobs.
+- STAGING_DIR: The directory where files are written before they become blobs.
+"""
+import contextlib
+import os
+import threading
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; the lock is per-process there.
+    fcntl = None
+from streaming import clone_file, spool_stream
+
+ROOT_BLOB_DIR = "blobs"
+
+STAGING_DIR = os.path.join(ROOT_BLOB_DIR, ".staging")
+
+# Serializes linking against garbage collection, so a blob is never removed
+# between being found and being linked to. The thread lock covers this process
+# and a lock on _LOCK_PATH covers the other web workers.
+_gc_lock = threading.Lock()
+_LOCK_PATH = os.path.join(ROOT_BLOB_DIR, ".lock")
+
+if not os.path.exists(STAGING_DIR):
+    os.makedirs(STAGING_DIR)
+
+@contextlib.contextmanager
+def _locked():
+    with _gc_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(_LOCK_PATH, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+def blob_path(digest):
+    """
+    Returns the path of the blob with the given digest.
+    Args:
+        digest (str): The hex SHA-256 digest of the blob's content.
+    Returns:
+        str: The path of the blob, fanned out by the digest's first two characters.
+    """
+    return os.path.join(ROOT_BLOB_DIR, digest[:2], digest)
+
+def store(stream, dest_path):
+    """
+    Writes a stream to the blob named after its digest and atomically places a
+    link to the blob at dest_path. If the blob already exists the new data is
+    discarded and only the link is added.
+    Args:
+        stream (file-like or bytes): The data to store.
+        dest_path (str): The path of the bucket or CDN file.
+    Returns:
+        tuple: The number of bytes stored, the hex SHA-256 digest of the data,
+        and True if an existing blob was reused.
+    """
+    tmp_path, size, digest = spool_stream(stream, STAGING_DIR)
+    return size, digest, store_file(tmp_path, digest, dest_path)
+
+def store_file(tmp_path, digest, dest_path):
+    """
+    Moves a complete file into the blob named after its digest and atomically
+    places a link to the blob at dest_path. If the blob already exists the file
+    is removed and only the link is added.
+    Args:
+        tmp_path (str): The file to store, in STAGING_DIR.
+        digest (str): The hex SHA-256 digest of the file's content.
+        dest_path (str): The path of the bucket or CDN file.
+    Returns:
+        bool: True if an existing blob was reused.
+    """
+    path = blob_path(digest)
+    with _locked():
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        # Falls back to a copy if dest_path is on another filesystem; the file
+        # then simply does not share the blob.
+        clone_file(path, dest_path)
+    return deduplicated
+
+def refcount(digest):
+    """
+    Returns the number of files referencing a blob.
+    Args:
+        digest (str): The hex SHA-256 digest of the blob's content.
+    Returns:
+        int: The number of references, or 0 if the blob does not exist.
+    """
+    try:
+        return os.stat(blob_path(digest)).st_nlink - 1
+    except FileNotFoundError:
+        return 0
+
+def collect_garbage():
+    """
+    Removes blobs that no file references.
+    Returns:
+        dict: The number of blobs removed and the bytes reclaimed.
+    """
+    removed = reclaimed = 0
+    with _locked():
+        for stat, path in _blobs():
+            if stat.st_nlink == 1:
+                os.remove(path)
+                removed += 1
+                reclaimed += stat.st_size
+    return {"removed": removed, "reclaimed_bytes": reclaimed}
+
+def get_stats():
+    """
+    Returns the number of blobs and references and the bytes saved by sharing.
+    Returns:
+        dict: Blob count, bytes on disk, reference count, logical bytes
+        referenced, bytes saved and the number of unreferenced blobs.
+    """
+    stats = {"blobs": 0, "bytes": 0, "references": 0, "logical_bytes": 0,
+             "unreferenced": 0}
+    for stat, _ in _blobs():
+        references = stat.st_nlink - 1
+        stats["blobs"] += 1
+        stats["bytes"] += stat.st_size
+        stats["references"] += references
+        stats["logical_bytes"] += references * stat.st_size
+        stats["unreferenced"] += references == 0
+    stats["saved_bytes"] = max(stats["logical_bytes"] - stats["bytes"], 0)
+    return stats
+
+def _blobs():
+    for fanout in os.scandir(ROOT_BLOB_DIR):
+        if not fanout.is_dir() or fanout.name.startswith('.'):
+            continue
+        for entry in os.scandir(fanout.path):
+            if entry.is_file():
+                yield entry.stat(), entry.path
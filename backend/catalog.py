@@ -0,0 +1,250 @@
+"""
+Catalog Module
+
+This module keeps the metadata of storage buckets and objects in SQLite, so
+listing a bucket or checking whether it is empty is an index lookup instead of a
+directory scan. Objects are clustered by (bucket, key), which makes prefix
+listing a range scan; with a delimiter, each common prefix costs one index seek
+past all of its keys however many there are.
+
+The database runs in WAL mode so readers never block the writer, and each thread
+uses its own connection.
+
+Classes:
+    Catalog: The bucket and object metadata store.
+
+Global Variables:
+    MAX_KEYS (int): Default and upper limit of the entries returned per listing page.
+"""
+
+import base64
+import sqlite3
+import threading
+
+MAX_KEYS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    key TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    sha256 TEXT,
+    PRIMARY KEY (bucket, key)
+) WITHOUT ROWID;
+"""
+
+class Catalog:
+    """
+    The bucket and object metadata store.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The SQLite database file. It is created if missing.
+        """
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def create_bucket(self, bucket):
+        """
+        Records a bucket.
+        Returns:
+            bool: False if the bucket already existed.
+        """
+        with self._connection() as connection:
+            cursor = connection.execute("INSERT OR IGNORE INTO buckets VALUES (?)", (bucket,))
+            return cursor.rowcount == 1
+
+    def bucket_exists(self, bucket):
+        """
+        Returns True if the bucket is recorded.
+        """
+        return self._connection().execute(
+            "SELECT 1 FROM buckets WHERE name = ?", (bucket,)).fetchone() is not None
+
+    def list_buckets(self):
+        """
+        Returns the names of all buckets in order.
+        """
+        return [row[0] for row in
+                self._connection().execute("SELECT name FROM buckets ORDER BY name")]
+
+    def is_empty(self, bucket):
+        """
+        Returns True if the bucket holds no objects.
+        """
+        return self._connection().execute(
+            "SELECT 1 FROM objects WHERE bucket = ? LIMIT 1", (bucket,)).fetchone() is None
+
+    def delete_bucket(self, bucket):
+        """
+        Removes a bucket if it holds no objects.
+        Returns:
+            bool: False if the bucket does not exist or is not empty.
+        """
+        with self._connection() as connection:
+            cursor = connection.execute(
+                "DELETE FROM buckets WHERE name = ? AND NOT EXISTS "
+                "(SELECT 1 FROM objects WHERE bucket = ?)", (bucket, bucket))
+            return cursor.rowcount == 1
+
+    def put_object(self, bucket, key, stat, sha256=None):
+        """
+        Records or replaces the metadata of an object.
+        Args:
+            bucket (str): The bucket of the object.
+            key (str): The key of the object.
+            stat (dict): The object's "size", "etag" and "mtime" in nanoseconds.
+            sha256 (str): The hex SHA-256 digest of the object's content, if known.
+        """
+        self.put_objects(bucket, [(key, stat["size"], stat["etag"], stat["mtime"], sha256)])
+
+    def put_objects(self, bucket, rows):
+        """
+        Records or replaces the metadata of several objects in one transaction.
+        Args:
+            bucket (str): The bucket of the objects.
+            rows (iterable): (key, size, etag, mtime, sha256) tuples.
+        """
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)",
+                ((bucket, *row) for row in rows))
+
+    def get_object(self, bucket, key):
+        """
+        Returns the metadata of an object.
+        Returns:
+            dict: The object's key, size, ETag, mtime and SHA-256, or None.
+        """
+        row = self._connection().execute(
+            "SELECT key, size, etag, mtime, sha256 FROM objects WHERE bucket = ? AND key = ?",
+            (bucket, key)).fetchone()
+        return None if row is None else _object(row)
+
+    def delete_object(self, bucket, key):
+        """
+        Removes the metadata of an object.
+        Returns:
+            bool: False if the object was not recorded.
+        """
+        with self._connection() as connection:
+            cursor = connection.execute(
+                "DELETE FROM objects WHERE bucket = ? AND key = ?", (bucket, key))
+            return cursor.rowcount == 1
+
+    def list_objects(self, bucket, prefix="", delimiter=None, max_keys=MAX_KEYS,  # pylint: disable=too-many-arguments
+                     continuation_token=None):
+        """
+        Lists the objects of a bucket in key order, S3 style.
+        Args:
+            bucket (str): The bucket to list.
+            prefix (str): Only keys starting with this prefix are listed.
+            delimiter (str): Keys whose remainder after the prefix contains the
+                delimiter are rolled up into one common prefix, up to and
+                including its first occurrence.
+            max_keys (int): The most objects plus common prefixes to return.
+            continuation_token (str): The token of the previous page.
+        Returns:
+            dict: The page's "objects" and "common_prefixes", "is_truncated" and,
+            if truncated, the "next_continuation_token".
+        """
+        max_keys = max(1, min(max_keys, MAX_KEYS))
+        start = prefix
+        if continuation_token:
+            start = max(start, _decode_token(continuation_token))
+        page = {"objects": [], "common_prefixes": [], "is_truncated": False}
+        count = 0
+        for entry, resume in self._walk(bucket, (prefix, delimiter), start, max_keys + 1):
+            if count == max_keys:
+                page["is_truncated"] = True
+                page["next_continuation_token"] = _encode_token(start)
+                break
+            page["common_prefixes" if isinstance(entry, str) else "objects"].append(entry)
+            count += 1
+            start = resume
+        return page
+
+    def _walk(self, bucket, query, start, batch):
+        """
+        Yields the objects and common prefixes of a listing in key order, each
+        with the key the listing resumes from after it.
+        """
+        prefix, delimiter = query
+        end = _prefix_end(prefix)
+        connection = self._connection()
+        while start is not None:
+            # Rows are stepped lazily, so the rest of a batch that falls under
+            # a common prefix is never read.
+            rows = self._scan(connection, bucket, (start, end), batch)
+            seen = 0
+            for row in rows:
+                seen += 1
+                key = row[0]
+                cut = key.find(delimiter, len(prefix)) if delimiter else -1
+                if cut >= 0:
+                    common_prefix = key[:cut + len(delimiter)]
+                    # Seek past every key under the common prefix.
+                    start = _prefix_end(common_prefix)
+                    yield common_prefix, start
+                    break
+                start = key + "\0"
+                yield _object(row), start
+            else:
+                if seen < batch:
+                    return
+
+    @staticmethod
+    def _scan(connection, bucket, key_range, limit):
+        start, end = key_range
+        if end is None:
+            return connection.execute(
+                "SELECT key, size, etag, mtime, sha256 FROM objects "
+                "WHERE bucket = ? AND key >= ? ORDER BY key LIMIT ?",
+                (bucket, start, limit))
+        return connection.execute(
+            "SELECT key, size, etag, mtime, sha256 FROM objects "
+            "WHERE bucket = ? AND key >= ? AND key < ? ORDER BY key LIMIT ?",
+            (bucket, start, end, limit))
+
+def _object(row):
+    key, size, etag, mtime, sha256 = row
+    return {"key": key, "size": size, "etag": etag, "mtime": mtime, "sha256": sha256}
+
+def _prefix_end(prefix):
+    """
+    Returns the smallest string greater than every string starting with prefix,
+    or None if there is none (the empty prefix).
+    """
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _encode_token(start):
+    return base64.urlsafe_b64encode(start.encode('utf-8')).decode('ascii')
+
+def _decode_token(token):
+    try:
+        start = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Invalid continuation token.") from e
+    if _encode_token(start) != token:
+        raise ValueError("Invalid continuation token.")
+    return start
@@ -5,44 +5,144 @@ This module simulates a simple Content Delivery Network (CDN) with basic functio
 such as uploading files to the origin server, replicating files to edge servers, and 
 serving files from the nearest edge server.
 
+Each edge server is a pull-through cache with its own capacity and LRU eviction: a
+request that misses the nearest edge is filled from the origin. Uploads only write the
+origin and invalidate stale edge copies unless replication is requested.
+
+Replication pre-fills all edges concurrently on a thread pool, cloning files with
+hardlinks, reflinks or copy_file_range where the filesystem allows. It can run in the
+background after the origin write, with per-edge state and lag kept for inspection.
+
 Functions:
-    upload_to_origin(file_name, content):
-        Uploads a file to the origin server and replicates it to all edge servers.
-    replicate_to_edges(file_name):
-        Replicates a file from the origin server to all edge servers.
-    serve_from_nearest_edge(file_name, user_location):
+    upload_to_origin(file_name, content, replicate=False, async_replication=False):
+        Uploads a file to the origin server and optionally replicates it to all edge servers.
+    publish_to_origin(file_name, staged, replicate=False, async_replication=False):
+        Places a file staged in the blob store on the origin server.
+    replicate_to_edges(file_name, wait=True):
+        Pre-fills a file from the origin server into all edge caches.
+    get_replication_status(file_name):
+        Returns the replication state and lag of a file on each edge server.
+    add_edge_server(name, location=None, capacity=None):
+        Adds an edge server with its own cache.
+    remove_edge_server(name):
+        Removes an edge server and deletes its cache.
+    set_edge_health(name, healthy=None, load=None):
+        Marks an edge server healthy or unhealthy and reports its load.
+    nearest_edge(user_location, coords=None):
+        Returns the available edge server closest to the user.
+    edge_file_path(file_name, user_location, coords=None):
+        Returns the nearest edge server and the path of the file on it.
+    serve_from_nearest_edge(file_name, user_location, coords=None):
         Serves a file from the nearest edge server based on the user's location.
+    get_cdn_stats():
+        Returns the usage, hit, miss and eviction counters of every edge cache.
 Constants:
     edge_servers (list): List of edge server names.
     ROOT_CDN_DIR (str): Root directory for the CDN storage.
+    REPLICATION_WORKERS (int): Number of threads copying files to edge servers.
+    DEFAULT_EDGE_CAPACITY (int): Cache size in bytes of edges not in EDGE_CAPACITIES.
+    EDGE_CAPACITIES (dict): Cache size in bytes of individual edge servers.
+    EDGE_LOCATIONS (dict): (lat, lon) of individual edge servers.
+    edge_caches (dict): The EdgeCache of each edge server.
+    router (EdgeRouter): Picks the edge server for each request.
 """
+import base64
 import os
+import re
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_all
+import blob_store
+import instrumentation
+from edge_cache import EdgeCache
+from edge_routing import EdgeRouter
+from object_cache import hot_cache
+from streaming import spool_stream
 
 edge_servers = ['edge1', 'edge2', 'edge3']
 
 ROOT_CDN_DIR = "cdn_storage"
 
+REPLICATION_WORKERS = 8
+
+_EDGE_NAME = re.compile(r"[A-Za-z0-9_-]+")
+
+DEFAULT_EDGE_CAPACITY = 256 * 1024 * 1024
+EDGE_CAPACITIES = {}
+
+EDGE_LOCATIONS = {
+    'edge1': (37.77, -122.42),
+    'edge2': (40.71, -74.01),
+    'edge3': (51.51, -0.13),
+}
+
+_replication_pool = ThreadPoolExecutor(max_workers=REPLICATION_WORKERS,
+                                       thread_name_prefix="cdn-replication")
+_replication_status = {}
+_status_lock = threading.Lock()
+# Guards changes to edge_caches and edge_servers; readers iterate over copies.
+_edges_lock = threading.Lock()
+
 if not os.path.exists(ROOT_CDN_DIR):
     os.makedirs(ROOT_CDN_DIR)
 
-def upload_to_origin(file_name, content):
+edge_caches = {server: EdgeCache(server, os.path.join(ROOT_CDN_DIR, server),
+                                 EDGE_CAPACITIES.get(server, DEFAULT_EDGE_CAPACITY))
+               for server in edge_servers}
+router = EdgeRouter({server: EDGE_LOCATIONS.get(server) for server in edge_servers})
+
+def upload_to_origin(file_name, content, replicate=False, async_replication=False):
     """
-    Uploads a file to the origin server and replicates it to all edge servers.
+    Uploads a file to the origin server. Edge copies of an older version are
+    invalidated; edges fetch the new one on their next miss unless replicate is set.
+    The content is stored once in the blob store; the origin file and the edge
+    copies cloned from it are links to the same blob.
     Args:
         file_name (str): The name of the file to upload.
-        content (str): The content of the file to upload.
+        content (file-like or bytes): The content of the file to upload.
+        replicate (bool): Pre-fill the file into all edge caches.
+        async_replication (bool): When replicating, return once the origin holds
+            the file and fill the edges in the background.
     Returns:
-        dict: A dictionary containing the result of the operation.
+        dict: A dictionary containing the result of the operation, the file size,
+        its SHA-256 checksum and whether its content was already stored.
+    """
+    staged = spool_stream(content, blob_store.STAGING_DIR)
+    instrumentation.count("cdn.bytes_written", staged[1])
+    return publish_to_origin(file_name, staged, replicate, async_replication)
+
+def publish_to_origin(file_name, staged, replicate=False, async_replication=False):
+    """
+    Places a file already written to the blob store's staging directory on the
+    origin server. Lets a web worker stream an upload to disk itself and hand
+    only the staged path to the engine process that owns the edge caches.
+    Args:
+        file_name (str): The name of the file to upload.
+        staged (tuple): The temporary path, size and SHA-256 checksum returned
+            by spool_stream.
+        replicate (bool): Pre-fill the file into all edge caches.
+        async_replication (bool): When replicating, return once the origin holds
+            the file and fill the edges in the background.
+    Returns:
+        dict: A dictionary containing the result of the operation, the file size,
+        its SHA-256 checksum and whether its content was already stored.
     """
+    tmp_path, size, checksum = staged
     origin_path = os.path.join(ROOT_CDN_DIR, 'origin')
     if not os.path.exists(origin_path):
         os.makedirs(origin_path)
     file_path = os.path.join(origin_path, file_name)
-    with open(file_path, 'wb') as f:
-        f.write(content)
-    replicate_result = replicate_to_edges(file_name)
-    return {"message": f"File {file_name} uploaded to origin. {replicate_result}"}
+    deduplicated = blob_store.store_file(tmp_path, checksum, file_path)
+    hot_cache.invalidate(file_path)
+    for cache in _edge_caches():
+        cache.invalidate(file_name)
+    if not replicate:
+        return {"message": f"File {file_name} uploaded to origin.",
+                "size": size, "sha256": checksum, "deduplicated": deduplicated}
+    replicate_result = replicate_to_edges(file_name, wait=not async_replication)
+    return {"message": f"File {file_name} uploaded to origin. {replicate_result}",
+            "size": size, "sha256": checksum, "deduplicated": deduplicated}
 
 def delete_from_origin(file_name):
     """
@@ -55,45 +155,250 @@ def delete_from_origin(file_name):
     origin_path = os.path.join(ROOT_CDN_DIR, 'origin', file_name)
     if os.path.exists(origin_path):
         os.remove(origin_path)
-        for server in edge_servers:
-            edge_path = os.path.join(ROOT_CDN_DIR, server, file_name)
-            if os.path.exists(edge_path):
-                os.remove(edge_path)
+        hot_cache.invalidate(origin_path)
+        for cache in _edge_caches():
+            cache.invalidate(file_name)
+        with _status_lock:
+            _replication_status.pop(file_name, None)
         return {"message": f"File {file_name} deleted from origin and all edge servers."}
     return {"message": f"File {file_name} not found."}
 
-def replicate_to_edges(file_name):
+def replicate_to_edges(file_name, wait=True):
     """
-    Replicates a file from the origin server to all edge servers.
+    Pre-fills a file from the origin server into all edge caches concurrently.
+    Edges whose capacity is smaller than the file are skipped.
     Args:
         file_name (str): The name of the file to replicate.
+        wait (bool): Wait for every edge to finish. If False, the copies run in
+            the background and get_replication_status reports their progress.
     Returns:
         dict: A dictionary containing the result of the operation.
     """
     origin_path = os.path.join(ROOT_CDN_DIR, 'origin', file_name)
     if not os.path.exists(origin_path):
         return {"message": "File does not exist in the origin."}
-    for server in edge_servers:
-        edge_dir = os.path.join(ROOT_CDN_DIR, server)
-        if not os.path.exists(edge_dir):
-            os.makedirs(edge_dir)
-        edge_path = os.path.join(edge_dir, file_name)
-        shutil.copy(origin_path, edge_path)
+    with _edges_lock:
+        servers = list(edge_servers)
+    queued = time.time()
+    entries = {server: {"state": "pending", "queued": queued} for server in servers}
+    with _status_lock:
+        _replication_status[file_name] = entries
+    futures = [_replication_pool.submit(_replicate_to_edge, origin_path, server, file_name,
+                                        entries[server])
+               for server in servers]
+    if not wait:
+        return {"message": f"File {file_name} queued for replication to "
+                           f"{len(servers)} edge servers."}
+    wait_all(futures)
+    failed = [server for server, entry in entries.items() if entry["state"] == "failed"]
+    if failed:
+        return {"message": f"File {file_name} could not be replicated to {', '.join(failed)}."}
     return {"message": f"File {file_name} replicated to all edge servers."}
 
-def serve_from_nearest_edge(file_name, user_location):
+def _replicate_to_edge(origin_path, server, file_name, entry):
+    cache = edge_caches.get(server)
+    try:
+        # An edge removed after the copy was queued is skipped.
+        edge_path = cache.fill(file_name, origin_path) if cache is not None else None
+    except OSError as e:
+        state = {"state": "failed", "error": str(e)}
+    else:
+        state = {"state": "done" if edge_path else "skipped"}
+    state["lag"] = round(time.time() - entry["queued"], 6)
+    with _status_lock:
+        entry.update(state)
+
+def get_replication_status(file_name):
+    """
+    Returns the replication state of a file on each edge server. The lag of a
+    finished copy is the time from queueing to completion; the lag of a pending
+    copy is the time it has been waiting so far.
+    Args:
+        file_name (str): The name of the file.
+    Returns:
+        dict: A dictionary containing the state of each edge server.
+    """
+    with _status_lock:
+        entries = _replication_status.get(file_name)
+        if entries is None:
+            return {"message": f"No replication recorded for {file_name}."}
+        now = time.time()
+        edges = {}
+        for server, entry in entries.items():
+            edge = dict(entry)
+            if edge["state"] == "pending":
+                edge["lag"] = round(now - edge["queued"], 6)
+            edges[server] = edge
+    return {"file": file_name, "edges": edges}
+
+def add_edge_server(name, location=None, capacity=None):
+    """
+    Adds an edge server with its own cache, which starts empty. Only users that
+    hash next to the new edge, or that are closer to it, move to it.
+    Args:
+        name (str): The name of the edge server.
+        location (tuple): The (lat, lon) of the edge server, if known.
+        capacity (int): The cache size in bytes. Defaults to DEFAULT_EDGE_CAPACITY.
+    Returns:
+        dict: A dictionary containing the result of the operation, or an error
+        if the name is not made of letters, digits, "_" and "-", or the location
+        or capacity is invalid.
+    """
+    if not _EDGE_NAME.fullmatch(name):
+        return {"error": f"Invalid edge server name {name!r}."}
+    if location is not None:
+        try:
+            lat, lon = (float(value) for value in location)
+        except (TypeError, ValueError):
+            lat = lon = None
+        if lat is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return {"error": f"Invalid location {location!r}, expected a latitude and "
+                             "longitude in degrees."}
+        location = (lat, lon)
+    if capacity is not None:
+        if not isinstance(capacity, int) or isinstance(capacity, bool) or capacity <= 0:
+            return {"error": f"Invalid capacity {capacity!r}, expected a positive number "
+                             "of bytes."}
+    root = os.path.realpath(ROOT_CDN_DIR)
+    directory = os.path.join(ROOT_CDN_DIR, name)
+    # The edge cache evicts whatever it finds in its directory.
+    if os.path.dirname(os.path.realpath(directory)) != root:
+        return {"error": f"Invalid edge server name {name!r}."}
+    with _edges_lock:
+        if name in edge_caches or name == 'origin':
+            return {"message": f"Edge server {name} already exists."}
+        # Files left by an earlier edge of this name missed its invalidations.
+        shutil.rmtree(directory, ignore_errors=True)
+        edge_caches[name] = EdgeCache(name, directory, capacity or DEFAULT_EDGE_CAPACITY)
+        edge_servers.append(name)
+        router.add_edge(name, location)
+    return {"message": f"Edge server {name} added."}
+
+def remove_edge_server(name):
+    """
+    Removes an edge server and deletes its cached files. Its users fail over to
+    their next-nearest edge.
+    Args:
+        name (str): The name of the edge server.
+    Returns:
+        dict: A dictionary containing the result of the operation.
+    """
+    with _edges_lock:
+        cache = edge_caches.pop(name, None)
+        if cache is None:
+            return {"message": f"Edge server {name} not found."}
+        router.remove_edge(name)
+        edge_servers.remove(name)
+    shutil.rmtree(cache.directory, ignore_errors=True)
+    return {"message": f"Edge server {name} removed."}
+
+def set_edge_health(name, healthy=None, load=None):
+    """
+    Marks an edge server healthy or unhealthy and reports its load. Unhealthy
+    edges and edges at or above the overload threshold receive no new requests.
+    Args:
+        name (str): The name of the edge server.
+        healthy (bool): Whether the edge can serve requests.
+        load (float): The edge's utilization, from 0 to 1.
+    Returns:
+        dict: A dictionary containing the result of the operation, or an error
+        if the load is not a number.
+    """
+    if load is not None:
+        try:
+            load = float(load)
+        except (TypeError, ValueError):
+            return {"error": f"Invalid load {load!r}."}
+    if not router.set_health(name, healthy, load):
+        return {"message": f"Edge server {name} not found."}
+    return {"message": f"Edge server {name} updated.", "edges": router.status()}
+
+def nearest_edge(user_location, coords=None):
+    """
+    Returns the available edge server closest to the user. With coordinates the
+    nearest healthy edge by distance is chosen; otherwise the user's location
+    number is placed on a consistent-hash ring.
+    Args:
+        user_location (int): The location of the user.
+        coords (tuple): The (lat, lon) of the user, if known.
+    Returns:
+        str: The name of the edge server, or None if no edge is available.
+    """
+    return router.route(user_location, coords)
+
+def edge_file_path(file_name, user_location, coords=None):
+    """
+    Returns the nearest edge server and the path of the file on it. On a cache
+    miss the edge is filled from the origin first. Files larger than the edge's
+    capacity or replaced while the edge was filled, and requests made while no
+    edge is available, are served straight from the origin.
+    Args:
+        file_name (str): The name of the file.
+        user_location (int): The location of the user.
+        coords (tuple): The (lat, lon) of the user, if known.
+    Returns:
+        tuple: The name of the server the file is served from and the file path,
+        or None if the file is not on the origin either.
+    """
+    origin_path = os.path.join(ROOT_CDN_DIR, 'origin', file_name)
+    server = nearest_edge(user_location, coords)
+    cache = edge_caches.get(server)
+    if cache is None:
+        return 'origin', origin_path if os.path.isfile(origin_path) else None
+    edge_path = cache.lookup(file_name)
+    if edge_path is not None:
+        return server, edge_path
+    try:
+        edge_path = cache.fill(file_name, origin_path)
+    except FileNotFoundError:
+        return server, None
+    if edge_path is None:
+        return 'origin', origin_path
+    return server, edge_path
+
+def serve_from_nearest_edge(file_name, user_location, coords=None):
     """
     Serves a file from the nearest edge server based on the user's location.
+    Small files are read through the in-memory hot object cache. Text files are
+    returned as they are; other files are returned base64-encoded.
     Args:
         file_name (str): The name of the file to serve.
         user_location (int): The location of the user.
+        coords (tuple): The (lat, lon) of the user, if known.
     Returns:
         dict: A dictionary containing the content of the file and the server it was served from.
     """
-    nearest_server = edge_servers[user_location % len(edge_servers)]
-    edge_path = os.path.join(ROOT_CDN_DIR, nearest_server, file_name)
-    if os.path.exists(edge_path):
-        with open(edge_path, 'r', encoding='utf-8') as f:
-            return {"content": f.read(), "server": nearest_server}
-    else:
+    nearest_server, edge_path = edge_file_path(file_name, user_location, coords)
+    if edge_path is None:
         return {"message": f"File {file_name} not found."}
+    cached = hot_cache.load(edge_path)
+    if cached is not None:
+        data = cached[0]
+    else:
+        with open(edge_path, 'rb') as f:
+            data = f.read()
+        instrumentation.count("cdn.bytes_read", len(data))
+    try:
+        return {"content": data.decode('utf-8'), "server": nearest_server}
+    except UnicodeDecodeError:
+        return {"content": base64.b64encode(data).decode('ascii'), "encoding": "base64",
+                "server": nearest_server}
+
+def _edge_caches():
+    with _edges_lock:
+        return list(edge_caches.values())
+
+def get_cdn_stats():
+    """
+    Returns the usage, hit, miss and eviction counters of every edge cache.
+    Returns:
+        dict: A dictionary with the statistics of each edge server, the overall
+        hit ratio and the statistics of the in-memory hot object cache.
+    """
+    with _edges_lock:
+        caches = list(edge_caches.items())
+    edges = {server: cache.stats() for server, cache in caches}
+    hits = sum(edge["hits"] for edge in edges.values())
+    lookups = hits + sum(edge["misses"] for edge in edges.values())
+    return {"edges": edges, "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "hot_cache": hot_cache.stats()}
@@ -0,0 +1,169 @@
+"""
+Edge Cache Module
+
+This module turns a CDN edge server directory into a size-bounded cache. Each
+edge keeps an LRU index of the files it holds; filling a file evicts the least
+recently used ones until the new file fits, and hit, miss and eviction counters
+are kept for sizing edges and measuring hit ratio.
+
+Classes:
+    EdgeCache: LRU index over the files of one edge server directory.
+"""
+
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict
+import instrumentation
+from object_cache import hot_cache
+from streaming import clone_file
+
+class EdgeCache:  # pylint: disable=too-many-instance-attributes
+    """
+    LRU index over the files of one edge server directory, bounded by total size.
+    """
+
+    def __init__(self, name, directory, capacity):
+        self.name = name
+        self.directory = directory
+        self.capacity = capacity
+        self.counters = Counter(hits=0, misses=0, evictions=0, fills=0)
+        self._entries = OrderedDict()
+        self._size = 0
+        # Fills in progress per file name, and invalidations seen while they run.
+        self._filling = Counter()
+        self._generations = Counter()
+        self._lock = threading.Lock()
+        self._load()
+
+    def lookup(self, file_name):
+        """
+        Looks a file up and marks it most recently used.
+        Args:
+            file_name (str): The name of the file.
+        Returns:
+            str: The path of the cached file, or None on a miss.
+        """
+        with self._lock:
+            if file_name in self._entries:
+                self._entries.move_to_end(file_name)
+                self.counters["hits"] += 1
+                return os.path.join(self.directory, file_name)
+            self.counters["misses"] += 1
+            return None
+
+    def fill(self, file_name, origin_path):
+        """
+        Copies a file from the origin into the cache, evicting least recently
+        used files until it fits. The copy is made outside the lock, so lookups
+        and other fills are not held up by it; if the file is invalidated while
+        it is copied, the copy is dropped rather than cached.
+        Args:
+            file_name (str): The name of the file.
+            origin_path (str): The path of the file on the origin server.
+        Returns:
+            str: The path of the cached file, or None if the file is larger than
+            the cache or was invalidated during the copy.
+        """
+        if os.path.getsize(origin_path) > self.capacity:
+            return None
+        path = os.path.join(self.directory, file_name)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f".fill-{uuid.uuid4().hex}")
+        with self._lock:
+            self._filling[file_name] += 1
+            generation = self._generations[file_name]
+        installed = False
+        try:
+            clone_file(origin_path, tmp_path)
+            size = os.stat(tmp_path).st_size
+            with self._lock:
+                if self._generations[file_name] == generation and size <= self.capacity:
+                    self._size -= self._entries.pop(file_name, 0)
+                    self._evict(self.capacity - size)
+                    os.replace(tmp_path, path)
+                    hot_cache.invalidate(path)
+                    self._entries[file_name] = size
+                    self._size += size
+                    self.counters["fills"] += 1
+                    installed = True
+        finally:
+            with self._lock:
+                self._filling[file_name] -= 1
+                if not self._filling[file_name]:
+                    del self._filling[file_name]
+                    self._generations.pop(file_name, None)
+            if not installed:
+                _remove(tmp_path)
+        if not installed:
+            return None
+        instrumentation.count("cdn.fill_bytes", size)
+        return path
+
+    def invalidate(self, file_name):
+        """
+        Drops a file from the cache.
+        Args:
+            file_name (str): The name of the file.
+        Returns:
+            bool: True if the file was cached.
+        """
+        with self._lock:
+            if file_name in self._filling:
+                self._generations[file_name] += 1
+            size = self._entries.pop(file_name, None)
+            if size is None:
+                return False
+            self._size -= size
+            _remove(os.path.join(self.directory, file_name))
+            return True
+
+    def stats(self):
+        """
+        Returns the cache's usage and counters.
+        Returns:
+            dict: Capacity, bytes used, file count, counters and hit ratio.
+        """
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "capacity": self.capacity,
+                "used": self._size,
+                "files": len(self._entries),
+                **self.counters,
+                "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            }
+
+    def _load(self):
+        """
+        Indexes files already on disk, least recently accessed first, and
+        evicts the least recently accessed ones if they exceed the capacity.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                files.append((stat.st_atime, entry.name, stat.st_size))
+        for _, file_name, size in sorted(files):
+            self._entries[file_name] = size
+            self._size += size
+        self._evict(self.capacity)
+
+    def _evict(self, limit):
+        """
+        Evicts least recently used files until at most `limit` bytes are cached.
+        """
+        while self._entries and self._size > limit:
+            victim, victim_size = self._entries.popitem(last=False)
+            self._size -= victim_size
+            self.counters["evictions"] += 1
+            _remove(os.path.join(self.directory, victim))
+
+def _remove(path):
+    hot_cache.invalidate(path)
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,238 @@
+"""
+Edge Routing Module
+
+This module picks the CDN edge server that should serve a user. Users with
+coordinates go to the nearest edge by great-circle distance, found through a
+k-d tree over the edges' positions on the unit sphere. Users identified only by
+a location number are placed on a consistent-hash ring, so adding or removing an
+edge only remaps the users that hashed next to it. Either way, edges that are
+unhealthy or overloaded are skipped and the next-nearest edge is used.
+
+Classes:
+    KDTree: Nearest-neighbour index over 3D points with a filter for skipped points.
+    HashRing: Consistent-hash ring with virtual nodes.
+    EdgeRouter: Health- and load-aware routing over both indexes.
+
+Global Variables:
+    VIRTUAL_NODES (int): Ring positions per edge server.
+    OVERLOAD_THRESHOLD (float): Load at or above which an edge is skipped.
+"""
+
+import bisect
+import hashlib
+import math
+import threading
+
+VIRTUAL_NODES = 64
+OVERLOAD_THRESHOLD = 0.9
+
+def to_unit_vector(lat, lon):
+    """
+    Converts a latitude and longitude in degrees to a point on the unit sphere.
+    Straight-line distance between such points grows with great-circle distance.
+    """
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+class KDTree:  # pylint: disable=too-few-public-methods
+    """
+    Nearest-neighbour index over 3D points.
+    """
+
+    def __init__(self, points):
+        """
+        Args:
+            points (dict): Maps each name to its (x, y, z) point.
+        """
+        self._root = self._build(list(points.items()), 0)
+
+    def _build(self, items, depth):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda item: item[1][axis])
+        middle = len(items) // 2
+        return (items[middle], axis, self._build(items[:middle], depth + 1),
+                self._build(items[middle + 1:], depth + 1))
+
+    def nearest(self, point, accept=lambda name: True):
+        """
+        Finds the nearest accepted point.
+        Args:
+            point (tuple): The (x, y, z) query point.
+            accept (callable): Returns False for names that must be skipped.
+        Returns:
+            str: The name of the nearest accepted point, or None.
+        """
+        best = [None, math.inf]
+        self._search(self._root, point, accept, best)
+        return best[0]
+
+    def _search(self, node, point, accept, best):
+        if node is None:
+            return
+        (name, position), axis, left, right = node
+        distance = sum((a - b) ** 2 for a, b in zip(point, position))
+        if distance < best[1] and accept(name):
+            best[0], best[1] = name, distance
+        delta = point[axis] - position[axis]
+        near, far = (left, right) if delta < 0 else (right, left)
+        self._search(near, point, accept, best)
+        if delta * delta < best[1]:
+            self._search(far, point, accept, best)
+
+class HashRing:
+    """
+    Consistent-hash ring with virtual nodes.
+    """
+
+    def __init__(self, vnodes=VIRTUAL_NODES):
+        self.vnodes = vnodes
+        self._hashes = []
+        self._names = []
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, name):
+        """
+        Places a name on the ring at vnodes positions.
+        """
+        for replica in range(self.vnodes):
+            position = self._hash(f"{name}#{replica}")
+            index = bisect.bisect(self._hashes, position)
+            self._hashes.insert(index, position)
+            self._names.insert(index, name)
+
+    def remove(self, name):
+        """
+        Removes every ring position of a name.
+        """
+        keep = [i for i, owner in enumerate(self._names) if owner != name]
+        self._hashes = [self._hashes[i] for i in keep]
+        self._names = [self._names[i] for i in keep]
+
+    def lookup(self, key, accept=lambda name: True):
+        """
+        Finds the first accepted name clockwise from the key's position.
+        Args:
+            key: The key to place on the ring.
+            accept (callable): Returns False for names that must be skipped.
+        Returns:
+            str: The owning name, or None if no name is accepted.
+        """
+        if not self._hashes:
+            return None
+        start = bisect.bisect(self._hashes, self._hash(key))
+        tried = set()
+        for offset in range(len(self._names)):
+            name = self._names[(start + offset) % len(self._names)]
+            if name in tried:
+                continue
+            if accept(name):
+                return name
+            tried.add(name)
+        return None
+
+class EdgeRouter:
+    """
+    Routes users to edge servers by distance or consistent hashing, skipping
+    edges that are marked unhealthy or whose load reaches OVERLOAD_THRESHOLD.
+    """
+
+    def __init__(self, locations, vnodes=VIRTUAL_NODES):
+        """
+        Args:
+            locations (dict): Maps each edge server to its (lat, lon), or None if
+                its position is unknown.
+            vnodes (int): Ring positions per edge server.
+        """
+        self._locations = {}
+        self._state = {}
+        self._ring = HashRing(vnodes)
+        self._tree = KDTree({})
+        self._lock = threading.Lock()
+        for name, location in locations.items():
+            self.add_edge(name, location)
+
+    def add_edge(self, name, location=None):
+        """
+        Adds an edge server.
+        Args:
+            name (str): The edge server name.
+            location (tuple): Its (lat, lon), or None if unknown.
+        """
+        with self._lock:
+            if name in self._state:
+                self._ring.remove(name)
+            self._state[name] = {"healthy": True, "load": 0.0}
+            self._locations[name] = location
+            self._ring.add(name)
+            self._rebuild()
+
+    def remove_edge(self, name):
+        """
+        Removes an edge server.
+        Args:
+            name (str): The edge server name.
+        """
+        with self._lock:
+            self._state.pop(name, None)
+            self._locations.pop(name, None)
+            self._ring.remove(name)
+            self._rebuild()
+
+    def set_health(self, name, healthy=None, load=None):
+        """
+        Updates the health flag and/or load of an edge server.
+        Args:
+            name (str): The edge server name.
+            healthy (bool): Whether the edge can serve requests.
+            load (float): The edge's utilization, from 0 to 1.
+        Returns:
+            bool: False if the edge is unknown.
+        """
+        state = self._state.get(name)
+        if state is None:
+            return False
+        if healthy is not None:
+            state["healthy"] = bool(healthy)
+        if load is not None:
+            state["load"] = float(load)
+        return True
+
+    def status(self):
+        """
+        Returns each edge's location, health flag and load.
+        """
+        return {name: {"location": self._locations[name], **state}
+                for name, state in self._state.items()}
+
+    def available(self, name):
+        """
+        Returns True if the edge is healthy and not overloaded.
+        """
+        state = self._state.get(name)
+        return state is not None and state["healthy"] and state["load"] < OVERLOAD_THRESHOLD
+
+    def route(self, user_location=None, coords=None):
+        """
+        Picks the edge server for a user.
+        Args:
+            user_location (int): The user's location number, used for consistent
+                hashing when no coordinates are given.
+            coords (tuple): The user's (lat, lon), if known.
+        Returns:
+            str: The edge server name, or None if no edge is available.
+        """
+        if coords is not None:
+            name = self._tree.nearest(to_unit_vector(*coords), self.available)
+            if name is not None:
+                return name
+        return self._ring.lookup(user_location, self.available)
+
+    def _rebuild(self):
+        self._tree = KDTree({name: to_unit_vector(*location)
+                             for name, location in self._locations.items()
+                             if location is not None})
@@ -0,0 +1,435 @@
+"""
+Engine Module
+
+This module runs the stateful part of the simulator in a single engine process, so
+that the web app can be served by several worker processes. The engine owns the
+VM table and everything that keeps state in memory: the VM scheduler, networks,
+VPCs, metrics store, autoscaler and CDN edge caches. Workers call it through a
+multiprocessing manager proxy, one round trip per operation, and read VM records
+straight from the shared-memory table without any round trip. Storage needs no
+engine: buckets, blobs and the catalog live on disk and in SQLite, which every
+worker can use directly.
+
+When CLOUD_SIM_STATE_DIR names a directory, the engine journals VM and network
+changes there and recovers them when it starts again; see persistence. When
+CLOUD_SIM_VM_BACKEND is process or cgroup, the workloads of VMs run in processes
+or cgroups of their own instead of on the pooled scheduler; see vm_backends.
+
+Classes:
+    Engine: The VM, autoscaling, metrics and CDN operations of the simulator.
+    EngineManager: Multiprocessing manager that serves the engine.
+    RoundTripCounter: Counts the calls made through an engine proxy.
+
+Functions:
+    serve_engine(address, authkey): Runs the engine in this process.
+    start_engine(authkey=None, timeout=STARTUP_TIMEOUT): Starts the engine process.
+    stop_engine(process): Stops the engine process.
+    connect_engine(address, authkey): Connects to a running engine process.
+
+Global Variables:
+    ENGINE_ADDRESS_ENV (str): Environment variable holding the engine's address.
+    ENGINE_AUTHKEY_ENV (str): Environment variable holding the engine's hex authkey.
+    STARTUP_TIMEOUT (float): Seconds start_engine waits for the engine to listen.
+"""
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing.managers import BaseManager
+import cdn
+import instrumentation
+import vpc
+from autoscaler import Autoscaler, ScalingGroup, VMExecutor, policy_from_dict
+from persistence import STATE_DIR_ENV, journal
+from vm_backends import VM_BACKEND_ENV
+from vm_simulator import (start_vm, stop_vm, delete_vm, start_vms, stop_vms, delete_vms,
+                          get_backend, metrics_store, restore_state, use_backend)
+from vm_table import DEFAULT_CAPACITY, VMTable
+
+ENGINE_ADDRESS_ENV = "CLOUD_SIM_ENGINE_ADDRESS"
+ENGINE_AUTHKEY_ENV = "CLOUD_SIM_ENGINE_AUTHKEY"
+STARTUP_TIMEOUT = 30.0
+
+_engine = {}
+
+class Engine:  # pylint: disable=too-many-public-methods
+    """
+    The VM, autoscaling, metrics and CDN operations, bound to the VM table the
+    engine owns. Every method takes and returns plain values so it can be called
+    through a proxy.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, state_dir=None, backend=None):
+        """
+        Args:
+            capacity (int): The number of VMs the VM table can hold.
+            state_dir (str): The directory the VM and network state is journaled
+                to and recovered from on start, or None to keep it in memory only.
+            backend (str): The VM backend, see vm_simulator.use_backend, or None
+                to keep the current one.
+        Raises:
+            ValueError: If the backend is unknown.
+            RuntimeError: If the backend is unavailable or another process has
+                the state directory open.
+        """
+        if backend:
+            use_backend(backend)
+        self.table = VMTable(capacity=capacity)
+        self.autoscaler = Autoscaler()
+        self.recovery = None
+        if state_dir:
+            try:
+                self.recovery = restore_state(self.table, state_dir)
+            except RuntimeError:
+                self.table.close()
+                raise
+
+    def table_name(self):
+        """
+        Returns the name other processes attach to the VM table by.
+        """
+        return self.table.name
+
+    def close(self):
+        """
+        Writes a final snapshot of the state, if it is journaled, stops the
+        workloads of the VMs and removes the VM table.
+        """
+        journal.close()
+        get_backend().close()
+        self.table.close()
+
+    def start_vm(self, vm_id):
+        """
+        Starts a VM. See vm_simulator.start_vm.
+        """
+        return start_vm(vm_id, self.table)
+
+    def stop_vm(self, vm_id):
+        """
+        Stops a VM. See vm_simulator.stop_vm.
+        """
+        return stop_vm(vm_id, self.table)
+
+    def delete_vm(self, vm_id):
+        """
+        Deletes a VM. See vm_simulator.delete_vm.
+        """
+        return delete_vm(vm_id, self.table)
+
+    def start_vms(self, vm_ids):
+        """
+        Starts a batch of VMs. See vm_simulator.start_vms.
+        """
+        return start_vms(vm_ids, self.table)
+
+    def stop_vms(self, vm_ids):
+        """
+        Stops a batch of VMs. See vm_simulator.stop_vms.
+        """
+        return stop_vms(vm_ids, self.table)
+
+    def delete_vms(self, vm_ids):
+        """
+        Deletes a batch of VMs. See vm_simulator.delete_vms.
+        """
+        return delete_vms(vm_ids, self.table)
+
+    def query_metrics(self, vm_id=None, start=None, end=None, resolution=None):
+        """
+        Queries the metrics store. See MetricsStore.query.
+        """
+        return metrics_store.query(vm_id, start, end, resolution)
+
+    def create_scaling_group(self, name, first_vm_id, limits, policy):
+        """
+        Creates or replaces a scaling group and starts evaluating it.
+        Args:
+            name (str): The name of the group.
+            first_vm_id (int): The first VM ID of the group.
+            limits (tuple): The min_size, max_size and initial desired size.
+            policy (dict): The policy description, see policy_from_dict.
+        Returns:
+            dict: The group's status.
+        Raises:
+            ValueError: If the limits or policy are invalid or the VM IDs overlap
+                another group's.
+        """
+        group = ScalingGroup(name, first_vm_id, limits, policy_from_dict(policy))
+        self.autoscaler.attach(VMExecutor(self.table))
+        self.autoscaler.add_group(group)
+        return group.status()
+
+    def remove_scaling_group(self, name):
+        """
+        Removes a scaling group and stops its VMs. See Autoscaler.remove_group.
+        """
+        return self.autoscaler.remove_group(name)
+
+    def scaling_groups(self):
+        """
+        Returns the status of every scaling group.
+        """
+        return self.autoscaler.status()
+
+    def create_vpc(self, name, cidr=vpc.DEFAULT_CIDR):
+        """
+        Creates a VPC. See vpc.create_vpc.
+        Returns:
+            dict: The VPC's status.
+        """
+        return vpc.create_vpc(name, cidr).status()
+
+    def delete_vpc(self, name):
+        """
+        Deletes a VPC. See vpc.delete_vpc.
+        """
+        return vpc.delete_vpc(name)
+
+    def vpc_status(self, name=None):
+        """
+        Returns the status of a VPC, or of every VPC if no name is given.
+        Raises:
+            KeyError: If the VPC does not exist.
+        """
+        if name is None:
+            return vpc.list_vpcs()
+        with vpc.registry_lock:
+            return vpc.get_vpc(name).status()
+
+    def update_vpc(self, name, operation, *args):
+        """
+        Applies one change to a VPC: add_subnet, remove_subnet,
+        set_security_group, remove_security_group or set_firewall. See VPC.
+        Args:
+            name (str): The name of the VPC.
+            operation (str): The VPC method to call.
+            *args: Its arguments.
+        Returns:
+            dict: The VPC's status after the change.
+        Raises:
+            KeyError: If the VPC or the subnet or group to remove does not exist.
+            ValueError: If the operation or its arguments are invalid.
+        """
+        if operation not in ("add_subnet", "remove_subnet", "set_security_group",
+                             "remove_security_group", "set_firewall"):
+            raise ValueError(f"Unknown VPC operation {operation}.")
+        with vpc.registry_lock:
+            target = vpc.get_vpc(name)
+            getattr(target, operation)(*args)
+            return target.status()
+
+    def attach_to_vpc(self, name, vm_id, subnet, groups=None):
+        """
+        Attaches a VM in the table to a VPC. See vpc.attach_to_vpc.
+        Raises:
+            KeyError: If the VM, VPC, subnet or a group does not exist.
+            ValueError: If the subnet is full.
+        """
+        if vm_id not in self.table:
+            raise KeyError(f"VM {vm_id}")
+        return vpc.attach_to_vpc(name, vm_id, subnet, groups)
+
+    def detach_from_vpc(self, name, vm_id):
+        """
+        Detaches a VM from a VPC.
+        Returns:
+            bool: False if the VM is not attached to that VPC.
+        """
+        with vpc.registry_lock:
+            return vpc.vm_vpcs.get(vm_id) == name and vpc.detach_from_vpc(vm_id)
+
+    def check_flow(self, source_vm, destination_vm, protocol, port=0):
+        """
+        Decides whether a VM may open a flow to another. Flows from or to a
+        VM that is not running are not allowed. See vpc.check_flow.
+        """
+        for vm_id in (source_vm, destination_vm):
+            vm = self.table.get(vm_id)
+            if vm is None or vm["status"] != "running":
+                return {"allowed": False, "reason": f"VM {vm_id} is not running"}
+        return vpc.check_flow(source_vm, destination_vm, protocol, port)
+
+    def publish_to_origin(self, file_name, staged, replicate=False, async_replication=False):
+        """
+        Places a staged file on the CDN origin. See cdn.publish_to_origin.
+        """
+        return cdn.publish_to_origin(file_name, staged, replicate, async_replication)
+
+    def delete_from_origin(self, file_name):
+        """
+        Deletes a file from the CDN. See cdn.delete_from_origin.
+        """
+        return cdn.delete_from_origin(file_name)
+
+    def edge_file_path(self, file_name, user_location, coords=None):
+        """
+        Returns the nearest edge and the file's path on it. See cdn.edge_file_path.
+        """
+        return cdn.edge_file_path(file_name, user_location, coords)
+
+    def serve_from_nearest_edge(self, file_name, user_location, coords=None):
+        """
+        Serves a file from the nearest edge. See cdn.serve_from_nearest_edge.
+        """
+        return cdn.serve_from_nearest_edge(file_name, user_location, coords)
+
+    def replication_status(self, file_name):
+        """
+        Returns the replication state of a file. See cdn.get_replication_status.
+        """
+        return cdn.get_replication_status(file_name)
+
+    def cdn_stats(self):
+        """
+        Returns the edge cache counters. See cdn.get_cdn_stats.
+        """
+        return cdn.get_cdn_stats()
+
+    def add_edge_server(self, name, location=None, capacity=None):
+        """
+        Adds an edge server. See cdn.add_edge_server.
+        """
+        return cdn.add_edge_server(name, location, capacity)
+
+    def remove_edge_server(self, name):
+        """
+        Removes an edge server. See cdn.remove_edge_server.
+        """
+        return cdn.remove_edge_server(name)
+
+    def set_edge_health(self, name, healthy=None, load=None):
+        """
+        Reports the health and load of an edge server. See cdn.set_edge_health.
+        """
+        return cdn.set_edge_health(name, healthy, load)
+
+    def instrumentation_snapshot(self):
+        """
+        Returns the histograms and counters of the engine process. See
+        instrumentation.snapshot.
+        """
+        return instrumentation.snapshot()
+
+    def profile(self, seconds, interval=instrumentation.SAMPLE_INTERVAL):
+        """
+        Profiles the engine process. See instrumentation.sample_stacks.
+        """
+        return instrumentation.sample_stacks(seconds, interval)
+
+class RoundTripCounter:  # pylint: disable=too-few-public-methods
+    """
+    Wraps an engine proxy and counts every call made through it in the
+    "engine.round_trips" counter.
+    """
+
+    def __init__(self, proxy):
+        self._proxy = proxy
+
+    def __getattr__(self, name):
+        method = getattr(self._proxy, name)
+        def call(*args, **kwargs):
+            instrumentation.count("engine.round_trips")
+            return method(*args, **kwargs)
+        return call
+
+def _get_engine():
+    """
+    Returns the engine of this process, creating it on first use.
+    """
+    if "engine" not in _engine:
+        _engine["engine"] = Engine(state_dir=os.environ.get(STATE_DIR_ENV) or None,
+                                   backend=os.environ.get(VM_BACKEND_ENV) or None)
+    return _engine["engine"]
+
+class EngineManager(BaseManager):
+    """
+    Multiprocessing manager whose engine() returns a proxy to the one Engine of
+    the manager's process.
+    """
+
+EngineManager.register("engine", callable=_get_engine)
+
+def serve_engine(address, authkey):
+    """
+    Runs the engine in this process until it receives SIGTERM or SIGINT, then
+    removes its VM table.
+    Args:
+        address (str): The Unix socket to listen on.
+        authkey (bytes): The key clients must know.
+    """
+    engine = _get_engine()
+    def stop(signum, frame):
+        del signum, frame
+        engine.close()
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    EngineManager(address, authkey).get_server().serve_forever()
+
+def start_engine(authkey=None, timeout=STARTUP_TIMEOUT):
+    """
+    Starts the engine in a new process and waits until it accepts connections.
+    The engine's address and authkey are exported to the environment so that
+    worker processes forked afterwards find it.
+    Args:
+        authkey (bytes): The key clients must know. Defaults to a random key.
+        timeout (float): Seconds to wait for the engine to start.
+    Returns:
+        subprocess.Popen: The engine process.
+    Raises:
+        RuntimeError: If the engine does not start in time.
+    """
+    authkey = authkey or os.urandom(32)
+    address = os.path.join(tempfile.mkdtemp(prefix="cloud-sim-"), "engine.sock")
+    os.environ[ENGINE_ADDRESS_ENV] = address
+    os.environ[ENGINE_AUTHKEY_ENV] = authkey.hex()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.path.dirname(os.path.abspath(__file__)), env.get("PYTHONPATH")]))
+    process = subprocess.Popen([sys.executable, "-m", "engine"], env=env)  # pylint: disable=consider-using-with
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            EngineManager(address, authkey).connect()
+            return process
+        except OSError as e:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("The engine process did not start.") from e
+            time.sleep(0.05)
+
+def stop_engine(process):
+    """
+    Stops the engine process, which removes its VM table.
+    Args:
+        process (subprocess.Popen): The process returned by start_engine.
+    """
+    process.terminate()
+    process.wait()
+    shutil.rmtree(os.path.dirname(os.environ[ENGINE_ADDRESS_ENV]), ignore_errors=True)
+
+def connect_engine(address, authkey):
+    """
+    Connects to a running engine.
+    Args:
+        address (str): The engine's address.
+        authkey (bytes): The engine's authkey.
+    Returns:
+        tuple: A proxy to the engine, wrapped in a RoundTripCounter when
+        instrumentation is on, and the VM table attached for reading.
+    """
+    manager = EngineManager(address, authkey)
+    manager.connect()
+    engine = manager.engine()  # pylint: disable=no-member
+    table = VMTable(engine.table_name(), create=False)
+    if instrumentation.enabled():
+        engine = RoundTripCounter(engine)
+    return engine, table
+
+if __name__ == "__main__":
+    serve_engine(os.environ[ENGINE_ADDRESS_ENV], bytes.fromhex(os.environ[ENGINE_AUTHKEY_ENV]))
@@ -0,0 +1,287 @@
+"""
+Firewall Module
+
+This module decides whether flows between addresses are allowed. A rule matches
+a protocol, a source CIDR, a destination CIDR and a range of destination ports,
+and either allows or denies the flow. Within a rule set the matching rule with
+the lowest priority number wins, and the rule set's default action applies when
+no rule matches.
+
+Rule sets are compiled so that a decision does not scan every rule. Rules are
+numbered in priority order and each dimension maps a flow to the bitmask of
+rules it satisfies: a prefix trie for each of the source and destination
+addresses, an interval table for the port and a table for the protocol. The
+rules a flow matches are the AND of the four masks, and the winning rule is the
+lowest set bit. The trie is stored level by level, one dictionary per prefix
+length in use from prefix to rule mask, so a lookup visits only the lengths the
+rules actually use instead of walking 32 single-bit nodes. The interval table
+splits the port range at every rule boundary and keeps the mask of each piece,
+so a port is resolved with one bisect.
+
+Classes:
+    Rule: One allow or deny rule.
+    PrefixTrie: Maps an address to the rules whose CIDR contains it.
+    IntervalTable: Maps a port to the rules whose port range contains it.
+    RuleSet: A compiled, prioritized list of rules.
+
+Functions:
+    parse_ports(ports): Parses a port or port range.
+    parse_rule(spec): Builds a rule from its JSON description.
+
+Global Variables:
+    PROTOCOLS (tuple): The protocols a flow can use.
+    ACTIONS (tuple): The actions a rule can take.
+    MAX_PORT (int): The highest port number.
+"""
+
+import bisect
+import ipaddress
+from ip_assignment import ip_to_int
+
+PROTOCOLS = ("tcp", "udp", "icmp")
+ACTIONS = ("allow", "deny")
+MAX_PORT = 65535
+
+class Rule:
+    """
+    One rule: flows of the protocol from the source to the destination CIDR on
+    a destination port in the range are allowed or denied.
+    """
+    __slots__ = ("priority", "action", "protocol", "source", "destination", "ports")
+
+    def __init__(self, action="allow", protocol="any", source="0.0.0.0/0",  # pylint: disable=too-many-arguments
+                 destination="0.0.0.0/0", *, ports=(0, MAX_PORT), priority=100):
+        """
+        Args:
+            action (str): "allow" or "deny".
+            protocol (str): One of PROTOCOLS, or "any".
+            source (str): The CIDR of the source addresses.
+            destination (str): The CIDR of the destination addresses.
+            ports (tuple): The first and last destination port.
+            priority (int): Rules with lower numbers are matched first.
+        Raises:
+            ValueError: If a field is invalid.
+        """
+        if action not in ACTIONS:
+            raise ValueError("The action must be allow or deny.")
+        if protocol != "any" and protocol not in PROTOCOLS:
+            raise ValueError(f"The protocol must be any or one of {', '.join(PROTOCOLS)}.")
+        first, last = ports
+        if not 0 <= first <= last <= MAX_PORT:
+            raise ValueError(f"Invalid port range {first}-{last}.")
+        self.priority = int(priority)
+        self.action = action
+        self.protocol = protocol
+        self.source = ipaddress.IPv4Network(source)
+        self.destination = ipaddress.IPv4Network(destination)
+        self.ports = (first, last)
+
+    def matches(self, source, destination, protocol, port):
+        """
+        Returns True if the rule matches the flow, checking every field. Used as
+        the reference the compiled matcher is measured against.
+        Args:
+            source (int): The source address.
+            destination (int): The destination address.
+            protocol (str): The protocol of the flow.
+            port (int): The destination port.
+        """
+        return (self.protocol in ("any", protocol)
+                and self.ports[0] <= port <= self.ports[1]
+                and _contains(self.source, source)
+                and _contains(self.destination, destination))
+
+    def to_dict(self):
+        """
+        Returns the JSON description of the rule.
+        """
+        return {"priority": self.priority, "action": self.action, "protocol": self.protocol,
+                "source": str(self.source), "destination": str(self.destination),
+                "ports": list(self.ports)}
+
+def _contains(network, address):
+    return address >> (32 - network.prefixlen) == \
+        int(network.network_address) >> (32 - network.prefixlen)
+
+def parse_ports(ports):
+    """
+    Parses a port or port range: 80, "80", "1024-65535" or [1024, 65535].
+    Args:
+        ports: The port or range, or None for every port.
+    Returns:
+        tuple: The first and last port.
+    Raises:
+        ValueError: If the ports are invalid.
+    """
+    if ports is None:
+        return (0, MAX_PORT)
+    if isinstance(ports, str):
+        ports = ports.split("-")
+    elif not isinstance(ports, (list, tuple)):
+        ports = [ports]
+    if len(ports) == 1:
+        ports = [ports[0], ports[0]]
+    if len(ports) != 2:
+        raise ValueError(f"Invalid port range {ports}.")
+    return (int(ports[0]), int(ports[1]))
+
+def parse_rule(spec):
+    """
+    Builds a rule from its JSON description, for example
+    {"action": "deny", "protocol": "tcp", "source": "10.0.1.0/24", "ports": "22",
+    "priority": 10}. Every key is optional; see Rule for the defaults.
+    Args:
+        spec (dict): The rule description.
+    Returns:
+        Rule: The rule.
+    Raises:
+        ValueError: If the description is invalid.
+    """
+    try:
+        return Rule(spec.get("action", "allow"), spec.get("protocol", "any"),
+                    spec.get("source", "0.0.0.0/0"), spec.get("destination", "0.0.0.0/0"),
+                    ports=parse_ports(spec.get("ports")), priority=spec.get("priority", 100))
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"Invalid rule: {e}") from e
+
+class PrefixTrie:
+    """
+    Maps an address to the bitmask of the rules whose CIDR contains it. Each
+    node of the trie is an entry of the dictionary of its prefix length.
+    """
+
+    def __init__(self):
+        self._levels = {}
+
+    def add(self, network, bit):
+        """
+        Adds a rule's CIDR.
+        Args:
+            network (IPv4Network): The CIDR.
+            bit (int): The rule's bit.
+        """
+        shift = 32 - network.prefixlen
+        level = self._levels.setdefault(shift, {})
+        prefix = int(network.network_address) >> shift
+        level[prefix] = level.get(prefix, 0) | bit
+
+    def compile(self):
+        """
+        Freezes the trie into the list of levels that lookups walk.
+        """
+        self._levels = sorted(self._levels.items())
+
+    def lookup(self, address):
+        """
+        Returns the bitmask of the rules whose CIDR contains the address.
+        """
+        mask = 0
+        for shift, level in self._levels:
+            mask |= level.get(address >> shift, 0)
+        return mask
+
+class IntervalTable:  # pylint: disable=too-few-public-methods
+    """
+    Maps a port to the bitmask of the rules whose port range contains it. The
+    port range is split at every rule boundary into pieces that the same rules
+    cover.
+    """
+
+    def __init__(self, ranges):
+        """
+        Args:
+            ranges (list): The first and last port of each rule, in bit order.
+        """
+        starts, ends = {}, {}
+        for index, (first, last) in enumerate(ranges):
+            starts[first] = starts.get(first, 0) | 1 << index
+            ends[last + 1] = ends.get(last + 1, 0) | 1 << index
+        self.bounds = sorted(set(starts) | set(ends))
+        self.masks = []
+        mask = 0
+        for bound in self.bounds:
+            mask = (mask & ~ends.get(bound, 0)) | starts.get(bound, 0)
+            self.masks.append(mask)
+
+    def lookup(self, port):
+        """
+        Returns the bitmask of the rules whose port range contains the port.
+        """
+        index = bisect.bisect_right(self.bounds, port) - 1
+        return self.masks[index] if index >= 0 else 0
+
+class RuleSet:
+    """
+    A prioritized list of rules compiled for fast matching.
+    """
+
+    def __init__(self, rules=(), default="deny"):
+        """
+        Args:
+            rules (list): The rules, in any order. Rules of equal priority keep
+                their order.
+            default (str): The action for flows that match no rule.
+        Raises:
+            ValueError: If the default action is invalid.
+        """
+        if default not in ACTIONS:
+            raise ValueError("The default action must be allow or deny.")
+        self.default = default
+        self.rules = sorted(rules, key=lambda rule: rule.priority)
+        self._sources = PrefixTrie()
+        self._destinations = PrefixTrie()
+        any_protocol = 0
+        self._protocols = dict.fromkeys(PROTOCOLS, 0)
+        for index, rule in enumerate(self.rules):
+            bit = 1 << index
+            self._sources.add(rule.source, bit)
+            self._destinations.add(rule.destination, bit)
+            if rule.protocol == "any":
+                any_protocol |= bit
+            else:
+                self._protocols[rule.protocol] |= bit
+        for protocol in PROTOCOLS:
+            self._protocols[protocol] |= any_protocol
+        self._sources.compile()
+        self._destinations.compile()
+        self._ports = IntervalTable([rule.ports for rule in self.rules])
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, source, destination, protocol, port=0):
+        """
+        Returns the winning rule for a flow.
+        Args:
+            source (int or str): The source address.
+            destination (int or str): The destination address.
+            protocol (str): The protocol of the flow.
+            port (int): The destination port; 0 for ICMP.
+        Returns:
+            Rule: The matching rule with the lowest priority, or None.
+        """
+        candidates = self._protocols.get(protocol, 0)
+        if candidates:
+            if isinstance(source, str):
+                source, destination = ip_to_int(source), ip_to_int(destination)
+            candidates &= self._ports.lookup(port)
+        if candidates:
+            candidates &= self._sources.lookup(source)
+        if candidates:
+            candidates &= self._destinations.lookup(destination)
+        if not candidates:
+            return None
+        return self.rules[(candidates & -candidates).bit_length() - 1]
+
+    def decide(self, source, destination, protocol, port=0):
+        """
+        Returns "allow" or "deny" for a flow. See match.
+        """
+        rule = self.match(source, destination, protocol, port)
+        return self.default if rule is None else rule.action
+
+    def to_dict(self):
+        """
+        Returns the JSON description of the rule set.
+        """
+        return {"default": self.default, "rules": [rule.to_dict() for rule in self.rules]}
@@ -0,0 +1,50 @@
+"""
+Gunicorn Configuration
+
+Serves the Cloud Simulator in production:
+
+    gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+The master starts the engine process before it forks the workers, and the
+workers find the engine through the environment they inherit. Every worker is a
+gthread worker: its requests run on a pool of `threads` threads, so a request
+blocked on disk I/O or on a round trip to the engine holds one thread and not
+the whole worker.
+
+Concurrency: up to workers * threads requests are served at once. By default
+that is one worker per CPU, at most 8, times 8 threads. WEB_CONCURRENCY and
+GUNICORN_THREADS override the two numbers and GUNICORN_BIND sets the address.
+"""
+
+# Gunicorn reads its settings from lowercase module variables.
+# pylint: disable=invalid-name
+
+import os
+from engine import start_engine, stop_engine
+from persistence import DEFAULT_STATE_DIR, STATE_DIR_ENV
+
+bind = os.environ.get("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", min(os.cpu_count() or 1, 8)))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# Large uploads and downloads stream for as long as the client needs.
+timeout = 120
+keepalive = 5
+
+_engine = {}
+
+def on_starting(server):
+    """
+    Starts the engine process before any worker is forked. It journals its
+    state to CLOUD_SIM_STATE_DIR, "state" by default.
+    """
+    del server
+    os.environ.setdefault(STATE_DIR_ENV, DEFAULT_STATE_DIR)
+    _engine["process"] = start_engine()
+
+def on_exit(server):
+    """
+    Stops the engine process and removes its VM table.
+    """
+    del server
+    stop_engine(_engine["process"])
@@ -0,0 +1,188 @@
+"""
+Instrumentation Module
+
+This module records where time and I/O go in the simulator: a latency histogram
+per route, counters of bytes read and written by storage and the CDN, and the
+number of round trips from the web workers to the engine process. Histograms use
+fixed buckets that double in width, so recording a value is one bisect and an
+increment, and memory does not grow with traffic. Everything is kept per
+process; a snapshot says which process it describes.
+
+Instrumentation is on unless the CLOUD_SIM_INSTRUMENTATION environment variable
+is 0. When it is off the app registers no request hooks, no proxy wrapper is
+installed and count returns after one flag check.
+
+sample_stacks is an on-demand sampling profiler. It runs only while a profile is
+requested: for the requested number of seconds it walks the stack of every other
+thread at a fixed interval and returns the stacks in the folded format that
+flamegraph.pl and speedscope read, one "thread;caller;...;callee count" line per
+distinct stack.
+
+Classes:
+    Histogram: Latency histogram with doubling buckets.
+
+Functions:
+    enabled(): Returns True if instrumentation is on.
+    count(name, value=1): Adds to a counter.
+    observe(name, seconds): Records a latency in a histogram.
+    snapshot(): Returns every histogram and counter of this process.
+    sample_stacks(seconds, interval=SAMPLE_INTERVAL): Profiles all threads.
+
+Global Variables:
+    INSTRUMENTATION_ENV (str): Environment variable that turns instrumentation off when 0.
+    BUCKET_BOUNDS (tuple): Upper bounds in seconds of the histogram buckets.
+    SAMPLE_INTERVAL (float): Default seconds between two profiler samples.
+    MAX_PROFILE_SECONDS (float): The longest profile that can be requested.
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+INSTRUMENTATION_ENV = "CLOUD_SIM_INSTRUMENTATION"
+
+# 50 microseconds doubling up to about 105 seconds.
+BUCKET_BOUNDS = tuple(50e-6 * 2 ** i for i in range(22))
+
+SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 60.0
+
+_state = {"enabled": os.environ.get(INSTRUMENTATION_ENV, "1") != "0"}
+_histograms = {}
+_counters = Counter()
+_lock = threading.Lock()
+_profile_lock = threading.Lock()
+
+class Histogram:
+    """
+    Latency histogram whose buckets double in width from 50 microseconds.
+    """
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        Records one latency.
+        """
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q-th quantile, or the
+        maximum if that is lower.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, bucket in zip(BUCKET_BOUNDS, self.counts):
+            seen += bucket
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """
+        Returns the count, mean, p50, p90, p99 and max in milliseconds, and the
+        count of every non-empty bucket by its upper bound.
+        """
+        if not self.count:
+            return {"count": 0}
+        def ms(seconds):
+            return round(seconds * 1e3, 3)
+        bounds = [ms(bound) for bound in BUCKET_BOUNDS] + ["inf"]
+        return {"count": self.count, "mean_ms": ms(self.total / self.count),
+                "p50_ms": ms(self.quantile(0.5)), "p90_ms": ms(self.quantile(0.9)),
+                "p99_ms": ms(self.quantile(0.99)), "max_ms": ms(self.max),
+                "buckets": {str(bound): bucket for bound, bucket in zip(bounds, self.counts)
+                            if bucket}}
+
+def enabled():
+    """
+    Returns True if instrumentation is on.
+    """
+    return _state["enabled"]
+
+def count(name, value=1):
+    """
+    Adds to a counter, such as "storage.bytes_written".
+    Args:
+        name (str): The name of the counter.
+        value (int): The amount to add.
+    """
+    if not _state["enabled"]:
+        return
+    with _lock:
+        _counters[name] += value
+
+def observe(name, seconds):
+    """
+    Records a latency in the histogram of the given name.
+    Args:
+        name (str): The name of the histogram, such as "GET /display_vms".
+        seconds (float): The latency.
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+def snapshot():
+    """
+    Returns every histogram and counter of this process.
+    Returns:
+        dict: The process ID, whether instrumentation is on, the summary of each
+        route's histogram and the counters.
+    """
+    with _lock:
+        routes = {name: histogram.summary() for name, histogram in sorted(_histograms.items())}
+        counters = dict(sorted(_counters.items()))
+    return {"pid": os.getpid(), "enabled": _state["enabled"], "routes": routes,
+            "counters": counters}
+
+def sample_stacks(seconds, interval=SAMPLE_INTERVAL):
+    """
+    Samples the stack of every other thread of this process and folds the
+    samples into flamegraph input.
+    Args:
+        seconds (float): How long to sample, at most MAX_PROFILE_SECONDS.
+        interval (float): Seconds between two samples.
+    Returns:
+        str: One "thread;frame;...;frame count" line per distinct stack, with
+        the outermost frame first, or None if another profile is running.
+    """
+    if not _profile_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+        return None
+    try:
+        stacks = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + min(seconds, MAX_PROFILE_SECONDS)
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != me:
+                    stacks[(names.get(ident, str(ident)),) + _frames(frame)] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return "".join(f"{';'.join(stack)} {samples}\n" for stack, samples in stacks.most_common())
+
+def _frames(frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                      f"{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.reverse()
+    return tuple(frames)
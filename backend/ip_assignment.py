@@ -1,55 +1,424 @@
 """
 IP Assignment Module
 
-This module handles the creation, assignment, and deletion of network IPs 
+This module handles the creation, assignment, and deletion of network IPs
 for virtual machines (VMs) in a simulated cloud environment.
 
+Every network owns a CIDR subnet whose host addresses are handed out by an
+AddressPool. The pool marks used addresses in a bitmap and reuses released ones
+from a free list, so allocation and release are O(1) and no two VMs in a network
+ever share an address.
+
+Attaching and detaching VMs is recorded in the state journal, see persistence.
+
+Classes:
+- AddressPool: Allocates and releases the host addresses of one CIDR subnet.
+
 Functions:
-- assign_ip(network_id): Assigns a random IP address within the specified network.
-- create_network(vm_id): Creates a new network for the given VM ID.
-- delete_network(vm_id): Deletes the network associated with the given VM ID if no 
-VMs are left in the network.
+- parse_cidr(cidr): Parses an IPv4 CIDR into its network address and prefix length.
+- assign_ip(network_id, vm_id): Allocates the next free IP address in the
+specified network for a VM.
+- assign_ips(network_id, vm_ids): Allocates one IP address per VM in a single call.
+- release_ip(network_id, ip): Returns an IP address to the network's pool.
+- create_network(vm_id, cidr=None): Creates a new network for the given VM ID.
+- attach_vm(network_id, vm_id): Adds a VM to a network and assigns it an IP address.
+- create_networks(vm_ids): Creates the network of each VM and attaches the VM to it
+in one call.
+- detach_vm(network_id, vm_id): Removes a VM from one network.
+- get_vm_networks(vm_id): Returns the networks a VM is attached to.
+- delete_network(vm_id): Detaches the given VM ID from all of its networks and deletes
+the networks that have no VMs left.
+- delete_networks(vm_ids): Detaches several VMs from all of their networks in one call.
+- restore_networks(state): Replaces every network with networks recovered from the
+state journal.
 
 Global Variables:
 - networks: A dictionary storing network information, where the key is the network
-ID and the value is a dictionary containing a list of VMs in the network.
+ID and the value is a dictionary containing the set of VMs in the network, the
+network's CIDR, its AddressPool and the IP address assigned to each VM.
+- vm_networks: The reverse index of networks, mapping each VM ID to the set of
+network IDs it is attached to.
+- BASE_NETWORK: The supernet that default network subnets are carved from.
+- DEFAULT_PREFIX: The prefix length of default network subnets.
 """
-import random
+import ipaddress
+import re
+import socket
+import struct
+import threading
+from array import array
+from persistence import journal
+
+# "a.b.c.d/n" with plain decimal octets and prefix, as ipaddress accepts them.
+_OCTET = r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+_PLAIN_CIDR = re.compile(rf"{_OCTET}(?:\.{_OCTET}){{3}}/(?:3[0-2]|[12]?[0-9])")
+
+BASE_NETWORK = ipaddress.IPv4Network("10.0.0.0/8")
+DEFAULT_PREFIX = 24
 
 networks = {}
+vm_networks = {}
+_registry_lock = threading.RLock()
+
+def ip_to_int(ip):
+    """
+    Converts a dotted IPv4 address to an integer.
+    """
+    return struct.unpack("!I", socket.inet_aton(ip))[0]
+
+def int_to_ip(value):
+    """
+    Converts an integer to a dotted IPv4 address.
+    """
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+def parse_cidr(cidr):
+    """
+    Parses an IPv4 CIDR. "a.b.c.d/n" strings with plain decimal numbers are
+    parsed directly, which is much faster than ipaddress when thousands of
+    networks are created or recovered; other forms, such as a netmask after the
+    slash or octets with leading zeros, go through ipaddress.
+    Args:
+        cidr (str): The CIDR.
+    Returns:
+        tuple: The network address as an integer and the prefix length.
+    Raises:
+        ValueError: If the CIDR is invalid or has host bits set.
+    """
+    cidr = str(cidr)
+    if _PLAIN_CIDR.fullmatch(cidr):
+        address, _, prefix = cidr.partition("/")
+        # inet_aton would read octets with leading zeros as octal; the pattern
+        # only lets plain decimal ones through.
+        network = ip_to_int(address)
+        prefixlen = int(prefix)
+        if network & ((1 << (32 - prefixlen)) - 1):
+            raise ValueError(f"{cidr} has host bits set")
+        return network, prefixlen
+    subnet = ipaddress.IPv4Network(cidr)
+    return int(subnet.network_address), subnet.prefixlen
+
+class AddressPool:
+    """
+    Allocates and releases the host addresses of one CIDR subnet.
+
+    Addresses are tracked as offsets from the first host address. Offsets below
+    the high-water mark have been handed out at least once; released ones go on
+    a free list and are reused before the high-water mark advances.
+    """
+
+    def __init__(self, cidr):
+        network, prefixlen = parse_cidr(cidr)
+        self.cidr = f"{int_to_ip(network)}/{prefixlen}"
+        num_addresses = 1 << (32 - prefixlen)
+        if prefixlen >= 31:
+            # RFC 3021: point-to-point subnets have no network or broadcast address.
+            self._first = network
+            self.size = num_addresses
+        else:
+            self._first = network + 1
+            self.size = num_addresses - 2
+        self._bitmap = bytearray((self.size + 7) // 8)
+        self._free = array("I")
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def used(self):
+        """
+        The number of addresses currently allocated.
+        """
+        return self._next - len(self._free)
+
+    def __contains__(self, ip):
+        offset = ip_to_int(ip) - self._first
+        return 0 <= offset < self.size and self._is_set(offset)
+
+    def allocate(self):
+        """
+        Allocates one address.
+        Returns:
+            str: The allocated IP address, or None if the subnet is exhausted.
+        """
+        with self._lock:
+            offset = self._take()
+        return None if offset is None else int_to_ip(self._first + offset)
+
+    def allocate_many(self, count):
+        """
+        Allocates several addresses at once, or none if they do not all fit.
+        Args:
+            count (int): The number of addresses to allocate.
+        Returns:
+            list: The allocated IP addresses, or None if the subnet is too small.
+        """
+        with self._lock:
+            if count > self.size - self.used:
+                return None
+            offsets = [self._take() for _ in range(count)]
+        first = self._first
+        return [int_to_ip(first + offset) for offset in offsets]
+
+    def reserve(self, ips):
+        """
+        Marks specific addresses as allocated, as when assignments are recovered
+        after a restart. Addresses below the highest one that stay free go on the
+        free list.
+        Args:
+            ips (iterable): The IP addresses to reserve.
+        Raises:
+            ValueError: If an address is outside the subnet or already allocated.
+        """
+        with self._lock:
+            for ip in ips:
+                offset = ip_to_int(ip) - self._first
+                if not 0 <= offset < self.size or self._is_set(offset):
+                    raise ValueError(f"{ip} cannot be reserved in {self.cidr}.")
+                if offset >= self._next:
+                    self._free.extend(range(offset - 1, self._next - 1, -1))
+                    self._next = offset + 1
+                else:
+                    self._free.remove(offset)
+                self._bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def release(self, ip):
+        """
+        Returns an address to the pool.
+        Args:
+            ip (str): The IP address to release.
+        Returns:
+            bool: False if the address is outside the subnet or not allocated.
+        """
+        offset = ip_to_int(ip) - self._first
+        with self._lock:
+            if not 0 <= offset < self.size or not self._is_set(offset):
+                return False
+            self._bitmap[offset >> 3] &= ~(1 << (offset & 7))
+            self._free.append(offset)
+            return True
+
+    def _is_set(self, offset):
+        return self._bitmap[offset >> 3] & (1 << (offset & 7))
+
+    def _take(self):
+        if self._free:
+            offset = self._free.pop()
+        elif self._next < self.size:
+            offset = self._next
+            self._next += 1
+        else:
+            return None
+        self._bitmap[offset >> 3] |= 1 << (offset & 7)
+        return offset
 
-def assign_ip(network_id):
+def default_cidr(network_id):
     """
-    Assigns a random IP address within the specified network.
+    Returns the subnet a network gets when no CIDR is given: the network_id-th
+    /DEFAULT_PREFIX block of BASE_NETWORK.
+    Args:
+        network_id (int): The ID of the network.
+    Returns:
+        str: The CIDR of the network's subnet.
+    Raises:
+        ValueError: If BASE_NETWORK has no block for this network ID.
+    """
+    block_size = 1 << (32 - DEFAULT_PREFIX)
+    blocks = BASE_NETWORK.num_addresses // block_size
+    if not 0 <= network_id < blocks:
+        raise ValueError(f"Network ID {network_id} is outside 0-{blocks - 1}.")
+    start = int(BASE_NETWORK.network_address) + network_id * block_size
+    return f"{int_to_ip(start)}/{DEFAULT_PREFIX}"
+
+def assign_ip(network_id, vm_id):
+    """
+    Allocates the next free IP address within the specified network.
     Args:
         network_id (int): The ID of the network to assign the IP address from.
+        vm_id (int): The ID of the VM the address is for. The address is
+            released when the VM leaves the network.
     Returns:
-        str: The assigned IP address.
+        str: The assigned IP address, or None if the network is exhausted.
     """
-    ip = f"192.168.{network_id}.{random.randint(1, 254)}"
+    network = networks[network_id]
+    ip = network["pool"].allocate()
+    if ip is not None:
+        network["ips"][vm_id] = ip
     return ip
 
-def create_network(vm_id):
+def assign_ips(network_id, vm_ids):
     """
-    Creates a new network for the given VM ID.
+    Allocates one IP address per VM within the specified network in a single call.
+    Args:
+        network_id (int): The ID of the network to assign the IP addresses from.
+        vm_ids (list): The IDs of the VMs the addresses are for.
+    Returns:
+        list: The assigned IP addresses in the order of vm_ids, or None if the
+        network does not have enough free addresses.
+    """
+    network = networks[network_id]
+    ips = network["pool"].allocate_many(len(vm_ids))
+    if ips is not None:
+        network["ips"].update(zip(vm_ids, ips))
+    return ips
+
+def release_ip(network_id, ip):
+    """
+    Returns an IP address to the pool of the specified network.
+    Args:
+        network_id (int): The ID of the network the address belongs to.
+        ip (str): The IP address to release.
+    Returns:
+        bool: False if the network does not exist or the address was not assigned.
+    """
+    network = networks.get(network_id)
+    if network is None:
+        return False
+    return network["pool"].release(ip)
+
+def create_network(vm_id, cidr=None):
+    """
+    Creates a new network for the given VM ID. If the network already exists it
+    is returned unchanged, so addresses it has handed out stay reserved.
     Args:
         vm_id (int): The ID of the VM to create the network for.
+        cidr (str): The subnet of the network. Defaults to default_cidr(vm_id).
     Returns:
         int: The ID of the created network.
+    Raises:
+        ValueError: If the CIDR is invalid or no default subnet exists for the ID.
     """
     network_id = vm_id
-    networks[network_id] = {"vms": []}
+    with _registry_lock:
+        if network_id not in networks:
+            pool = AddressPool(cidr or default_cidr(network_id))
+            networks[network_id] = {"vms": set(), "cidr": pool.cidr, "pool": pool, "ips": {}}
     return network_id
 
+def attach_vm(network_id, vm_id):
+    """
+    Adds a VM to a network and assigns it an IP address there. A VM can be
+    attached to several networks and holds one address in each.
+    Args:
+        network_id (int): The ID of the network to attach the VM to.
+        vm_id (int): The ID of the VM to attach.
+    Returns:
+        str: The VM's IP address in the network, or None if the network is exhausted.
+    """
+    with _registry_lock:
+        network = networks[network_id]
+        if vm_id in network["vms"]:
+            return network["ips"].get(vm_id)
+        ip = assign_ip(network_id, vm_id)
+        if ip is not None:
+            network["vms"].add(vm_id)
+            vm_networks.setdefault(vm_id, set()).add(network_id)
+            journal.record("attach", network_id, network["cidr"], vm_id, ip)
+        return ip
+
+def create_networks(vm_ids):
+    """
+    Creates the network of each VM and attaches the VM to it, taking the registry
+    lock once for the whole batch rather than twice per VM.
+    Args:
+        vm_ids (list): The IDs of the VMs.
+    Returns:
+        tuple: A dictionary of the IP address of each VM that was attached, and a
+        dictionary of the reason each other VM could not be.
+    """
+    ips, errors = {}, {}
+    with _registry_lock:
+        for vm_id in vm_ids:
+            try:
+                network_id = create_network(vm_id)
+            except ValueError as e:
+                errors[vm_id] = str(e)
+                continue
+            ip = attach_vm(network_id, vm_id)
+            if ip is None:
+                errors[vm_id] = f"network {network_id} is full!"
+            else:
+                ips[vm_id] = ip
+    return ips, errors
+
+def detach_vm(network_id, vm_id):
+    """
+    Removes a VM from a network, releases its IP address there and deletes the
+    network if no VMs are left in it.
+    Args:
+        network_id (int): The ID of the network to detach the VM from.
+        vm_id (int): The ID of the VM to detach.
+    Returns:
+        bool: False if the VM was not attached to the network.
+    """
+    with _registry_lock:
+        member_of = vm_networks.get(vm_id)
+        if member_of is None or network_id not in member_of:
+            return False
+        member_of.discard(network_id)
+        if not member_of:
+            del vm_networks[vm_id]
+        _leave(network_id, vm_id)
+        return True
+
+def get_vm_networks(vm_id):
+    """
+    Returns the networks a VM is attached to.
+    Args:
+        vm_id (int): The ID of the VM.
+    Returns:
+        set: The IDs of the VM's networks.
+    """
+    return set(vm_networks.get(vm_id, ()))
+
 def delete_network(vm_id):
     """
-    Deletes the network associated with the given VM ID if no VMs are left in the network.
+    Detaches the given VM ID from all of its networks, releasing its IP addresses,
+    and deletes every network that has no VMs left. The reverse index makes this
+    proportional to the VM's own networks rather than to all networks.
     Args:
         vm_id (int): The ID of the VM to delete the network for.
     """
-    for network_id, network in list(networks.items()):
-        if vm_id in network["vms"]:
-            network["vms"].remove(vm_id)
-            if len(network["vms"]) == 0:
-                del networks[network_id]
-                print(f"Network {network_id} deleted because no VMs are left.")
+    with _registry_lock:
+        for network_id in vm_networks.pop(vm_id, ()):
+            _leave(network_id, vm_id)
+
+def delete_networks(vm_ids):
+    """
+    Detaches several VMs from all of their networks under one registry lock.
+    Args:
+        vm_ids (list): The IDs of the VMs.
+    """
+    with _registry_lock:
+        for vm_id in vm_ids:
+            for network_id in vm_networks.pop(vm_id, ()):
+                _leave(network_id, vm_id)
+
+def restore_networks(state):
+    """
+    Replaces every network with recovered ones, reserving the addresses their
+    VMs held.
+    Args:
+        state (dict): The CIDR and the {vm_id: ip} assignments of each network
+            ID, as returned by persistence.replay.
+    """
+    with _registry_lock:
+        networks.clear()
+        vm_networks.clear()
+        for network_id, (cidr, ips) in state.items():
+            pool = AddressPool(cidr)
+            pool.reserve(ips.values())
+            networks[network_id] = {"vms": set(ips), "cidr": pool.cidr, "pool": pool,
+                                    "ips": dict(ips)}
+            for vm_id in ips:
+                vm_networks.setdefault(vm_id, set()).add(network_id)
+
+def _leave(network_id, vm_id):
+    journal.record("leave", network_id, vm_id)
+    network = networks[network_id]
+    network["vms"].discard(vm_id)
+    ip = network["ips"].pop(vm_id, None)
+    if ip is not None:
+        network["pool"].release(ip)
+    if not network["vms"]:
+        del networks[network_id]
+        print(f"Network {network_id} deleted because no VMs are left.")
@@ -0,0 +1,111 @@
+"""
+Metrics Sampler Module
+
+This module reads host CPU and memory usage from `psutil` once per sampling
+interval and shares the snapshot with every running VM. Each VM derives its own
+numbers from the snapshot through a small synthetic load model, so VMs report
+distinct values at O(1) cost per VM per tick.
+
+Classes:
+    MetricsSampler: Caches one host metrics snapshot per interval.
+    LoadModel: Per-VM bias, periodic load and jitter applied to a host snapshot.
+
+Global Variables:
+    SAMPLE_INTERVAL (float): Default seconds between two psutil reads.
+"""
+
+import math
+import random
+import threading
+import time
+import psutil
+
+SAMPLE_INTERVAL = 1.0
+
+
+class MetricsSampler:  # pylint: disable=too-few-public-methods
+    """
+    Reads host metrics at most once per interval and hands out the cached snapshot.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._snapshot = (0.0, 0.0)
+        self._taken_at = None
+        # The first cpu_percent(None) call only primes psutil's counters.
+        psutil.cpu_percent(interval=None)
+
+    def sample(self):
+        """
+        Returns the host snapshot, refreshing it if it is older than the interval.
+        Returns:
+            tuple: Host CPU usage and memory usage, both in percent.
+        """
+        now = self._clock()
+        with self._lock:
+            if self._taken_at is None or now - self._taken_at >= self.interval:
+                self._snapshot = (psutil.cpu_percent(interval=None),
+                                  psutil.virtual_memory().percent)
+                self._taken_at = now
+            return self._snapshot
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _splitmix(seed, count):
+    """
+    Returns count floats in [0, 1) from the SplitMix64 sequence of the seed.
+    """
+    values = []
+    state = seed & _MASK64
+    for _ in range(count):
+        state = (state + 0x9E3779B97F4A7C15) & _MASK64
+        z = ((state ^ (state >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        values.append((z ^ (z >> 31)) / 18446744073709551616.0)
+    return values
+
+
+def _clamp(value):
+    return min(100.0, max(0.0, value))
+
+
+class LoadModel:  # pylint: disable=too-few-public-methods
+    """
+    Turns a host snapshot into the metrics of one VM.
+
+    The bias, amplitude, period and phase are drawn once from a SplitMix64
+    sequence seeded with the VM ID, so a VM keeps the same load profile across
+    restarts. Seeding a SplitMix64 costs a few integer operations where a
+    random.Random costs tens of microseconds, which adds up when tens of
+    thousands of VMs are started or recovered at once.
+    """
+    __slots__ = ("cpu_bias", "mem_bias", "amplitude", "period", "phase", "jitter")
+
+    def __init__(self, vm_id, jitter=2.0):
+        cpu, mem, amplitude, period, phase = _splitmix(vm_id, 5)  # pylint: disable=unbalanced-tuple-unpacking
+        self.cpu_bias = -15.0 + 30.0 * cpu
+        self.mem_bias = -5.0 + 10.0 * mem
+        self.amplitude = 20.0 * amplitude
+        self.period = 60.0 + 540.0 * period
+        self.phase = 2 * math.pi * phase
+        self.jitter = jitter
+
+    def apply(self, snapshot, now, rng=random):
+        """
+        Applies the load model to a host snapshot.
+        Args:
+            snapshot (tuple): Host CPU and memory usage in percent.
+            now (float): The current time in seconds.
+            rng (Random): The generator used for per-tick jitter.
+        Returns:
+            tuple: The VM's CPU and memory usage in percent, rounded to one decimal.
+        """
+        host_cpu, host_mem = snapshot
+        wave = self.amplitude * math.sin(2 * math.pi * now / self.period + self.phase)
+        cpu = host_cpu + self.cpu_bias + wave + rng.gauss(0.0, self.jitter)
+        mem = host_mem + self.mem_bias + rng.gauss(0.0, self.jitter / 4)
+        return round(_clamp(cpu), 1), round(_clamp(mem), 1)
@@ -0,0 +1,281 @@
+"""
+Metrics Store Module
+
+This module keeps a bounded history of every VM's CPU and memory usage. Each VM
+has three fixed-size ring buffers of float32 columns: raw samples, one per VM
+tick (every six seconds by default, so the raw ring spans half an hour),
+one-minute rollups and one-hour rollups. Rollups keep the average and
+maximum of each metric and are built as samples arrive, so no background job is
+needed and nothing grows with uptime. The number of VMs with a history is capped
+too; when the cap is reached the VM that reported least recently is dropped.
+
+Queries pick the finest resolution that still covers the requested range and
+return the points together with the average, 95th percentile and maximum, for one
+VM or aggregated over the whole fleet. On rollups the average and percentile are
+taken over the per-bucket averages and the maximum over the per-bucket maxima.
+
+Classes:
+    MetricsStore: The per-VM time-series store.
+
+Global Variables:
+    RAW_POINTS (int): Raw samples kept per VM.
+    MINUTE_POINTS (int): One-minute rollups kept per VM.
+    HOUR_POINTS (int): One-hour rollups kept per VM.
+    MAX_SERIES (int): The most VMs with a history.
+    RESOLUTIONS (dict): The bucket width in seconds of each resolution. Raw
+        samples are as far apart as the VM scheduler's TICK_INTERVAL.
+"""
+
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from vm_scheduler import TICK_INTERVAL
+
+RAW_POINTS = 300
+MINUTE_POINTS = 240
+HOUR_POINTS = 168
+MAX_SERIES = 10000
+
+RESOLUTIONS = {"raw": TICK_INTERVAL, "1m": 60, "1h": 3600}
+
+class _Ring:
+    """
+    Fixed-size ring of rows: a uint32 timestamp in seconds and float32 columns.
+    """
+    __slots__ = ("times", "columns", "head", "count")
+
+    def __init__(self, capacity, width):
+        self.times = array('I', bytes(4 * capacity))
+        self.columns = tuple(array('f', bytes(4 * capacity)) for _ in range(width))
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp, values):
+        """
+        Writes a row over the oldest one once the ring is full.
+        """
+        i = self.head
+        self.times[i] = timestamp
+        for column, value in zip(self.columns, values):
+            column[i] = value
+        self.head = (i + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def oldest(self):
+        """
+        Returns the timestamp of the oldest row, or None if the ring is empty.
+        """
+        if not self.count:
+            return None
+        return self.times[(self.head - self.count) % len(self.times)]
+
+    def rows(self, start, end):
+        """
+        Returns the rows with start <= timestamp <= end, oldest first.
+        """
+        capacity = len(self.times)
+        first = self.head - self.count
+        rows = []
+        for k in range(first, self.head):
+            i = k % capacity
+            timestamp = self.times[i]
+            if start <= timestamp <= end:
+                rows.append((timestamp, *(column[i] for column in self.columns)))
+        return rows
+
+class _Rollup:
+    """
+    A ring of closed buckets and the open bucket samples are added to.
+    """
+    __slots__ = ("width", "ring", "bucket")
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.ring = _Ring(capacity, 4)
+        # [start, samples, cpu sum, cpu max, memory sum, memory max]
+        self.bucket = [None, 0, 0.0, 0.0, 0.0, 0.0]
+
+    def add(self, timestamp, cpu, memory):
+        """
+        Adds a sample to the open bucket, closing it first if its time is over.
+        """
+        bucket = self.bucket
+        bucket_start = timestamp - timestamp % self.width
+        if bucket[0] != bucket_start:
+            if bucket[1]:
+                self.ring.append(bucket[0], self._close())
+            bucket[:] = [bucket_start, 0, 0.0, cpu, 0.0, memory]
+        bucket[1] += 1
+        bucket[2] += cpu
+        bucket[3] = max(bucket[3], cpu)
+        bucket[4] += memory
+        bucket[5] = max(bucket[5], memory)
+
+    def rows(self, start, end):
+        """
+        Returns the buckets in a time range, including the open one.
+        """
+        rows = self.ring.rows(start, end)
+        if self.bucket[1] and start <= self.bucket[0] <= end:
+            rows.append((self.bucket[0], *self._close()))
+        return rows
+
+    def _close(self):
+        _, samples, cpu_sum, cpu_max, memory_sum, memory_max = self.bucket
+        return (cpu_sum / samples, cpu_max, memory_sum / samples, memory_max)
+
+class _Series:
+    """
+    The raw ring and rollups of one VM.
+    """
+    __slots__ = ("raw", "rollups")
+
+    def __init__(self):
+        self.raw = _Ring(RAW_POINTS, 2)
+        self.rollups = {"1m": _Rollup(RESOLUTIONS["1m"], MINUTE_POINTS),
+                        "1h": _Rollup(RESOLUTIONS["1h"], HOUR_POINTS)}
+
+    def record(self, timestamp, cpu, memory):
+        """
+        Adds a sample to the raw ring and to every rollup.
+        """
+        self.raw.append(timestamp, (cpu, memory))
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, cpu, memory)
+
+    def covers(self, resolution, start):
+        """
+        Returns True if the resolution still holds every sample since start.
+        """
+        ring = self.raw if resolution == "raw" else self.rollups[resolution].ring
+        return ring.count < len(ring.times) or ring.oldest() <= start
+
+    def rows(self, resolution, start, end):
+        """
+        Returns the rows of a resolution in a time range.
+        """
+        if resolution == "raw":
+            return self.raw.rows(start, end)
+        return self.rollups[resolution].rows(start, end)
+
+class MetricsStore:
+    """
+    Bounded per-VM time-series store of CPU and memory usage.
+    """
+
+    def __init__(self, max_series=MAX_SERIES, clock=time.time):
+        """
+        Args:
+            max_series (int): The most VMs with a history.
+            clock (callable): Returns the current time in seconds since the epoch.
+        """
+        self.max_series = max_series
+        self.clock = clock
+        self._series = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._series)
+
+    def record(self, vm_id, cpu, memory):
+        """
+        Records one sample of a VM's usage at the current time.
+        Args:
+            vm_id (int): The ID of the VM.
+            cpu (float): The CPU usage in percent.
+            memory (float): The memory usage in percent.
+        """
+        timestamp = int(self.clock())
+        with self._lock:
+            series = self._series.get(vm_id)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    self._series.popitem(last=False)
+                series = self._series[vm_id] = _Series()
+            else:
+                self._series.move_to_end(vm_id)
+            series.record(timestamp, cpu, memory)
+
+    def drop(self, vm_id):
+        """
+        Forgets the history of a VM.
+        Args:
+            vm_id (int): The ID of the VM.
+        """
+        with self._lock:
+            self._series.pop(vm_id, None)
+
+    def query(self, vm_id=None, start=None, end=None, resolution=None):
+        """
+        Returns the usage history of one VM, or aggregates over the whole fleet.
+        Args:
+            vm_id (int): The ID of the VM, or None for the whole fleet.
+            start (float): The start of the range in seconds since the epoch.
+                Defaults to one hour before end.
+            end (float): The end of the range. Defaults to now.
+            resolution (str): "raw", "1m" or "1h". Defaults to the finest one
+                that covers the range.
+        Returns:
+            dict: The resolution used, the points (for a single VM) and the
+            average, 95th percentile and maximum of CPU and memory usage.
+        Raises:
+            KeyError: If the VM has no history.
+            ValueError: If the resolution is unknown.
+        """
+        end = self.clock() if end is None else end
+        start = end - 3600 if start is None else start
+        if resolution is not None and resolution not in RESOLUTIONS:
+            raise ValueError(f"Resolution must be one of {', '.join(RESOLUTIONS)}.")
+        with self._lock:
+            if vm_id is None:
+                series = list(self._series.values())
+            else:
+                series = [self._series[vm_id]]
+            if resolution is None:
+                resolution = _finest(series, start)
+            rows = [row for s in series for row in s.rows(resolution, start, end)]
+        result = {"resolution": resolution, "start": start, "end": end}
+        if vm_id is None:
+            result["vms"] = len(series)
+        else:
+            result["vm_id"] = vm_id
+            result["points"] = [_point(resolution, row) for row in rows]
+        if resolution == "raw":
+            result["cpu"] = _aggregate([row[1] for row in rows], [row[1] for row in rows])
+            result["memory"] = _aggregate([row[2] for row in rows], [row[2] for row in rows])
+        else:
+            result["cpu"] = _aggregate([row[1] for row in rows], [row[2] for row in rows])
+            result["memory"] = _aggregate([row[3] for row in rows], [row[4] for row in rows])
+        return result
+
+    def stats(self):
+        """
+        Returns the number of VMs with a history and the memory their buffers use.
+        Returns:
+            dict: The series count, the cap and the bytes of ring buffers.
+        """
+        per_series = 4 * (3 * RAW_POINTS + 5 * (MINUTE_POINTS + HOUR_POINTS))
+        return {"series": len(self._series), "max_series": self.max_series,
+                "bytes_per_series": per_series, "bytes": per_series * len(self._series)}
+
+def _finest(series, start):
+    for resolution in RESOLUTIONS:
+        if all(s.covers(resolution, start) for s in series):
+            return resolution
+    return "1h"
+
+def _point(resolution, row):
+    if resolution == "raw":
+        return {"time": row[0], "cpu": round(row[1], 2), "memory": round(row[2], 2)}
+    return {"time": row[0], "cpu_avg": round(row[1], 2), "cpu_max": round(row[2], 2),
+            "memory_avg": round(row[3], 2), "memory_max": round(row[4], 2)}
+
+def _aggregate(values, maxima):
+    if not values:
+        return {"avg": None, "p95": None, "max": None}
+    ordered = sorted(values)
+    return {"avg": round(sum(values) / len(values), 2),
+            "p95": round(ordered[math.ceil(0.95 * len(ordered)) - 1], 2),
+            "max": round(max(maxima), 2)}
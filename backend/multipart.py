@@ -0,0 +1,274 @@
+"""
+Multipart Upload Module
+
+This module lets clients upload a large file to a storage bucket in parts, S3
+style: initiate an upload, send its parts in any order and over as many
+connections as they like, then complete or abort it. A failed part is simply
+sent again, and list_parts shows which parts have arrived.
+
+Each part is streamed to its own file in the upload's directory. Completing the
+upload concatenates the parts with os.copy_file_range, so the data is not copied
+through user space, and stores the result in the blob store like any other
+upload. Uploads with no activity for UPLOAD_TTL seconds are aborted by a sweep
+that runs at most every SWEEP_INTERVAL seconds when an upload is initiated.
+
+Functions:
+- initiate_upload(bucket_name, file_name): Starts a multipart upload.
+- upload_part(upload_id, part_number, content): Streams one part of an upload.
+- list_parts(upload_id): Returns the parts of an upload received so far.
+- complete_upload(upload_id, parts=None): Assembles the parts into the file.
+- abort_upload(upload_id): Discards an upload and its parts.
+- sweep_stale_uploads(ttl=UPLOAD_TTL): Aborts uploads with no recent activity.
+
+Global Variables:
+- ROOT_MULTIPART_DIR: The directory holding the parts of uploads in progress.
+- UPLOAD_TTL: Seconds without a new part after which an upload is abandoned.
+- SWEEP_INTERVAL: The least number of seconds between sweeps.
+- MAX_PARTS: The highest part number.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+import blob_store
+import instrumentation
+from storage import ROOT_STORAGE_DIR, catalog, record_file
+from streaming import CHUNK_SIZE, append_file, write_stream
+
+ROOT_MULTIPART_DIR = "multipart"
+UPLOAD_TTL = 24 * 60 * 60
+SWEEP_INTERVAL = 60
+MAX_PARTS = 10000
+
+_UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+_MANIFEST = "upload.json"
+_sweep_state = {"last": 0.0}
+
+if not os.path.exists(ROOT_MULTIPART_DIR):
+    os.makedirs(ROOT_MULTIPART_DIR)
+
+def initiate_upload(bucket_name, file_name):
+    """
+    Starts a multipart upload of a file to a bucket.
+    Args:
+        bucket_name (str): The name of the bucket to upload the file to.
+        file_name (str): The name of the file to upload.
+    Returns:
+        dict: A dictionary containing the result of the operation and the ID
+        of the upload.
+    """
+    now = time.time()
+    if now - _sweep_state["last"] >= SWEEP_INTERVAL:
+        _sweep_state["last"] = now
+        sweep_stale_uploads()
+    if not catalog.bucket_exists(bucket_name):
+        return {"error": f"Bucket {bucket_name} does not exist!"}
+    upload_id = uuid.uuid4().hex
+    directory = os.path.join(ROOT_MULTIPART_DIR, upload_id)
+    os.makedirs(directory)
+    with open(os.path.join(directory, _MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({"bucket": bucket_name, "file": file_name, "initiated": now}, f)
+    return {"message": f"Multipart upload of {file_name} to {bucket_name} initiated!",
+            "upload_id": upload_id}
+
+def upload_part(upload_id, part_number, content):
+    """
+    Streams one part of an upload to disk. Sending a part number again replaces
+    the part.
+    Args:
+        upload_id (str): The ID of the upload.
+        part_number (int): The position of the part, from 1 to MAX_PARTS.
+        content (file-like or bytes): The content of the part.
+    Returns:
+        dict: A dictionary containing the result of the operation, the part's
+        size and its ETag (the SHA-256 checksum of the part).
+    """
+    directory = _upload_dir(upload_id)
+    if directory is None:
+        return {"error": f"Upload {upload_id} does not exist!"}
+    if not 1 <= part_number <= MAX_PARTS:
+        return {"error": f"Part number must be between 1 and {MAX_PARTS}!"}
+    try:
+        size, checksum = write_stream(content, _part_path(directory, part_number))
+    except FileNotFoundError:
+        # The upload was completed or aborted while the part was arriving.
+        return {"error": f"Upload {upload_id} does not exist!"}
+    instrumentation.count("storage.bytes_written", size)
+    return {"message": f"Part {part_number} of upload {upload_id} uploaded!",
+            "part_number": part_number, "size": size, "etag": checksum}
+
+def list_parts(upload_id):
+    """
+    Returns the parts of an upload received so far.
+    Args:
+        upload_id (str): The ID of the upload.
+    Returns:
+        dict: The bucket and file of the upload and the number and size of
+        each part, or an error.
+    """
+    directory = _upload_dir(upload_id)
+    if directory is None:
+        return {"error": f"Upload {upload_id} does not exist!"}
+    manifest = _read_manifest(directory)
+    parts = [{"part_number": number, "size": os.path.getsize(path)}
+             for number, path in sorted(_parts(directory).items())]
+    return {"upload_id": upload_id, "bucket": manifest["bucket"],
+            "file": manifest["file"], "parts": parts}
+
+def complete_upload(upload_id, parts=None):
+    """
+    Assembles the parts of an upload into the file and stores it in its bucket.
+    Args:
+        upload_id (str): The ID of the upload.
+        parts (list): The {"part_number", "etag"} of each part to include, in
+            ascending order. Defaults to every part received.
+    Returns:
+        dict: A dictionary containing the result of the operation, the file
+        size, its SHA-256 checksum and the upload's ETag, built from the part
+        checksums as in S3.
+    """
+    directory = _upload_dir(upload_id)
+    if directory is None:
+        return {"error": f"Upload {upload_id} does not exist!"}
+    # Claiming the directory turns away concurrent parts, completes and aborts.
+    claimed = f"{directory}.completing"
+    try:
+        os.rename(directory, claimed)
+    except FileNotFoundError:
+        return {"error": f"Upload {upload_id} does not exist!"}
+    try:
+        manifest = _read_manifest(claimed)
+        tmp_path, size, checksum, etag = _assemble(claimed, parts)
+    except ValueError as e:
+        os.rename(claimed, directory)
+        return {"error": str(e)}
+    instrumentation.count("storage.bytes_read", size)
+    instrumentation.count("storage.bytes_written", size)
+    bucket_name, file_name = manifest["bucket"], manifest["file"]
+    if not catalog.bucket_exists(bucket_name):
+        os.remove(tmp_path)
+        shutil.rmtree(claimed)
+        return {"error": f"Bucket {bucket_name} does not exist!"}
+    file_path = os.path.join(ROOT_STORAGE_DIR, bucket_name, file_name)
+    deduplicated = blob_store.store_file(tmp_path, checksum, file_path)
+    record_file(bucket_name, file_name, checksum)
+    shutil.rmtree(claimed)
+    return {"message": f"File {file_name} uploaded to {bucket_name}!", "size": size,
+            "sha256": checksum, "etag": etag, "deduplicated": deduplicated}
+
+def abort_upload(upload_id):
+    """
+    Discards an upload and its parts.
+    Args:
+        upload_id (str): The ID of the upload.
+    Returns:
+        dict: A dictionary containing the result of the operation.
+    """
+    directory = _upload_dir(upload_id)
+    if directory is None or not _discard(directory):
+        return {"message": f"Upload {upload_id} does not exist!"}
+    return {"message": f"Upload {upload_id} aborted!"}
+
+def sweep_stale_uploads(ttl=UPLOAD_TTL):
+    """
+    Aborts uploads that have received no part for ttl seconds, and removes what
+    interrupted completes and aborts left behind.
+    Args:
+        ttl (float): Seconds of inactivity after which an upload is abandoned.
+    Returns:
+        dict: The number of uploads aborted.
+    """
+    cutoff = time.time() - ttl
+    aborted = 0
+    for entry in os.scandir(ROOT_MULTIPART_DIR):
+        if not entry.is_dir() or entry.stat().st_mtime >= cutoff:
+            continue
+        if _UPLOAD_ID.fullmatch(entry.name):
+            # Writing a part updates the directory's mtime.
+            aborted += _discard(entry.path)
+        else:
+            shutil.rmtree(entry.path, ignore_errors=True)
+    return {"aborted": aborted}
+
+def _upload_dir(upload_id):
+    if not _UPLOAD_ID.fullmatch(upload_id):
+        return None
+    directory = os.path.join(ROOT_MULTIPART_DIR, upload_id)
+    return directory if os.path.isdir(directory) else None
+
+def _discard(directory):
+    claimed = f"{directory}.aborting"
+    try:
+        os.rename(directory, claimed)
+    except FileNotFoundError:
+        return False
+    shutil.rmtree(claimed)
+    return True
+
+def _part_path(directory, part_number):
+    return os.path.join(directory, f"part-{part_number:05d}")
+
+def _parts(directory):
+    return {int(entry.name[5:]): entry.path for entry in os.scandir(directory)
+            if entry.name.startswith("part-") and entry.name[5:].isdigit()}
+
+def _read_manifest(directory):
+    with open(os.path.join(directory, _MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+def _assemble(directory, parts):
+    """
+    Concatenates the parts of an upload into a new file in the blob store's
+    staging directory. Each part is read once to checksum it while the copy
+    itself is done by append_file.
+    Returns:
+        tuple: The path of the file, its size, its SHA-256 checksum and the
+        upload's ETag.
+    Raises:
+        ValueError: If a part is missing, out of order or has a different ETag.
+    """
+    available = _parts(directory)
+    if parts is None:
+        parts = [{"part_number": number} for number in sorted(available)]
+    if not parts:
+        raise ValueError("The upload has no parts!")
+    numbers = [part.get("part_number") for part in parts]
+    if not all(isinstance(number, int) for number in numbers):
+        raise ValueError("Every part needs an integer part_number!")
+    if numbers != sorted(set(numbers)):
+        raise ValueError("Parts must be listed in ascending order without repeats!")
+    fd, tmp_path = tempfile.mkstemp(dir=blob_store.STAGING_DIR, prefix='.multipart-')
+    whole = hashlib.sha256()
+    composite = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb', buffering=0) as dst:
+            for part in parts:
+                path = available.get(part["part_number"])
+                if path is None:
+                    raise ValueError(f"Part {part['part_number']} was not uploaded!")
+                digest = _checksum(path, whole)
+                if part.get("etag") not in (None, digest.hexdigest()):
+                    raise ValueError(f"Part {part['part_number']} has a different ETag!")
+                composite.update(digest.digest())
+                size += append_file(path, dst)
+        os.chmod(tmp_path, 0o644)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, size, whole.hexdigest(), f"{composite.hexdigest()}-{len(parts)}"
+
+def _checksum(path, whole):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            whole.update(chunk)
+    return digest
@@ -0,0 +1,159 @@
+"""
+Object Cache Module
+
+This module keeps small, frequently read objects in memory so hot storage and CDN
+reads skip the exists/open/read syscalls. Entries are keyed by file path and
+carry an ETag built from the file's mtime and size when it was loaded. Writers
+call `invalidate` whenever they replace or remove a file; with `validate` set,
+every hit also re-checks the ETag against the file, for setups where another
+process may change files behind this one's back. A capacity of 0 disables it.
+
+Classes:
+    ObjectCache: Size-bounded LRU cache of file contents.
+
+Global Variables:
+    MAX_CACHE_BYTES (int): Default total size of cached objects.
+    MAX_OBJECT_BYTES (int): Default size limit of a single cached object.
+    hot_cache (ObjectCache): The cache shared by the storage and CDN modules.
+"""
+
+import os
+import threading
+from collections import Counter, OrderedDict
+import instrumentation
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_OBJECT_BYTES = 1024 * 1024
+
+def file_etag(stat):
+    """
+    Builds an ETag from a file's mtime and size.
+    Args:
+        stat (os.stat_result): The result of os.stat on the file.
+    Returns:
+        str: The ETag, without quotes.
+    """
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+class ObjectCache:
+    """
+    Size-bounded LRU cache of file contents, keyed by path.
+    """
+
+    def __init__(self, capacity=MAX_CACHE_BYTES, max_object_size=MAX_OBJECT_BYTES,
+                 validate=False):
+        self.capacity = capacity
+        self.max_object_size = max_object_size
+        self.validate = validate
+        self.counters = Counter(hits=0, misses=0, evictions=0, invalidations=0)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """
+        Whether the cache stores anything. Set capacity to 0 to disable it.
+        """
+        return self.capacity > 0
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def load(self, path):
+        """
+        Returns a file's content from memory, reading and caching it on a miss.
+        Args:
+            path (str): The path of the file.
+        Returns:
+            tuple: The file content and its ETag, or None if the file does not
+            exist or is too large to cache.
+        """
+        if self.enabled:
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is None:
+                    self.counters["misses"] += 1
+                else:
+                    self._entries.move_to_end(path)
+                    if not self.validate:
+                        self.counters["hits"] += 1
+                        return entry
+            if entry is not None:
+                # The file is checked outside the lock; only the count needs it.
+                current = self._current(path, entry[1])
+                with self._lock:
+                    self.counters["hits" if current else "misses"] += 1
+                if current:
+                    return entry
+        # A file invalidated while it is being read must not be cached stale.
+        generation = self.counters["invalidations"]
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_size > self.max_object_size:
+                    return None
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        instrumentation.count("hot_cache.bytes_read", len(data))
+        entry = (data, file_etag(stat))
+        if len(data) <= self.capacity:
+            self._store(path, entry, generation)
+        return entry
+
+    def invalidate(self, path):
+        """
+        Drops a file from the cache. Call it whenever the file is replaced or removed.
+        Args:
+            path (str): The path of the file.
+        """
+        with self._lock:
+            self.counters["invalidations"] += 1
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._size -= len(entry[0])
+
+    def clear(self):
+        """
+        Drops every cached file.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Returns the cache's usage and counters.
+        Returns:
+            dict: Capacity, bytes used, object count and counters.
+        """
+        with self._lock:
+            return {"capacity": self.capacity, "used": self._size,
+                    "objects": len(self._entries), **self.counters}
+
+    def _store(self, path, entry, generation):
+        size = len(entry[0])
+        with self._lock:
+            if self.counters["invalidations"] != generation:
+                return
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self._size -= len(old[0])
+            while self._entries and self._size + size > self.capacity:
+                _, victim = self._entries.popitem(last=False)
+                self._size -= len(victim[0])
+                self.counters["evictions"] += 1
+            self._entries[path] = entry
+            self._size += size
+
+    def _current(self, path, etag):
+        try:
+            if file_etag(os.stat(path)) == etag:
+                return True
+        except FileNotFoundError:
+            pass
+        self.invalidate(path)
+        return False
+
+hot_cache = ObjectCache()
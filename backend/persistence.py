@@ -0,0 +1,301 @@
+"""
+Persistence Module
+
+This module keeps the VM and network state of the simulator across restarts.
+Every change is appended to a journal as a small record: a VM's new status, pid
+and address, a deleted VM, a VM attached to or leaving a network, and a process
+adopting every running VM after a restart. Changes are
+made inside journal transactions; a transaction writes its records in one
+append when it ends, before the operation returns to its caller, so a crash
+loses no acknowledged change.
+
+The journal is compacted into a snapshot of the whole state every
+SNAPSHOT_EVERY records and when the simulator shuts down. Snapshots and
+journals are numbered by generation: a snapshot of generation n contains
+everything up to the start of journal n, so recovery reads the newest snapshot
+and replays only its journal. A snapshot is written to a temporary file and
+renamed over the previous one. Each transaction is one line of the journal, and
+a last line torn by a crash is cut off when the journal is opened again.
+
+Records are written with one flush per transaction, which survives a crash of
+the simulator. Set fsync to also survive a crash of the machine, at the cost of
+a disk sync per transaction.
+
+Classes:
+    Journal: Append-only journal of state changes with compacting snapshots.
+
+Functions:
+    snapshot_state(table, networks, pid_times): Returns the state to write to a snapshot.
+    replay(snapshot, records): Rebuilds the state from a snapshot and journal records.
+
+Global Variables:
+    STATE_DIR_ENV (str): Environment variable naming the state directory.
+    DEFAULT_STATE_DIR (str): The state directory the servers use by default.
+    SNAPSHOT_EVERY (int): Records after which the journal is compacted.
+    journal (Journal): The journal of this process, disabled until opened.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+STATE_DIR_ENV = "CLOUD_SIM_STATE_DIR"
+DEFAULT_STATE_DIR = "state"
+SNAPSHOT_EVERY = 200000
+
+_SNAPSHOT = "snapshot.json"
+
+class Journal:  # pylint: disable=too-many-instance-attributes
+    """
+    Append-only journal of state changes with compacting snapshots. Until it is
+    opened, transactions only serialize their callers and records are dropped.
+    """
+
+    def __init__(self, snapshot_every=SNAPSHOT_EVERY, fsync=False):
+        """
+        Args:
+            snapshot_every (int): Records after which the journal is compacted.
+            fsync (bool): Whether to sync the journal to disk on every transaction.
+        """
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.directory = None
+        self.generation = 0
+        self._file = None
+        self._lock_file = None
+        self._state = None
+        self._pending = []
+        self._written = 0
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        """
+        True once the journal is open.
+        """
+        return self._file is not None
+
+    def open(self, directory, state):
+        """
+        Opens the journal in a directory and returns what a previous run left
+        there. Only one process can have a directory open.
+        Args:
+            directory (str): The state directory, created if needed.
+            state (callable): Returns the current state as snapshot_state does;
+                called under the journal lock whenever a snapshot is written.
+        Returns:
+            tuple: The newest snapshot, or None, and the records of its journal.
+        Raises:
+            RuntimeError: If the journal is already open or another process has
+                the directory open.
+        """
+        if self._file is not None:
+            raise RuntimeError(f"The journal is already open in {self.directory}.")
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, ".lock"), "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                lock_file.close()
+                raise RuntimeError(f"The state directory {directory} is in use.") from e
+        snapshot = None
+        path = os.path.join(directory, _SNAPSHOT)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        generation = snapshot["generation"] if snapshot else 0
+        records = _read_records(self._journal_path(directory, generation))
+        with self._lock:
+            self.directory, self.generation, self._state = directory, generation, state
+            self._lock_file = lock_file
+            self._file = open(self._journal_path(directory, generation), "a",  # pylint: disable=consider-using-with
+                              encoding="utf-8")
+            self._written = len(records)
+        return snapshot, records
+
+    def record(self, *fields):
+        """
+        Adds a record to the current transaction. Does nothing while the journal
+        is closed.
+        Args:
+            *fields: The record type and its values, all JSON-serializable.
+        """
+        if self._file is not None:
+            self._pending.append(fields)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Context manager that serializes state changes and writes the records
+        they make in one append when the block ends.
+        """
+        with self._lock:
+            try:
+                yield
+            finally:
+                self._commit()
+
+    def checkpoint(self):
+        """
+        Writes a snapshot of the current state and starts a new, empty journal.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            # Records not yet written describe changes the state already holds.
+            self._pending = []
+            generation = self.generation + 1
+            snapshot = {"generation": generation, "time": time.time(), **self._state()}
+            path = os.path.join(self.directory, _SNAPSHOT)
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                # dumps encodes in C; dump would write piece by piece.
+                f.write(json.dumps(snapshot, separators=(",", ":")))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            self._file.close()
+            old = self._journal_path(self.directory, self.generation)
+            self.generation = generation
+            self._file = open(self._journal_path(self.directory, generation), "w",  # pylint: disable=consider-using-with
+                              encoding="utf-8")
+            self._written = 0
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(old)
+
+    def close(self, checkpoint=True):
+        """
+        Closes the journal, by default after writing a final snapshot.
+        Args:
+            checkpoint (bool): Whether to write a snapshot first. Without one the
+                next run replays the journal, as after a crash.
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            if checkpoint:
+                self.checkpoint()
+            else:
+                self._commit()
+            self._file.close()
+            self._lock_file.close()
+            self._file = self._lock_file = self._state = None
+
+    def _commit(self):
+        if not self._pending or self._file is None:
+            return
+        pending, self._pending = self._pending, []
+        # One line per transaction, so a torn write drops a whole transaction.
+        self._file.write(json.dumps(pending, separators=(",", ":"))[1:-1] + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._written += len(pending)
+        if self._written >= self.snapshot_every:
+            self.checkpoint()
+
+    @staticmethod
+    def _journal_path(directory, generation):
+        return os.path.join(directory, f"journal-{generation}.log")
+
+def _read_records(path):
+    """
+    Reads the records of a journal and truncates it after the last complete
+    transaction, so that new transactions are not appended to a torn one.
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r+b") as f:
+        data = f.read()
+        # A transaction is complete once its newline is written.
+        lines = data[:data.rfind(b"\n") + 1].splitlines()
+        try:
+            # One parse of the whole journal is much faster than one per line.
+            records = json.loads(b"[" + b",".join(lines) + b"]")
+            good = sum(len(line) + 1 for line in lines)
+        except json.JSONDecodeError:
+            records, good = [], 0
+            for line in lines:
+                try:
+                    records.extend(json.loads(b"[" + line + b"]"))
+                except json.JSONDecodeError:
+                    # A transaction torn by a crash is the last one; nothing follows it.
+                    break
+                good += len(line) + 1
+        if good < len(data):
+            f.truncate(good)
+    return records
+
+def snapshot_state(table, networks, pid_times):
+    """
+    Returns the state to write to a snapshot. Times of pids that no longer back
+    any VM are dropped from pid_times.
+    Args:
+        table (VMTable): The VM table.
+        networks (dict): The networks of ip_assignment.
+        pid_times (dict): When each pid was last recorded backing a VM.
+    Returns:
+        dict: The vm_id, status, pid and ip of every VM, the [pid, time] of every
+        pid with a known time, and the ID, CIDR and [vm_id, ip] assignments of
+        every network.
+    """
+    vms = [[vm_id, vm["status"], vm["pid"], vm["ip"]] for vm_id, vm in table.items()]
+    pids = {vm[2] for vm in vms if vm[2]}
+    for pid in set(pid_times) - pids:
+        del pid_times[pid]
+    return {"vms": vms,
+            "pids": [[pid, pid_times[pid]] for pid in pids if pid in pid_times],
+            "networks": [[network_id, network["cidr"], list(network["ips"].items())]
+                         for network_id, network in list(networks.items())]}
+
+def replay(snapshot, records):
+    """
+    Rebuilds the state from a snapshot and the records of its journal.
+    Args:
+        snapshot (dict): The snapshot, or None.
+        records (list): The journal records, oldest first.
+    Returns:
+        tuple: The (status, pid, ip, since) of each VM ID, where since is when
+        the pid was last known to back the VM, and the (cidr, {vm_id: ip}) of
+        each network ID.
+    """
+    vms, networks = {}, {}
+    if snapshot:
+        # Snapshots without pid times are dated by when they were written.
+        times = dict(snapshot.get("pids", ()))
+        for vm_id, status, pid, ip in snapshot["vms"]:
+            vms[vm_id] = (status, pid, ip, times.get(pid, snapshot["time"]))
+        for network_id, cidr, ips in snapshot["networks"]:
+            networks[network_id] = (cidr, dict(ips))
+    for record in records:
+        _apply(record, vms, networks)
+    return vms, networks
+
+def _apply(record, vms, networks):
+    kind = record[0]
+    if kind == "vm":
+        vms[record[1]] = tuple(record[2:])
+    elif kind == "vm_deleted":
+        vms.pop(record[1], None)
+    elif kind == "adopt":
+        _, pid, since = record
+        for vm_id, (status, _, ip, _) in vms.items():
+            if status == "running":
+                vms[vm_id] = (status, pid, ip, since)
+    elif kind == "attach":
+        _, network_id, cidr, vm_id, ip = record
+        networks.setdefault(network_id, (cidr, {}))[1][vm_id] = ip
+    elif kind == "leave":
+        network = networks.get(record[1])
+        if network is not None:
+            network[1].pop(record[2], None)
+            if not network[1]:
+                del networks[record[1]]
+
+journal = Journal()
@@ -0,0 +1,363 @@
+"""
+Simulation Module
+
+This module runs the cloud on virtual time. A Simulation holds a virtual clock, a
+priority queue of timed events and a seeded random number generator; running it
+pops events in time order and jumps the clock straight to each one, so nothing
+ever sleeps and a week of traffic takes as long as the work it contains. Given
+the same seed, a run makes exactly the same decisions.
+
+Drivers put the parts of the simulator on that clock:
+
+- SimulatedVMs starts and stops VMs through the real network and IP code and the
+  VM table, and ticks their load models from one event per tick interval. It also
+  works as an autoscaler executor.
+- SimulatedStorage issues uploads and downloads against a disk modelled by its
+  bandwidth and a FIFO queue, instead of doing real I/O.
+- SimulatedCDN sends Zipf-distributed requests through the real edge router to
+  size-bounded LRU edge caches that track sizes only.
+
+Classes:
+    Simulation: Virtual clock, event queue and seeded generator.
+    SimulatedVMs: VM lifecycle and metrics on virtual time.
+    SimulatedStorage: Storage workload against a modelled disk.
+    SimulatedCDN: CDN workload against modelled edge caches.
+
+Functions:
+    latency_summary(latencies): Returns the mean, p50, p99 and max of latencies.
+    churn(sim, vms, vm_ids, count, lifetime): Keeps a fleet of VMs turning over.
+
+Global Variables:
+    HOST_MEAN (tuple): The CPU and memory usage the simulated host wanders around.
+    DISK_BANDWIDTH (float): Bytes per second of the modelled storage disk.
+    EDGE_LATENCY (float): Seconds to serve a request from an edge cache.
+    ORIGIN_LATENCY (float): Extra seconds to fetch a missed object from the origin.
+    ORIGIN_BANDWIDTH (float): Bytes per second between the origin and an edge.
+"""
+
+import bisect
+import heapq
+import itertools
+import math
+import random
+import time
+from array import array
+from collections import OrderedDict, deque
+from ip_assignment import create_networks, delete_networks
+from metrics_sampler import LoadModel
+from vm_scheduler import TICK_INTERVAL
+
+HOST_MEAN = (40.0, 50.0)
+DISK_BANDWIDTH = 200e6
+EDGE_LATENCY = 0.02
+ORIGIN_LATENCY = 0.1
+ORIGIN_BANDWIDTH = 100e6
+
+class Simulation:
+    """
+    Virtual clock, event queue and seeded random number generator.
+    """
+
+    def __init__(self, seed=0, start=0.0):
+        """
+        Args:
+            seed (int): Seeds the generator every driver draws from.
+            start (float): The virtual time the simulation starts at.
+        """
+        self.now = start
+        self.rng = random.Random(seed)
+        self.events = 0
+        self._queue = []
+        self._seq = itertools.count()
+
+    def clock(self):
+        """
+        Returns the virtual time. Pass it wherever a clock callable is expected.
+        """
+        return self.now
+
+    def schedule(self, delay, action, *args):
+        """
+        Runs action(*args) after delay virtual seconds. Events due at the same
+        time run in the order they were scheduled.
+        """
+        heapq.heappush(self._queue, (self.now + delay, next(self._seq), action, args))
+
+    def every(self, interval, action, *args):
+        """
+        Runs action(*args) every interval virtual seconds, starting one interval
+        from now.
+        """
+        def repeat():
+            action(*args)
+            self.schedule(interval, repeat)
+        self.schedule(interval, repeat)
+
+    def run(self, until):
+        """
+        Runs events in time order up to and including the virtual time until.
+        Args:
+            until (float): The virtual time to stop at.
+        Returns:
+            dict: The events run, virtual and wall-clock seconds elapsed and the
+            ratio of the two.
+        """
+        started, wall = self.now, time.perf_counter()
+        events = self.events
+        queue = self._queue
+        while queue and queue[0][0] <= until:
+            self.now, _, action, args = heapq.heappop(queue)
+            action(*args)
+            self.events += 1
+        self.now = max(self.now, until)
+        wall = time.perf_counter() - wall
+        virtual = self.now - started
+        return {"events": self.events - events, "virtual_seconds": virtual,
+                "wall_seconds": round(wall, 3),
+                "speedup": round(virtual / wall) if wall else None}
+
+    def poisson(self, rate, action, *args):
+        """
+        Runs action(*args) at exponentially distributed intervals, rate times
+        per virtual second on average.
+        """
+        def arrive():
+            action(*args)
+            self.schedule(self.rng.expovariate(rate), arrive)
+        self.schedule(self.rng.expovariate(rate), arrive)
+
+class SimulatedVMs:
+    """
+    Starts, stops and ticks VMs on virtual time. Networks and IP addresses come
+    from the real ip_assignment module and state is kept in a VM table.
+    """
+
+    def __init__(self, sim, table, store=None, tick_interval=TICK_INTERVAL):
+        """
+        Args:
+            sim (Simulation): The simulation.
+            table (VMTable): The table VM state is written to.
+            store (MetricsStore): Records every tick, if given. It should use
+                sim.clock as its clock.
+            tick_interval (float): Virtual seconds between two ticks of a VM.
+        """
+        self.sim = sim
+        self.table = table
+        self.store = store
+        self.running = {}
+        self.host = list(HOST_MEAN)
+        sim.every(tick_interval, self._tick)
+
+    def start(self, vm_ids):
+        """
+        Starts VMs, attaching each to its own network.
+        Returns:
+            list: The IDs of the VMs that were started.
+        """
+        ips, _ = create_networks(vm_ids)
+        started = []
+        for vm_id, ip in ips.items():
+            if self.table.insert(vm_id, "running", ip=ip):
+                self.running[vm_id] = LoadModel(vm_id)
+                started.append(vm_id)
+        delete_networks([vm_id for vm_id in ips if vm_id not in self.running])
+        return started
+
+    def stop(self, vm_ids):
+        """
+        Stops VMs and removes them from the table, releasing their networks.
+        """
+        vm_ids = [vm_id for vm_id in vm_ids if self.running.pop(vm_id, None) is not None]
+        delete_networks(vm_ids)
+        for vm_id in vm_ids:
+            self.table.remove(vm_id)
+            if self.store is not None:
+                self.store.drop(vm_id)
+
+    def scale_out(self, group, vm_ids):
+        """
+        Autoscaler executor hook: starts VMs of a group.
+        """
+        del group
+        return self.start(vm_ids)
+
+    def scale_in(self, group, vm_ids):
+        """
+        Autoscaler executor hook: stops VMs of a group.
+        """
+        del group
+        self.stop(vm_ids)
+
+    def metric(self, group, name):
+        """
+        Autoscaler metrics hook: the average usage of a group's running VMs.
+        """
+        values = [vm[name] for vm in map(self.table.get, group.members)
+                  if vm is not None and vm[name] is not None]
+        return sum(values) / len(values) if values else None
+
+    def _tick(self):
+        rng, now = self.sim.rng, self.sim.now
+        # The host wanders around its mean instead of being sampled.
+        self.host = [min(95.0, max(5.0, value + 0.05 * (mean - value) + rng.gauss(0.0, 1.0)))
+                     for value, mean in zip(self.host, HOST_MEAN)]
+        snapshot = tuple(self.host)
+        for vm_id, load in self.running.items():
+            cpu, memory = load.apply(snapshot, now, rng)
+            self.table.set_metrics(vm_id, cpu, memory)
+            if self.store is not None:
+                self.store.record(vm_id, cpu, memory)
+
+class SimulatedStorage:  # pylint: disable=too-few-public-methods
+    """
+    Uploads and downloads against a disk modelled by its bandwidth and a FIFO
+    request queue. Object sizes are tracked; their content is not.
+    """
+
+    def __init__(self, sim, workload, bandwidth=DISK_BANDWIDTH):
+        """
+        Args:
+            sim (Simulation): The simulation.
+            workload (dict): "rate" requests per second, the share of "writes",
+                the number of distinct "objects" and their (min, max) "size".
+            bandwidth (float): Bytes per second of the disk.
+        """
+        self.sim = sim
+        self.workload = workload
+        self.bandwidth = bandwidth
+        self.objects = {}
+        self.busy_until = sim.now
+        self.counters = {"uploads": 0, "downloads": 0, "not_found": 0,
+                         "bytes_written": 0, "bytes_read": 0}
+        self.latencies = array('f')
+        sim.poisson(workload["rate"], self._request)
+
+    def _request(self):
+        rng = self.sim.rng
+        key = rng.randrange(self.workload["objects"])
+        if rng.random() < self.workload["writes"]:
+            size = rng.randint(*self.workload["size"])
+            self.objects[key] = size
+            self.counters["uploads"] += 1
+            self.counters["bytes_written"] += size
+        else:
+            size = self.objects.get(key)
+            if size is None:
+                self.counters["not_found"] += 1
+                return
+            self.counters["downloads"] += 1
+            self.counters["bytes_read"] += size
+        start = max(self.sim.now, self.busy_until)
+        self.busy_until = start + size / self.bandwidth
+        self.latencies.append(self.busy_until - self.sim.now)
+
+    def summary(self):
+        """
+        Returns the request counters and latency distribution.
+        """
+        return {**self.counters, "objects": len(self.objects),
+                "latency": latency_summary(self.latencies)}
+
+class SimulatedCDN:  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """
+    Zipf-distributed requests routed by the real edge router to edge caches
+    that are modelled as size-bounded LRUs of object sizes.
+    """
+
+    def __init__(self, sim, router, capacity, workload):
+        """
+        Args:
+            sim (Simulation): The simulation.
+            router (EdgeRouter): Picks the edge of each request.
+            capacity (int): Cache size in bytes of every edge.
+            workload (dict): "rate" requests per second, the number of distinct
+                "objects", the Zipf exponent "zipf", their (min, max) "size" and
+                the number of user "locations".
+        """
+        self.sim = sim
+        self.router = router
+        self.capacity = capacity
+        self.workload = workload
+        rng = random.Random(sim.rng.random())
+        self.sizes = [rng.randint(*workload["size"]) for _ in range(workload["objects"])]
+        self._cumulative = list(itertools.accumulate(
+            1.0 / (rank + 1) ** workload["zipf"] for rank in range(workload["objects"])))
+        self.edges = {}
+        self.counters = {"hits": 0, "misses": 0, "unrouted": 0}
+        self.latencies = array('f')
+        sim.poisson(workload["rate"], self._request)
+
+    def _request(self):
+        rng = self.sim.rng
+        name = self.router.route(rng.randrange(self.workload["locations"]))
+        if name is None:
+            self.counters["unrouted"] += 1
+            return
+        key = bisect.bisect(self._cumulative, rng.random() * self._cumulative[-1])
+        key = min(key, len(self.sizes) - 1)
+        size = self.sizes[key]
+        cache, used = self.edges.setdefault(name, (OrderedDict(), [0]))
+        latency = EDGE_LATENCY
+        if key in cache:
+            cache.move_to_end(key)
+            self.counters["hits"] += 1
+        else:
+            self.counters["misses"] += 1
+            latency += ORIGIN_LATENCY + size / ORIGIN_BANDWIDTH
+            if size <= self.capacity:
+                while used[0] + size > self.capacity:
+                    used[0] -= cache.popitem(last=False)[1]
+                cache[key] = size
+                used[0] += size
+        self.latencies.append(latency)
+
+    def summary(self):
+        """
+        Returns the hit ratio, counters and latency distribution.
+        """
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters,
+                "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else None,
+                "latency": latency_summary(self.latencies)}
+
+def latency_summary(latencies):
+    """
+    Returns the mean, median, 99th percentile and maximum of latencies, in
+    milliseconds.
+    Args:
+        latencies (array): Latencies in seconds.
+    Returns:
+        dict: The statistics, or an empty dict if there are no latencies.
+    """
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    def percentile(p):
+        return round(ordered[math.ceil(p * len(ordered)) - 1] * 1e3, 3)
+    return {"mean": round(sum(ordered) / len(ordered) * 1e3, 3), "p50": percentile(0.5),
+            "p99": percentile(0.99), "max": round(ordered[-1] * 1e3, 3)}
+
+def churn(sim, vms, vm_ids, count, lifetime):
+    """
+    Starts a fleet of VMs and keeps it turning over: every VM runs for an
+    exponentially distributed lifetime and is then replaced by a VM on a free ID.
+    Args:
+        sim (Simulation): The simulation.
+        vms (SimulatedVMs): The VMs driver.
+        vm_ids (iterable): The IDs the fleet may use.
+        count (int): The number of VMs to keep running.
+        lifetime (float): The mean lifetime of a VM in virtual seconds.
+    Returns:
+        list: The IDs of the VMs started first.
+    """
+    free = deque(vm_ids)
+    def launch(number):
+        started = vms.start([free.popleft() for _ in range(min(number, len(free)))])
+        for vm_id in started:
+            sim.schedule(sim.rng.expovariate(1.0 / lifetime), replace, vm_id)
+        return started
+    def replace(vm_id):
+        vms.stop([vm_id])
+        free.append(vm_id)
+        launch(1)
+    return launch(count)
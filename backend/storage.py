@@ -7,24 +7,63 @@ simulated cloud environment.
 Functions:
 - create_bucket(bucket_name): Creates a new bucket with the specified name
 if it does not already exist.
-- upload_file(bucket_name, file_name, file_content): Uploads a file with the
+- upload_file(bucket_name, file_name, file_content): Streams a file with the
 specified name and content to the specified bucket.
+- record_file(bucket_name, file_name, checksum): Records a file written to a
+bucket in the catalog.
+- get_file_path(bucket_name, file_name): Returns the path of a file in the
+specified bucket, for streaming it back to a client.
 - delete_file(bucket_name, file_name): Deletes a file with the specified name
-from the specified bucket.
+from the specified bucket. Its blob is reclaimed by blob_store.collect_garbage
+once no other file references it.
 - delete_bucket(bucket_name): Deletes a bucket with the specified name if it
 exists and is empty.
+- list_files(bucket_name, prefix="", delimiter=None, max_keys=MAX_KEYS,
+continuation_token=None): Lists the files of a bucket a page at a time.
+
+Bucket and file metadata is recorded in a SQLite catalog, which answers listings
+and emptiness checks without scanning the bucket directories. Buckets created
+before the catalog existed are indexed from disk when it is first opened.
 
 Global Variables:
 - ROOT_STORAGE_DIR: The root directory where all storage buckets are located.
 If it does not exist, it is created at module initialization.
+- CATALOG_PATH: The SQLite database holding the bucket and file metadata.
+- catalog: The Catalog of all buckets and files.
 """
 import os
+import blob_store
+import instrumentation
+from catalog import MAX_KEYS, Catalog
+from object_cache import file_etag, hot_cache
 
 ROOT_STORAGE_DIR = "storage"
+CATALOG_PATH = "catalog.db"
 
 if not os.path.exists(ROOT_STORAGE_DIR):
     os.makedirs(ROOT_STORAGE_DIR)
 
+catalog = Catalog(CATALOG_PATH)
+
+def _index_existing_buckets():
+    """
+    Records buckets and files that are on disk but not in the catalog.
+    """
+    known = set(catalog.list_buckets())
+    for entry in os.scandir(ROOT_STORAGE_DIR):
+        if not entry.is_dir() or entry.name in known:
+            continue
+        catalog.create_bucket(entry.name)
+        rows = []
+        for file_entry in os.scandir(entry.path):
+            if file_entry.is_file() and not file_entry.name.startswith('.'):
+                stat = file_entry.stat()
+                rows.append((file_entry.name, stat.st_size, file_etag(stat),
+                             stat.st_mtime_ns, None))
+        catalog.put_objects(entry.name, rows)
+
+_index_existing_buckets()
+
 def create_bucket(bucket_name):
     """
     Creates a new bucket with the specified name if it does not already exist.
@@ -36,26 +75,61 @@ def create_bucket(bucket_name):
     bucket_path = os.path.join(ROOT_STORAGE_DIR, bucket_name)
     if not os.path.exists(bucket_path):
         os.makedirs(bucket_path)
+        catalog.create_bucket(bucket_name)
         return {"message": f"Bucket {bucket_name} created!"}
     return {"message": f"Bucket {bucket_name} already exists!"}
 
 def upload_file(bucket_name, file_name, file_content):
     """
     Uploads a file with the specified name and content to the specified bucket.
+    The content is streamed to disk in chunks and stored once in the blob store;
+    the bucket file is a link to the blob, shared with identical files elsewhere.
     Args:
         bucket_name (str): The name of the bucket to upload the file to.
         file_name (str): The name of the file to upload.
-        file_content (str): The content of the file to upload.
+        file_content (file-like or bytes): The content of the file to upload.
     Returns:
-        dict: A dictionary containing the result of the operation.
+        dict: A dictionary containing the result of the operation, the file size,
+        its SHA-256 checksum and whether its content was already stored.
     """
-    bucket_path = os.path.join(ROOT_STORAGE_DIR, bucket_name)
-    if not os.path.exists(bucket_path):
+    if not catalog.bucket_exists(bucket_name):
         return {"error": f"Bucket {bucket_name} does not exist!"}
-    file_path = os.path.join(bucket_path, file_name)
-    with open(file_path, 'wb') as f:
-        f.write(file_content)
-    return {"message": f"File {file_name} uploaded to {bucket_name}!"}
+    file_path = os.path.join(ROOT_STORAGE_DIR, bucket_name, file_name)
+    size, checksum, deduplicated = blob_store.store(file_content, file_path)
+    instrumentation.count("storage.bytes_written", size)
+    record_file(bucket_name, file_name, checksum)
+    return {"message": f"File {file_name} uploaded to {bucket_name}!",
+            "size": size, "sha256": checksum, "deduplicated": deduplicated}
+
+def record_file(bucket_name, file_name, checksum):
+    """
+    Records a file that was just written to a bucket in the catalog and drops
+    any cached copy of its old content.
+    Args:
+        bucket_name (str): The name of the bucket containing the file.
+        file_name (str): The name of the file.
+        checksum (str): The hex SHA-256 digest of the file's content.
+    """
+    file_path = os.path.join(ROOT_STORAGE_DIR, bucket_name, file_name)
+    hot_cache.invalidate(file_path)
+    stat = os.stat(file_path)
+    catalog.put_object(bucket_name, file_name,
+                       {"size": stat.st_size, "etag": file_etag(stat),
+                        "mtime": stat.st_mtime_ns}, checksum)
+
+def get_file_path(bucket_name, file_name):
+    """
+    Returns the on-disk path of a file in the specified bucket.
+    Args:
+        bucket_name (str): The name of the bucket containing the file.
+        file_name (str): The name of the file.
+    Returns:
+        str: The path of the file, or None if it does not exist.
+    """
+    file_path = os.path.join(ROOT_STORAGE_DIR, bucket_name, file_name)
+    if file_path in hot_cache or os.path.isfile(file_path):
+        return file_path
+    return None
 
 def delete_file(bucket_name, file_name):
     """
@@ -69,21 +143,57 @@ def delete_file(bucket_name, file_name):
     file_path = os.path.join(ROOT_STORAGE_DIR, bucket_name, file_name)
     if os.path.exists(file_path):
         os.remove(file_path)
+        hot_cache.invalidate(file_path)
+        catalog.delete_object(bucket_name, file_name)
         return {"message": f"File {file_name} deleted from {bucket_name}!"}
     return {"message": f"File {file_name} does not exist in {bucket_name}!"}
 
 def delete_bucket(bucket_name):
     """
-    Deletes a bucket with the specified name if it exists and is empty.
+    Deletes a bucket with the specified name if it exists and is empty. Emptiness
+    is checked in the catalog rather than by listing the bucket directory.
+    Temporary files left in the bucket by unfinished uploads are removed with it.
     Args:
         bucket_name (str): The name of the bucket to delete.
     Returns:
-        dict: A dictionary containing the result of the operation.
+        dict: A dictionary containing the result of the operation, or an error
+        if the bucket directory could not be removed.
     """
-    bucket_path = os.path.join(ROOT_STORAGE_DIR, bucket_name)
-    if os.path.exists(bucket_path):
-        if os.listdir(bucket_path):
+    if catalog.bucket_exists(bucket_name):
+        if not catalog.delete_bucket(bucket_name):
             return {"message": f"Bucket {bucket_name} is not empty and cannot be deleted!"}
-        os.rmdir(bucket_path)
+        bucket_path = os.path.join(ROOT_STORAGE_DIR, bucket_name)
+        try:
+            for entry in os.scandir(bucket_path):
+                if entry.name.startswith(('.upload-', '.clone-')):
+                    os.remove(entry.path)
+            os.rmdir(bucket_path)
+        except OSError as e:
+            # Keep the bucket recorded while its directory is still there.
+            catalog.create_bucket(bucket_name)
+            return {"error": f"Bucket {bucket_name} cannot be deleted: {e.strerror}"}
         return {"message": f"Bucket {bucket_name} deleted!"}
     return {"message": f"Bucket {bucket_name} does not exist!"}
+
+def list_files(bucket_name, prefix="", delimiter=None, max_keys=MAX_KEYS,
+               continuation_token=None):
+    """
+    Lists the files of a bucket in name order, one page at a time.
+    Args:
+        bucket_name (str): The name of the bucket to list.
+        prefix (str): Only files whose names start with this prefix are listed.
+        delimiter (str): Names containing the delimiter after the prefix are
+            rolled up into common prefixes.
+        max_keys (int): The most files plus common prefixes per page.
+        continuation_token (str): The token returned with the previous page.
+    Returns:
+        dict: The files with their size, ETag, mtime and SHA-256 checksum, the
+        common prefixes and the token of the next page, or an error.
+    """
+    if not catalog.bucket_exists(bucket_name):
+        return {"error": f"Bucket {bucket_name} does not exist!"}
+    try:
+        return catalog.list_objects(bucket_name, prefix, delimiter, max_keys,
+                                    continuation_token)
+    except ValueError as e:
+        return {"error": str(e)}
@@ -0,0 +1,177 @@
+"""
+Streaming Module
+
+This module copies upload streams to disk in bounded chunks. The data is written
+to a temporary file next to the destination and renamed into place once
+complete, so readers never see a partial object, and its SHA-256 checksum is
+computed in the same pass. Peak memory per upload is one chunk, whatever the
+object size.
+
+It also clones files that are already on disk as cheaply as the filesystem
+allows: a hardlink, then a reflink, then an in-kernel os.copy_file_range, and a
+plain byte copy only as the last resort.
+
+Functions:
+- write_stream(stream, dest_path, chunk_size=CHUNK_SIZE): Writes a stream to
+dest_path atomically and returns its size and checksum.
+- spool_stream(stream, directory, chunk_size=CHUNK_SIZE): Writes a stream to a
+temporary file and returns its path, size and checksum.
+- clone_file(src_path, dest_path): Atomically places a copy of src_path at
+dest_path and returns the method used.
+- append_file(src_path, dst): Appends a file to an open file in the kernel where
+possible.
+
+Global Variables:
+- CHUNK_SIZE: The number of bytes read from a stream at a time.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import uuid
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; reflinks are skipped there.
+    fcntl = None
+
+CHUNK_SIZE = 1 << 20
+
+# ioctl request number for FICLONE (Linux), which shares extents between files.
+_FICLONE = 0x40049409
+
+def write_stream(stream, dest_path, chunk_size=CHUNK_SIZE):
+    """
+    Writes a stream to dest_path through a temporary file and an atomic rename.
+    Args:
+        stream (file-like or bytes): The data to write. Anything with a read()
+            method is read in chunks; bytes and str are written as they are.
+        dest_path (str): The final path of the file.
+        chunk_size (int): The number of bytes read from the stream at a time.
+    Returns:
+        tuple: The number of bytes written and the hex SHA-256 digest of the data.
+    """
+    tmp_path, size, checksum = spool_stream(stream, os.path.dirname(dest_path) or '.',
+                                            chunk_size)
+    try:
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return size, checksum
+
+def spool_stream(stream, directory, chunk_size=CHUNK_SIZE):
+    """
+    Writes a stream to a new temporary file in directory, for callers that only
+    know the final name once the data has been seen.
+    Args:
+        stream (file-like or bytes): The data to write.
+        directory (str): The directory of the temporary file.
+        chunk_size (int): The number of bytes read from the stream at a time.
+    Returns:
+        tuple: The path of the temporary file, the number of bytes written and
+        the hex SHA-256 digest of the data. The caller renames or removes the file.
+    """
+    if isinstance(stream, str):
+        stream = stream.encode('utf-8')
+    if isinstance(stream, (bytes, bytearray, memoryview)):
+        stream = io.BytesIO(stream)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        # mkstemp creates the file owner-only; give it the usual file mode.
+        os.chmod(tmp_path, 0o644)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return tmp_path, size, digest.hexdigest()
+
+def clone_file(src_path, dest_path):
+    """
+    Atomically places a copy of src_path at dest_path, using the cheapest method
+    the filesystem supports. The copy is built under a temporary name and renamed
+    into place, so readers of dest_path see either the old or the new file.
+    Args:
+        src_path (str): The file to copy.
+        dest_path (str): The path of the copy.
+    Returns:
+        str: The method used: "hardlink", "reflink", "copy_file_range" or "copy".
+    """
+    tmp_path = os.path.join(os.path.dirname(dest_path) or '.', f".clone-{uuid.uuid4().hex}")
+    try:
+        method = _clone(src_path, tmp_path)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return method
+
+def append_file(src_path, dst):
+    """
+    Appends the content of src_path to an open file with os.copy_file_range, so
+    the data is copied in the kernel (or its extents shared, on filesystems that
+    support it) rather than through user space. Falls back to a chunked copy.
+    Args:
+        src_path (str): The file to append.
+        dst (file): The destination, opened unbuffered in binary write mode.
+    Returns:
+        int: The number of bytes appended.
+    """
+    with open(src_path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        remaining = size
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except OSError:
+                pass
+        if remaining:
+            src.seek(size - remaining)
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    return size
+
+def _clone(src_path, tmp_path):
+    try:
+        os.link(src_path, tmp_path)
+        return "hardlink"
+    except OSError:
+        pass
+    with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                if remaining == 0:
+                    return "copy_file_range"
+            except OSError:
+                pass
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return "copy"
@@ -0,0 +1,482 @@
+"""
+VM Backends Module
+
+This module holds the drivers that run the workloads of running VMs. vm_simulator
+hands every start and stop to its current backend, and the backend writes each
+VM's CPU and memory usage to the VM table and the metrics store, where
+monitor_vm and the metrics routes read them.
+
+- PooledBackend ticks a load model per VM on the shared VMScheduler thread. A VM
+  costs a few hundred bytes, but its usage is derived from host-wide numbers.
+- ProcessBackend runs a workload in one OS process per VM and accounts each VM
+  from its process's counters in /proc.
+- CgroupBackend also runs one process per VM, inside a cgroup v2 group of its
+  own with cpu.max and memory.max limits, and accounts each VM from the group's
+  cpu.stat and memory.current. The process joins its group before it runs the
+  workload.
+
+The process and cgroup backends read the counters of every VM in one pass per
+tick interval, from one collector thread, and write the results to the table
+under one lock acquisition. A VM's CPU usage is the CPU time it used since the
+previous pass as a percentage of its vCPUs, and its memory usage is its resident
+memory as a percentage of its memory size.
+
+Limits need the cpu and memory controllers, which the parent of the cgroup root
+must delegate. Without them the cgroup backend still isolates and accounts CPU
+time per VM, and takes memory from the resident set of the VM's process.
+
+Classes:
+    VMBackend: The interface of a VM backend.
+    PooledBackend: Runs VMs on the pooled scheduler.
+    ProcessBackend: Runs every VM in its own process.
+    CgroupBackend: Runs every VM in its own process and cgroup v2 group.
+
+Functions:
+    cgroup_mount(): Returns where the cgroup v2 hierarchy is mounted.
+
+Global Variables:
+    VM_BACKEND_ENV (str): Environment variable naming the engine's VM backend.
+    CGROUP_ROOT_ENV (str): Environment variable naming the cgroup the VM groups
+        are created in.
+    BACKENDS (tuple): The names of the backends.
+    DEFAULT_VCPUS (float): The vCPUs of a VM.
+    DEFAULT_MEMORY (int): The bytes of memory of a VM.
+    CPU_PERIOD (int): The cpu.max period in microseconds.
+"""
+
+import abc
+import multiprocessing
+import os
+import threading
+import time
+import psutil
+from vm_scheduler import TICK_INTERVAL
+
+VM_BACKEND_ENV = "CLOUD_SIM_VM_BACKEND"
+CGROUP_ROOT_ENV = "CLOUD_SIM_CGROUP_ROOT"
+BACKENDS = ("pooled", "process", "cgroup")
+DEFAULT_VCPUS = 1.0
+DEFAULT_MEMORY = 256 * 1024 * 1024
+CPU_PERIOD = 100000
+
+# VM processes are forked from a fork server, not from the engine: a fork of the
+# engine would inherit its sockets, VM table and state directory lock, and keep
+# the directory locked after a crash for as long as the orphaned VMs live.
+_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else None)
+_HAS_PROC = os.path.isdir("/proc/self")
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if _HAS_PROC else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if _HAS_PROC else 4096
+
+def _read_file(path):
+    # os.read skips the buffering and decoding of open(), which matters when
+    # the collector reads thousands of small files per pass.
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 4096)
+    finally:
+        os.close(fd)
+
+def _write_file(path, value):
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.write(fd, value.encode())
+    finally:
+        os.close(fd)
+
+def _process_usage(pid):
+    """
+    Returns the CPU seconds and resident bytes of a process, or None if it is gone.
+    """
+    if not _HAS_PROC:
+        try:
+            process = psutil.Process(pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        # The command name in parentheses may contain spaces; fields follow it.
+        fields = _read_file(f"/proc/{pid}/stat").rsplit(b")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, int(fields[21]) * _PAGE_SIZE
+
+def _percent(value, total):
+    return round(min(100.0, max(0.0, 100.0 * value / total)), 1)
+
+def cgroup_mount():
+    """
+    Returns the mount point of the cgroup v2 hierarchy, or None if it is not
+    mounted. On hybrid hosts it is usually /sys/fs/cgroup/unified.
+    """
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                # Optional fields end at "-", which the filesystem type follows.
+                if fields[fields.index("-") + 1] == "cgroup2":
+                    return fields[4]
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+class VMBackend(abc.ABC):
+    """
+    The interface of a VM backend. vm_simulator calls it with the VM IDs it
+    starts and stops, inside its own bookkeeping of the table and networks.
+    """
+    name = None
+
+    @abc.abstractmethod
+    def __len__(self):
+        """
+        Returns the number of VMs the backend runs.
+        """
+
+    @abc.abstractmethod
+    def start(self, vm_ids, table):
+        """
+        Starts the workloads of VMs.
+        Args:
+            vm_ids (list): The IDs of the VMs.
+            table (VMTable): The table the VMs' metrics are written to.
+        Returns:
+            tuple: The pid backing each VM started, and an error message for
+            each VM that could not be started.
+        """
+
+    @abc.abstractmethod
+    def stop(self, vm_ids):
+        """
+        Stops the workloads of VMs. No metrics are written to them once this
+        returns.
+        Args:
+            vm_ids (list): The IDs of the VMs.
+        """
+
+    @abc.abstractmethod
+    def close(self):
+        """
+        Stops every workload the backend runs.
+        """
+
+class PooledBackend(VMBackend):
+    """
+    Runs VMs on the pooled scheduler: every VM is backed by this process.
+    """
+    name = "pooled"
+
+    def __init__(self, scheduler):
+        """
+        Args:
+            scheduler (VMScheduler): The scheduler that ticks the VMs.
+        """
+        self.scheduler = scheduler
+        self._vm_ids = set()
+
+    def __len__(self):
+        return len(self._vm_ids)
+
+    def start(self, vm_ids, table):
+        self.scheduler.add_many(vm_ids, table)
+        self._vm_ids.update(vm_ids)
+        return dict.fromkeys(vm_ids, os.getpid()), {}
+
+    def stop(self, vm_ids):
+        self.scheduler.remove_many(vm_ids)
+        self._vm_ids.difference_update(vm_ids)
+
+    def close(self):
+        self.stop(list(self._vm_ids))
+
+class _Workload:  # pylint: disable=too-few-public-methods
+    """
+    Per-VM bookkeeping of a process-backed VM.
+    """
+    __slots__ = ("vm_id", "table", "process", "group", "cpu_time", "sampled_at")
+
+    def __init__(self, vm_id, table, process, group=None):
+        self.vm_id = vm_id
+        self.table = table
+        self.process = process
+        self.group = group
+        self.cpu_time = 0.0
+        self.sampled_at = time.monotonic()
+
+class ProcessBackend(VMBackend):  # pylint: disable=too-many-instance-attributes
+    """
+    Runs every VM's workload in its own process and accounts it from /proc.
+    """
+    name = "process"
+
+    def __init__(self, target, store=None, *, vcpus=DEFAULT_VCPUS, memory=DEFAULT_MEMORY,  # pylint: disable=too-many-arguments
+                 tick_interval=TICK_INTERVAL):
+        """
+        Args:
+            target (callable): The workload, called with the VM ID and a dict in
+                the VM's process.
+            store (MetricsStore): The store usage is recorded in, if any.
+            vcpus (float): The vCPUs of a VM, against which CPU usage is measured.
+            memory (int): The bytes of memory of a VM.
+            tick_interval (float): Seconds between two passes of the collector.
+        """
+        self.target = target
+        self.store = store
+        # The fork server imports the workload's module once for every VM.
+        _CONTEXT.set_forkserver_preload([target.__module__])
+        self.vcpus = vcpus
+        self.memory = memory
+        self.tick_interval = tick_interval
+        self._workloads = {}
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._workloads)
+
+    def start(self, vm_ids, table):
+        pids, errors, replaced = {}, {}, []
+        for vm_id in vm_ids:
+            try:
+                workload = self._spawn(vm_id, table)
+            except OSError as e:
+                errors[vm_id] = str(e)
+                continue
+            usage = self._usage(workload)
+            if usage is not None:
+                workload.cpu_time = usage[0]
+            with self._lock:
+                old = self._workloads.get(vm_id)
+                self._workloads[vm_id] = workload
+            if old is not None:
+                replaced.append(old)
+            pids[vm_id] = workload.process.pid
+        self._terminate(replaced)
+        if pids:
+            self._ensure_running()
+        return pids, errors
+
+    def stop(self, vm_ids):
+        with self._lock:
+            workloads = [self._workloads.pop(vm_id) for vm_id in vm_ids
+                         if vm_id in self._workloads]
+        self._terminate(workloads)
+
+    def close(self):
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.stop(list(self._workloads))
+
+    def collect(self):
+        """
+        Reads the usage of every VM in one pass and writes it to the VM table
+        and the metrics store.
+        Returns:
+            int: The number of VMs updated.
+        """
+        with self._lock:
+            workloads = list(self._workloads.values())
+        readings = []
+        for workload in workloads:
+            usage = self._usage(workload)
+            if usage is None:
+                continue
+            cpu_time, memory = usage
+            now = time.monotonic()
+            elapsed = now - workload.sampled_at
+            if elapsed <= 0:
+                continue
+            readings.append((workload, _percent(cpu_time - workload.cpu_time,
+                                                elapsed * self.vcpus),
+                             _percent(memory, self.memory)))
+            workload.cpu_time, workload.sampled_at = cpu_time, now
+        updated = 0
+        with self._lock:
+            for workload, cpu, memory in readings:
+                if self._workloads.get(workload.vm_id) is workload:
+                    workload.table.set_metrics(workload.vm_id, cpu, memory)
+                    # Under the lock, so no sample lands after the VM is stopped.
+                    if self.store is not None:
+                        self.store.record(workload.vm_id, cpu, memory)
+                    updated += 1
+        return updated
+
+    def _spawn(self, vm_id, table):
+        process = _CONTEXT.Process(target=self.target, args=(vm_id, {}), daemon=True)
+        process.start()
+        return _Workload(vm_id, table, process)
+
+    def _usage(self, workload):
+        """
+        Returns the CPU seconds and resident bytes of a VM, or None if its
+        workload is gone.
+        """
+        return _process_usage(workload.process.pid)
+
+    def _release(self, workload):
+        """
+        Cleans up after a workload whose process has exited.
+        """
+
+    def _terminate(self, workloads):
+        for workload in workloads:
+            workload.process.terminate()
+        for workload in workloads:
+            workload.process.join(5)
+            if workload.process.is_alive():
+                workload.process.kill()
+                workload.process.join()
+            workload.process.close()
+            self._release(workload)
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._closing.clear()
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-collector",
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._closing.wait(self.tick_interval):
+            self.collect()
+
+def _run_in_group(group, ready, target, vm_id):
+    """
+    Runs a VM's workload in the VM's process after moving the process into the
+    VM's cgroup, so that none of its usage escapes the group's limits. Sends
+    None, or the error that kept it out of the group, through `ready` first.
+    """
+    try:
+        _write_file(os.path.join(group, "cgroup.procs"), str(os.getpid()))
+    except OSError as e:
+        ready.send(f"Cannot join the cgroup {group}: {e}")
+        ready.close()
+        return
+    ready.send(None)
+    ready.close()
+    target(vm_id, {})
+
+class CgroupBackend(ProcessBackend):
+    """
+    Runs every VM's workload in its own process and cgroup v2 group, limited to
+    the VM's vCPUs and memory when the cpu and memory controllers are available.
+    """
+    name = "cgroup"
+
+    def __init__(self, target, store=None, root=None, **kwargs):
+        """
+        Args:
+            target (callable): The workload, see ProcessBackend.
+            store (MetricsStore): The store usage is recorded in, if any.
+            root (str): The cgroup the VM groups are created in. Defaults to
+                CLOUD_SIM_CGROUP_ROOT, or cloud-sim under the cgroup v2 mount.
+            **kwargs: vcpus, memory and tick_interval, see ProcessBackend.
+        Raises:
+            RuntimeError: If there is no cgroup v2 hierarchy or the root cannot
+                be created.
+        """
+        super().__init__(target, store, **kwargs)
+        if root is None:
+            root = os.environ.get(CGROUP_ROOT_ENV)
+        if root is None:
+            mount = cgroup_mount()
+            if mount is None:
+                raise RuntimeError("No cgroup v2 hierarchy is mounted.")
+            root = os.path.join(mount, "cloud-sim")
+        try:
+            os.makedirs(root, exist_ok=True)
+        except OSError as e:
+            raise RuntimeError(f"Cannot create the cgroup {root}: {e}") from e
+        self.root = root
+        self.controllers = self._enable_controllers()
+
+    def _enable_controllers(self):
+        """
+        Enables the cpu and memory controllers for the VM groups, as far as the
+        root's parent delegates them, and returns the ones enabled.
+        """
+        available = _read_file(os.path.join(self.root, "cgroup.controllers")).split()
+        subtree = os.path.join(self.root, "cgroup.subtree_control")
+        for controller in (b"cpu", b"memory"):
+            if controller in available:
+                try:
+                    _write_file(subtree, f"+{controller.decode()}")
+                except OSError:
+                    pass
+        return {controller.decode() for controller in _read_file(subtree).split()}
+
+    def _spawn(self, vm_id, table):
+        group = os.path.join(self.root, f"vm-{vm_id}")
+        try:
+            os.mkdir(group)
+        except FileExistsError:
+            # Left over by a run that did not stop its VMs.
+            self._kill_group(group)
+            os.mkdir(group)
+        try:
+            if "cpu" in self.controllers:
+                _write_file(os.path.join(group, "cpu.max"),
+                            f"{int(self.vcpus * CPU_PERIOD)} {CPU_PERIOD}")
+            if "memory" in self.controllers:
+                _write_file(os.path.join(group, "memory.max"), str(self.memory))
+            reader, writer = _CONTEXT.Pipe(duplex=False)
+            process = _CONTEXT.Process(target=_run_in_group, daemon=True,
+                                       args=(group, writer, self.target, vm_id))
+            process.start()
+        except OSError:
+            self._kill_group(group)
+            raise
+        writer.close()
+        try:
+            error = reader.recv()
+        except EOFError:
+            error = "The VM process exited before it joined its cgroup."
+        finally:
+            reader.close()
+        workload = _Workload(vm_id, table, process, group)
+        if error is not None:
+            self._terminate([workload])
+            raise OSError(error)
+        return workload
+
+    def _usage(self, workload):
+        memory = None
+        try:
+            # usage_usec is the first line of cpu.stat.
+            cpu_stat = _read_file(os.path.join(workload.group, "cpu.stat"))
+            cpu_time = int(cpu_stat.split(None, 2)[1]) / 1e6
+            if "memory" in self.controllers:
+                memory = int(_read_file(os.path.join(workload.group, "memory.current")))
+        except (OSError, ValueError, IndexError):
+            return None
+        if memory is None:
+            usage = _process_usage(workload.process.pid)
+            if usage is None:
+                return None
+            memory = usage[1]
+        return cpu_time, memory
+
+    def _release(self, workload):
+        self._kill_group(workload.group)
+
+    @staticmethod
+    def _kill_group(group):
+        """
+        Kills any process left in a group and removes it.
+        """
+        kill = os.path.join(group, "cgroup.kill")
+        for _ in range(50):
+            try:
+                if os.path.exists(kill):
+                    _write_file(kill, "1")
+                os.rmdir(group)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                # The group stays busy until its killed processes have exited.
+                time.sleep(0.01)
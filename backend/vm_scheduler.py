@@ -0,0 +1,177 @@
+"""
+VM Scheduler Module
+
+This module runs simulated virtual machines (VMs) inside a single engine thread
+instead of one operating system process per VM. Each VM is a lightweight state
+object that the engine ticks on a fixed interval, so thousands of VMs fit in the
+memory of one process. Host metrics are sampled once per wake-up and fanned out
+to every due VM through its load model, and each tick's values are recorded
+in the metrics store, if one is given.
+
+Classes:
+    VMScheduler: Ticks registered VMs from one background thread.
+
+Global Variables:
+    TICK_INTERVAL (float): Seconds between two updates of the same VM.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from metrics_sampler import LoadModel, MetricsSampler
+
+TICK_INTERVAL = 6.0
+
+
+class _VMState:  # pylint: disable=too-few-public-methods
+    """
+    Per-VM bookkeeping held by the scheduler.
+    """
+    __slots__ = ("vm_id", "table", "load", "active")
+
+    def __init__(self, vm_id, table):
+        self.vm_id = vm_id
+        self.table = table
+        self.load = LoadModel(vm_id)
+        self.active = True
+
+
+class VMScheduler:  # pylint: disable=too-many-instance-attributes
+    """
+    Ticks every registered VM once per tick interval from one background thread.
+
+    VMs are kept in a heap ordered by their next due time, so each wake-up only
+    touches the VMs that are due. Removed VMs are dropped lazily when they reach
+    the top of the heap.
+    """
+
+    def __init__(self, tick_interval=TICK_INTERVAL, sampler=None, store=None):
+        self.tick_interval = tick_interval
+        self.sampler = sampler if sampler is not None else MetricsSampler()
+        self.store = store
+        self._vms = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __contains__(self, vm_id):
+        return vm_id in self._vms
+
+    def __len__(self):
+        return len(self._vms)
+
+    def add(self, vm_id, table):
+        """
+        Registers a VM and schedules its first tick immediately.
+        Args:
+            vm_id (int): The ID of the VM.
+            table (VMTable): The table the VM's metrics are written to.
+        """
+        with self._cond:
+            old = self._vms.get(vm_id)
+            if old is not None:
+                old.active = False
+            state = _VMState(vm_id, table)
+            self._vms[vm_id] = state
+            heapq.heappush(self._queue, (time.monotonic(), next(self._seq), state))
+            self._ensure_running()
+            self._cond.notify()
+
+    def add_many(self, vm_ids, table):
+        """
+        Registers several VMs with one lock acquisition and one heap rebuild.
+        Their first ticks are spread over one tick interval so a large batch
+        does not all come due at once.
+        Args:
+            vm_ids (list): The IDs of the VMs.
+            table (VMTable): The table the VMs' metrics are written to.
+        """
+        if not vm_ids:
+            return
+        now = time.monotonic()
+        step = self.tick_interval / len(vm_ids)
+        with self._cond:
+            for i, vm_id in enumerate(vm_ids):
+                old = self._vms.get(vm_id)
+                if old is not None:
+                    old.active = False
+                state = _VMState(vm_id, table)
+                self._vms[vm_id] = state
+                self._queue.append((now + i * step, next(self._seq), state))
+            heapq.heapify(self._queue)
+            self._ensure_running()
+            self._cond.notify()
+
+    def remove(self, vm_id):
+        """
+        Unregisters a VM. No tick writes to it once this returns.
+        Args:
+            vm_id (int): The ID of the VM.
+        Returns:
+            bool: True if the VM was registered.
+        """
+        with self._cond:
+            state = self._vms.pop(vm_id, None)
+            if state is None:
+                return False
+            state.active = False
+            return True
+
+    def remove_many(self, vm_ids):
+        """
+        Unregisters several VMs with one lock acquisition.
+        Args:
+            vm_ids (list): The IDs of the VMs.
+        Returns:
+            int: The number of VMs that were registered.
+        """
+        removed = 0
+        with self._cond:
+            for vm_id in vm_ids:
+                state = self._vms.pop(vm_id, None)
+                if state is not None:
+                    state.active = False
+                    removed += 1
+        return removed
+
+    def _ensure_running(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="vm-scheduler",
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                delay = self._queue[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                now = time.monotonic()
+                due = []
+                while self._queue and self._queue[0][0] <= now:
+                    _, _, state = heapq.heappop(self._queue)
+                    if state.active:
+                        due.append(state)
+                next_due = now + self.tick_interval
+                for state in due:
+                    heapq.heappush(self._queue, (next_due, next(self._seq), state))
+            if due:
+                snapshot = self.sampler.sample()
+                for state in due:
+                    self._tick(state, snapshot, now)
+
+    def _tick(self, state, snapshot, now):
+        cpu_usage, mem_usage = state.load.apply(snapshot, now)
+        with self._cond:
+            if not state.active:
+                return
+            state.table.set_metrics(state.vm_id, cpu_usage, mem_usage)
+            # Recorded under the lock, so a VM's series cannot be recreated
+            # after it is removed and its history dropped.
+            if self.store is not None:
+                self.store.record(state.vm_id, cpu_usage, mem_usage)
@@ -2,23 +2,72 @@
 VM Simulator Module
 
 This module provides functionality to simulate virtual machines (VMs) using the `psutil` library
-to monitor CPU and memory usage. It uses multiprocessing to run each VM simulation in a separate
-process.
+to monitor CPU and memory usage. The workloads of running VMs are run by a VM backend: by
+default a single pooled scheduler in the current process ticks them, rather than one operating
+system process each, and use_backend switches to one process or one cgroup per VM, which report
+the usage each VM really has. See the vm_backends module.
+
+VM lifecycle changes run in state journal transactions, so with a state directory
+open the VMs and their networks survive a restart; see restore_state and the
+persistence module.
 
 Functions:
     simulate_vm(vm_id, vm_dict): Simulates a VM by periodically updating its CPU and memory usage.
+        The workload of the process backend.
+    run_workload(vm_id, vm_dict): Uses CPU and memory along the VM's load profile. The
+        workload of the cgroup backend.
+    use_backend(name), get_backend(): Select and return the VM backend.
+    start_vms(vm_ids, vms), stop_vms(vm_ids, vms), delete_vms(vm_ids, vms),
+    monitor_vms(vm_ids, vms): Act on a batch of VMs in one call, allocating networks
+        and registering VMs with the scheduler in bulk, and return a result per VM.
+    restore_state(vms, directory): Recovers the VMs and networks saved in a state
+        directory and journals further changes there.
+
+Global Variables:
+    sampler (MetricsSampler): Shared host metrics sampler read once per tick.
+    metrics_store (MetricsStore): The CPU and memory history of every VM.
+    scheduler (VMScheduler): The engine that ticks every running VM of the pooled backend.
+    WORKLOAD_CPU (float): The CPU usage in percent run_workload's load profiles vary around.
+    WORKLOAD_MEMORY (int): The bytes of memory run_workload holds.
+    WORKLOAD_SLICE (float): Seconds over which run_workload spreads its CPU usage.
 
 Dependencies:
+    - os
     - time
     - psutil
-    - json
-    - multiprocessing
+    - metrics_sampler (custom module)
+    - vm_backends (custom module)
+    - metrics_store (custom module)
+    - persistence (custom module)
+    - vm_scheduler (custom module)
+    - vm_table (custom module)
+    - vpc (custom module)
 """
 
+import functools
+import os
 import time
-from multiprocessing import Process
 import psutil
-from ip_assignment import assign_ip, create_network, delete_network, networks
+from ip_assignment import (attach_vm, create_network, create_networks, delete_network,
+                           delete_networks, networks, restore_networks)
+from metrics_sampler import LoadModel, MetricsSampler
+from metrics_store import MetricsStore
+from persistence import journal, replay, snapshot_state
+from vm_backends import CgroupBackend, PooledBackend, ProcessBackend
+from vm_scheduler import VMScheduler
+from vpc import detach_from_vpc, detach_from_vpcs
+
+sampler = MetricsSampler()
+metrics_store = MetricsStore()
+scheduler = VMScheduler(sampler=sampler, store=metrics_store)
+WORKLOAD_CPU = 25.0
+WORKLOAD_MEMORY = 16 * 1024 * 1024
+WORKLOAD_SLICE = 0.1
+
+_backend = {"backend": PooledBackend(scheduler)}
+# When each pid was last recorded backing a VM, written to snapshots so that
+# recovery only reaps processes that are at least that old.
+_pid_times = {}
 
 def simulate_vm(vm_id, vm_dict):
     """
@@ -35,96 +84,151 @@ def simulate_vm(vm_id, vm_dict):
         vm_dict["memory"] = mem_usage
         time.sleep(5)
 
-def start_vm(vm_id, vms, manager):
+def run_workload(vm_id, vm_dict):
+    """
+    Uses CPU and memory along the VM's load profile: in every slice the
+    process busies the CPU for the share its load model gives and sleeps for
+    the rest, and it holds WORKLOAD_MEMORY bytes throughout.
+    Args:
+        vm_id (int): The ID of the VM.
+        vm_dict (dict): Receives the CPU usage the workload aims for.
+    """
+    load = LoadModel(vm_id, jitter=0.0)
+    # Filled with ones so every page is resident, not mapped to the zero page.
+    ballast = b"\x01" * WORKLOAD_MEMORY
+    vm_dict["memory"] = len(ballast)
+    while True:
+        share = load.apply((WORKLOAD_CPU, 0.0), time.time())[0] / 100
+        vm_dict["cpu"] = share * 100
+        deadline = time.perf_counter() + share * WORKLOAD_SLICE
+        while time.perf_counter() < deadline:
+            pass
+        time.sleep(WORKLOAD_SLICE * (1 - share))
+
+def use_backend(name):
+    """
+    Selects the backend that runs the workloads of VMs: pooled, process or cgroup.
+    Args:
+        name (str): The name of the backend.
+    Raises:
+        ValueError: If the name is unknown.
+        RuntimeError: If VMs are running on the current backend, or the cgroup
+            backend is not available.
+    """
+    if name == _backend["backend"].name:
+        return
+    if name == "pooled":
+        backend = PooledBackend(scheduler)
+    elif name == "process":
+        backend = ProcessBackend(simulate_vm, metrics_store)
+    elif name == "cgroup":
+        backend = CgroupBackend(run_workload, metrics_store)
+    else:
+        raise ValueError(f"Unknown VM backend {name}; use pooled, process or cgroup.")
+    if len(_backend["backend"]):
+        backend.close()
+        raise RuntimeError("VMs are running on the current backend.")
+    _backend["backend"] = backend
+
+def get_backend():
+    """
+    Returns the backend that runs the workloads of VMs.
+    """
+    return _backend["backend"]
+
+def start_vm(vm_id, vms):
     """
     Starts a VM with the given ID.
     Args:
         vm_id (int): The ID of the VM to start.
-        vms (dict): A dictionary containing information about running VMs.
-        manager (Manager): A multiprocessing Manager object.
+        vms (VMTable): The table containing information about VMs.
     Returns:
         dict: A dictionary containing the result of the operation.
     """
-    if vm_id not in vms or vms[vm_id]["status"] == "stopped":
-        network_id = create_network(vm_id)
-        ip = assign_ip(network_id)
-        vm_dict = manager.dict({'pid': None,
-                                'cpu': None,
-                                'memory': None,
-                                'status': 'running',
-                                'ip': ip
-                                })
-        p=Process(target=simulate_vm, args=(vm_id, vm_dict))
-        p.start()
-        vm_dict['pid'] = p.pid
-        vms[vm_id] = vm_dict
-        networks[network_id]["vms"].append(vm_id)
-        return {"message": f"VM {vm_id} started!"}
-    return {"message": f"VM {vm_id} already running!"}
+    with journal.transaction():
+        vm = vms.get(vm_id)
+        if vm is None or vm["status"] == "stopped":
+            try:
+                network_id = create_network(vm_id)
+            except ValueError as e:
+                return {"error": f"VM {vm_id} cannot be started: {e}"}
+            ip = attach_vm(network_id, vm_id)
+            if ip is None:
+                delete_network(vm_id)
+                return {"error": f"VM {vm_id} cannot be started, network {network_id} is full!"}
+            if not vms.insert(vm_id, "running", pid=os.getpid(), ip=ip):
+                delete_network(vm_id)
+                return {"error": f"VM {vm_id} cannot be started, the VM table is full!"}
+            pids, errors = _start_workloads([vm_id], vms, {vm_id} if vm else ())
+            if errors:
+                delete_network(vm_id)
+                return {"error": f"VM {vm_id} cannot be started: {errors[vm_id]}"}
+            _record_vm(vm_id, "running", pids[vm_id], ip)
+            print(f"VM {vm_id} started")
+            return {"message": f"VM {vm_id} started!"}
+        return {"message": f"VM {vm_id} already running!"}
 
 def stop_vm(vm_id, vms):
     """
     Stops a VM with the given ID.
     Args:
         vm_id (int): The ID of the VM to stop.
-        vms (dict): A dictionary containing information about running VMs.
+        vms (VMTable): The table containing information about VMs.
     Returns:
         dict: A dictionary containing the result of the operation.
     """
-    if vm_id in vms:
-        if vms[vm_id]["status"] == "running":
-            vm_dict = vms[vm_id]
-            if vm_dict["pid"] is not None:
-                p = psutil.Process(vm_dict["pid"])
-                p.terminate()
-                p.wait()
-            vm_dict["status"] = "stopped"
-            vm_dict["pid"] = None
-            vm_dict["cpu"] = None
-            vm_dict["memory"] = None
-            vm_dict["ip"] = None
-            delete_network(vm_id)
-            return {"message": f"VM {vm_id} stopped!"}
-        return {"message": f"VM {vm_id} already stopped!"}
-    return {"message": f"VM {vm_id} not found!"}
+    with journal.transaction():
+        vm = vms.get(vm_id)
+        if vm is not None:
+            if vm["status"] == "running":
+                get_backend().stop([vm_id])
+                vms.update(vm_id, status="stopped", pid=None, cpu=None, memory=None, ip=None)
+                _record_vm(vm_id, "stopped")
+                delete_network(vm_id)
+                return {"message": f"VM {vm_id} stopped!"}
+            return {"message": f"VM {vm_id} already stopped!"}
+        return {"message": f"VM {vm_id} not found!"}
 
 def delete_vm(vm_id, vms):
     """
     Deletes a VM with the given ID.
     Args:
         vm_id (int): The ID of the VM to delete.
-        vms (dict): A dictionary containing information about running VMs.
+        vms (VMTable): The table containing information about VMs.
     Returns:
         dict: A dictionary containing the result of the operation.
     """
-    if vm_id in vms:
-        if vms[vm_id]["pid"] is not None:
-            p = psutil.Process(vms[vm_id]["pid"])
-            p.terminate()
-            p.wait()
-        delete_network(vm_id)
-        del vms[vm_id]
-        return {"message": f"VM {vm_id} deleted!"}
-    return {"message": f"VM {vm_id} not found!"}
+    with journal.transaction():
+        if vm_id in vms:
+            get_backend().stop([vm_id])
+            delete_network(vm_id)
+            detach_from_vpc(vm_id)
+            vms.remove(vm_id)
+            journal.record("vm_deleted", vm_id)
+            metrics_store.drop(vm_id)
+            return {"message": f"VM {vm_id} deleted!"}
+        return {"message": f"VM {vm_id} not found!"}
 
 def monitor_vm(vm_id, vms):
     """
-    Monitors a VM with the given ID.
+    Monitors a VM with the given ID. Its CPU and memory usage are the latest
+    the VM backend wrote: derived from the host's on the pooled backend, and the
+    VM's own on the process and cgroup backends.
     Args:
         vm_id (int): The ID of the VM to monitor.
-        vms (dict): A dictionary containing information about running VMs.
+        vms (VMTable): The table containing information about VMs.
     Returns:
         dict: A dictionary containing the status of the VM.
     """
-    if vm_id in vms:
-        vm_dict = vms[vm_id]
+    vm = vms.get(vm_id)
+    if vm is not None:
         return {
             "vm_id": vm_id,
-            "status": vm_dict["status"],
-            "pid": vm_dict["pid"],
-            "cpu": vm_dict["cpu"],
-            "memory": vm_dict["memory"],
-            "ip": vm_dict["ip"]
+            "status": vm["status"],
+            "pid": vm["pid"],
+            "cpu": vm["cpu"],
+            "memory": vm["memory"],
+            "ip": vm["ip"]
         }
     return {"message": f"VM {vm_id} not found!"}
 
@@ -132,18 +236,237 @@ def display_vms(vms):
     """
     Displays all VMs.
     Args:
-        vms (dict): A dictionary containing information about running VMs.
+        vms (VMTable): The table containing information about VMs.
     Returns:
         dict: A dictionary containing the status of all VMs.
     """
-    if len(vms) == 0:
+    vm_list = [{
+        "vm_id": vm_id,
+        "status": vm["status"],
+        "pid": vm["pid"],
+        "ip": vm["ip"]
+    } for vm_id, vm in vms.items()]
+    if not vm_list:
         return {"message": "No VMs running!"}
-    vm_list = []
-    for vm_id, vm_dict in vms.items():
-        vm_list.append({
-            "vm_id": vm_id,
-            "status": vm_dict.get("status"),
-            "pid": vm_dict.get("pid"),
-            "ip": vm_dict.get("ip")
-        })
     return {"vms": vm_list}
+
+def start_vms(vm_ids, vms):
+    """
+    Starts a batch of VMs. Their networks are created and their IP addresses
+    assigned in one call, and they are registered with the scheduler together.
+    Args:
+        vm_ids (list): The IDs of the VMs to start.
+        vms (VMTable): The table containing information about VMs.
+    Returns:
+        dict: The result of the operation for each VM, in the order of vm_ids.
+    """
+    with journal.transaction():
+        vm_ids = list(dict.fromkeys(vm_ids))
+        results = {}
+        to_start, stopped = [], set()
+        for vm_id in vm_ids:
+            vm = vms.get(vm_id)
+            if vm is None or vm["status"] == "stopped":
+                to_start.append(vm_id)
+                if vm is not None:
+                    stopped.add(vm_id)
+            else:
+                results[vm_id] = {"message": f"VM {vm_id} already running!"}
+        ips, errors = create_networks(to_start)
+        for vm_id, error in errors.items():
+            results[vm_id] = {"error": f"VM {vm_id} cannot be started: {error}"}
+        inserted, rejected = [], list(errors)
+        for vm_id, ip in ips.items():
+            if vms.insert(vm_id, "running", pid=os.getpid(), ip=ip):
+                inserted.append(vm_id)
+            else:
+                rejected.append(vm_id)
+                results[vm_id] = {"error": f"VM {vm_id} cannot be started, the VM table is full!"}
+        pids, errors = _start_workloads(inserted, vms, stopped)
+        for vm_id, error in errors.items():
+            rejected.append(vm_id)
+            results[vm_id] = {"error": f"VM {vm_id} cannot be started: {error}"}
+        for vm_id, vm_pid in pids.items():
+            _record_vm(vm_id, "running", vm_pid, ips[vm_id])
+            results[vm_id] = {"message": f"VM {vm_id} started!"}
+        delete_networks(rejected)
+        print(f"{len(pids)} VMs started")
+        return _batch_results(vm_ids, results)
+
+def stop_vms(vm_ids, vms):
+    """
+    Stops a batch of VMs.
+    Args:
+        vm_ids (list): The IDs of the VMs to stop.
+        vms (VMTable): The table containing information about VMs.
+    Returns:
+        dict: The result of the operation for each VM, in the order of vm_ids.
+    """
+    with journal.transaction():
+        vm_ids = list(dict.fromkeys(vm_ids))
+        results = {}
+        running = []
+        for vm_id in vm_ids:
+            vm = vms.get(vm_id)
+            if vm is None:
+                results[vm_id] = {"message": f"VM {vm_id} not found!"}
+            elif vm["status"] == "running":
+                running.append(vm_id)
+                results[vm_id] = {"message": f"VM {vm_id} stopped!"}
+            else:
+                results[vm_id] = {"message": f"VM {vm_id} already stopped!"}
+        get_backend().stop(running)
+        for vm_id in running:
+            vms.update(vm_id, status="stopped", pid=None, cpu=None, memory=None, ip=None)
+            _record_vm(vm_id, "stopped")
+        delete_networks(running)
+        return _batch_results(vm_ids, results)
+
+def delete_vms(vm_ids, vms):
+    """
+    Deletes a batch of VMs.
+    Args:
+        vm_ids (list): The IDs of the VMs to delete.
+        vms (VMTable): The table containing information about VMs.
+    Returns:
+        dict: The result of the operation for each VM, in the order of vm_ids.
+    """
+    with journal.transaction():
+        vm_ids = list(dict.fromkeys(vm_ids))
+        existing = [vm_id for vm_id in vm_ids if vm_id in vms]
+        get_backend().stop(existing)
+        delete_networks(existing)
+        detach_from_vpcs(existing)
+        results = {vm_id: {"message": f"VM {vm_id} not found!"} for vm_id in vm_ids}
+        for vm_id in existing:
+            vms.remove(vm_id)
+            journal.record("vm_deleted", vm_id)
+            metrics_store.drop(vm_id)
+            results[vm_id] = {"message": f"VM {vm_id} deleted!"}
+        return _batch_results(vm_ids, results)
+
+def monitor_vms(vm_ids, vms):
+    """
+    Monitors a batch of VMs.
+    Args:
+        vm_ids (list): The IDs of the VMs to monitor.
+        vms (VMTable): The table containing information about VMs.
+    Returns:
+        dict: The status of each VM, in the order of vm_ids.
+    """
+    return {"results": [{"vm_id": vm_id, **monitor_vm(vm_id, vms)}
+                        for vm_id in dict.fromkeys(vm_ids)]}
+
+def _batch_results(vm_ids, results):
+    return {"results": [{"vm_id": vm_id, **results[vm_id]} for vm_id in vm_ids]}
+
+def _record_vm(vm_id, status, pid=None, ip=None):
+    now = time.time()
+    journal.record("vm", vm_id, status, pid, ip, now)
+    if pid and journal.enabled:
+        _pid_times[pid] = now
+
+def _record_adopt():
+    now = time.time()
+    journal.record("adopt", os.getpid(), now)
+    _pid_times[os.getpid()] = now
+
+def _start_workloads(vm_ids, vms, stopped):
+    """
+    Starts the workloads of VMs inserted into the table as running under this
+    process's pid, and updates the pids of those the backend runs elsewhere.
+    VMs whose workload does not start are put back as they were: stopped if
+    they are in `stopped`, and otherwise removed. Their networks are left to
+    the caller.
+    Returns:
+        tuple: The pid of each VM started and the error of each VM that was not.
+    """
+    pids, errors = get_backend().start(vm_ids, vms)
+    pid = os.getpid()
+    for vm_id, vm_pid in pids.items():
+        if vm_pid != pid:
+            vms.update(vm_id, pid=vm_pid)
+    for vm_id in errors:
+        if vm_id in stopped:
+            vms.update(vm_id, status="stopped", pid=None, ip=None)
+        else:
+            vms.remove(vm_id)
+    return pids, errors
+
+def restore_state(vms, directory):
+    """
+    Opens the state journal in a directory and recovers the VMs and networks a
+    previous run left there. Running VMs keep their addresses and are started
+    again on the current backend. A process still alive under a recorded pid
+    from before the state was saved, such as an orphaned simulate_vm process or
+    an engine that did not exit, is terminated.
+    Args:
+        vms (VMTable): The table to recover the VMs into.
+        directory (str): The state directory.
+    Returns:
+        dict: The numbers of running and stopped VMs recovered, of networks and
+        of processes reaped, and the seconds recovery took.
+    Raises:
+        RuntimeError: If another process has the state directory open.
+    """
+    start = time.perf_counter()
+    with journal.transaction():
+        snapshot, records = journal.open(directory, functools.partial(
+            snapshot_state, vms, networks, _pid_times))
+        vm_state, network_state = replay(snapshot, records)
+        restore_networks(network_state)
+        running, stale = _insert_recovered(vm_state, vms)
+        reaped = sum(_reap(pid, since) for pid, since in stale.items())
+        pids, errors = _start_workloads(running, vms, set(running))
+        delete_networks(list(errors))
+        # One record adopts every running VM for this process; the VMs the
+        # backend runs in processes of their own, or not at all, follow it.
+        _record_adopt()
+        for vm_id, pid in pids.items():
+            if pid != os.getpid():
+                _record_vm(vm_id, "running", pid, vm_state[vm_id][2])
+        for vm_id in errors:
+            _record_vm(vm_id, "stopped")
+    seconds = time.perf_counter() - start
+    print(f"Recovered {len(vm_state)} VMs ({len(pids)} running) and "
+          f"{len(network_state)} networks in {seconds:.2f} s")
+    return {"running": len(pids), "stopped": len(vm_state) - len(pids),
+            "networks": len(network_state), "reaped": reaped, "seconds": round(seconds, 3)}
+
+def _insert_recovered(vm_state, vms):
+    """
+    Inserts recovered VMs into the table, running ones under this process's pid.
+    Returns the IDs of the running VMs and, for every other pid recorded, the
+    latest time it was known to back a VM.
+    """
+    pid = os.getpid()
+    running, stale = [], {}
+    for vm_id, (status, old_pid, ip, since) in vm_state.items():
+        if old_pid and old_pid != pid:
+            stale[old_pid] = max(since, stale.get(old_pid, since))
+        if status == "running":
+            running.append(vm_id)
+            vms.insert(vm_id, status, pid=pid, ip=ip)
+        else:
+            vms.insert(vm_id, status)
+    return running, stale
+
+def _reap(pid, since):
+    """
+    Terminates the process with the pid if it started before `since`, that is,
+    if it is the process that backed VMs then rather than a newer one that
+    reused the pid. Our parent, such as the gunicorn master, is never reaped.
+    Returns True if a process was terminated.
+    """
+    try:
+        process = psutil.Process(pid)
+        if process.create_time() > since or pid == os.getppid():
+            return False
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except psutil.TimeoutExpired:
+            process.kill()
+        return True
+    except psutil.Error:
+        return False
@@ -0,0 +1,290 @@
+"""
+VM Table Module
+
+This module stores VM state as fixed-width records in a memory-mapped file under
+/dev/shm (or the temp directory where /dev/shm does not exist). It replaces the
+`Manager().dict()` proxies, whose every field access was an IPC round trip to the
+manager process.
+
+Each record holds the VM ID, pid, status code, packed IPv4 address, CPU and
+memory usage. Writers are serialized by a lock in the owning process and bump a
+per-record sequence counter around each write (a seqlock), so readers in any
+thread or process never take a lock and retry only if they raced a write.
+
+Classes:
+    VMTable: Shared-memory table of VM records.
+
+Global Variables:
+    SHM_DIR (str): Directory holding the table files.
+    DEFAULT_CAPACITY (int): Default number of VM records in a table.
+    STATUS_CODES (dict): Maps status names to the codes stored in a record.
+"""
+
+import math
+import mmap
+import os
+import socket
+import struct
+import tempfile
+import threading
+import uuid
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+DEFAULT_CAPACITY = 65536
+
+STATUS_CODES = {"running": 1, "stopped": 2}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+# Header: capacity, high-water mark (slots ever used), live record count.
+_HEADER = struct.Struct("<III4x")
+# Record: seq, status, vm_id, pid, ip, cpu, memory.
+_RECORD = struct.Struct("<IB3xqiIff")
+_SEQ = struct.Struct("<I")
+_SEQ_MASK = 0xFFFFFFFF
+_METRICS = struct.Struct("<ff")
+_METRICS_OFFSET = 24
+_NAN = float("nan")
+
+
+def pack_ip(ip):
+    """
+    Packs a dotted IPv4 address into an integer. None packs to 0.
+    """
+    if ip is None:
+        return 0
+    return struct.unpack("!I", socket.inet_aton(ip))[0]
+
+
+def unpack_ip(value):
+    """
+    Unpacks an integer into a dotted IPv4 address. 0 unpacks to None.
+    """
+    if value == 0:
+        return None
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+
+def _metric(value):
+    return None if math.isnan(value) else round(value, 1)
+
+
+def _to_dict(record):
+    _, status, _, pid, ip, cpu, memory = record
+    return {
+        "pid": pid or None,
+        "cpu": _metric(cpu),
+        "memory": _metric(memory),
+        "status": STATUS_NAMES[status],
+        "ip": unpack_ip(ip),
+    }
+
+
+class VMTable:
+    """
+    Shared-memory table of VM records.
+
+    The process that creates the table owns it: it performs all writes and
+    removes the file on `close`. Other processes attach by name and read.
+    """
+
+    def __init__(self, name=None, capacity=DEFAULT_CAPACITY, create=True):
+        self.name = name or f"cloud_sim_vms_{uuid.uuid4().hex[:12]}"
+        self.path = os.path.join(SHM_DIR, self.name)
+        if create:
+            size = _HEADER.size + capacity * _RECORD.size
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.ftruncate(fd, size)
+        else:
+            fd = os.open(self.path, os.O_RDWR)
+        try:
+            self._buf = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        if create:
+            _HEADER.pack_into(self._buf, 0, capacity, 0, 0)
+        self.owner = create
+        self._lock = threading.Lock()
+        self._index = {}
+        self._free = []
+        if not create:
+            self._reindex()
+
+    @property
+    def capacity(self):
+        """
+        The number of records the table can hold.
+        """
+        return _HEADER.unpack_from(self._buf, 0)[0]
+
+    def close(self):
+        """
+        Unmaps the table and, in the owning process, removes its file.
+        """
+        self._buf.close()
+        if self.owner and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __len__(self):
+        return _HEADER.unpack_from(self._buf, 0)[2]
+
+    def __contains__(self, vm_id):
+        return self._slot(vm_id) is not None
+
+    def get(self, vm_id):
+        """
+        Reads one VM record without locking.
+        Args:
+            vm_id (int): The ID of the VM.
+        Returns:
+            dict: The VM's pid, cpu, memory, status and ip, or None if not found.
+        """
+        slot = self._slot(vm_id)
+        if slot is None:
+            return None
+        record = self._read(slot)
+        if record[1] == 0 or record[2] != vm_id:
+            return None
+        return _to_dict(record)
+
+    def items(self):
+        """
+        Reads every VM record in one pass over the table.
+        Returns:
+            list: (vm_id, dict) pairs for all VMs in the table.
+        """
+        return [(record[2], _to_dict(record)) for record in self._records()
+                if record[1] != 0]
+
+    def insert(self, vm_id, status, pid=None, ip=None):
+        """
+        Adds a VM record, or overwrites the existing record of the same VM.
+        Args:
+            vm_id (int): The ID of the VM.
+            status (str): The VM status, a key of STATUS_CODES.
+            pid (int): The process ID backing the VM, if any.
+            ip (str): The VM's IPv4 address, if any.
+        Returns:
+            bool: False if the table is full.
+        """
+        with self._lock:
+            slot = self._index.get(vm_id)
+            if slot is None:
+                capacity, high_water, count = _HEADER.unpack_from(self._buf, 0)
+                if self._free:
+                    slot = self._free.pop()
+                elif high_water < capacity:
+                    slot = high_water
+                    high_water += 1
+                else:
+                    return False
+                _HEADER.pack_into(self._buf, 0, capacity, high_water, count + 1)
+                self._index[vm_id] = slot
+            self._write(slot, (STATUS_CODES[status], vm_id, pid or 0, pack_ip(ip),
+                               _NAN, _NAN))
+            return True
+
+    def update(self, vm_id, **fields):
+        """
+        Updates some fields of an existing VM record.
+        Args:
+            vm_id (int): The ID of the VM.
+            **fields: New values for pid, cpu, memory, status or ip.
+        Returns:
+            bool: False if the VM is not in the table.
+        """
+        with self._lock:
+            slot = self._index.get(vm_id)
+            if slot is None:
+                return False
+            _, status, _, pid, ip, cpu, memory = self._read(slot)
+            if "status" in fields:
+                status = STATUS_CODES[fields["status"]]
+            if "pid" in fields:
+                pid = fields["pid"] or 0
+            if "ip" in fields:
+                ip = pack_ip(fields["ip"])
+            if "cpu" in fields:
+                cpu = _NAN if fields["cpu"] is None else fields["cpu"]
+            if "memory" in fields:
+                memory = _NAN if fields["memory"] is None else fields["memory"]
+            self._write(slot, (status, vm_id, pid, ip, cpu, memory))
+            return True
+
+    def set_metrics(self, vm_id, cpu, memory):
+        """
+        Writes the CPU and memory usage of a VM.
+        Args:
+            vm_id (int): The ID of the VM.
+            cpu (float): CPU usage in percent.
+            memory (float): Memory usage in percent.
+        """
+        with self._lock:
+            slot = self._index.get(vm_id)
+            if slot is None:
+                return
+            offset = _HEADER.size + slot * _RECORD.size
+            seq = _SEQ.unpack_from(self._buf, offset)[0]
+            _SEQ.pack_into(self._buf, offset, (seq + 1) & _SEQ_MASK)
+            _METRICS.pack_into(self._buf, offset + _METRICS_OFFSET, cpu, memory)
+            _SEQ.pack_into(self._buf, offset, (seq + 2) & _SEQ_MASK)
+
+    def remove(self, vm_id):
+        """
+        Removes a VM record.
+        Args:
+            vm_id (int): The ID of the VM.
+        Returns:
+            bool: False if the VM is not in the table.
+        """
+        with self._lock:
+            slot = self._index.pop(vm_id, None)
+            if slot is None:
+                return False
+            self._write(slot, (0, 0, 0, 0, _NAN, _NAN))
+            self._free.append(slot)
+            capacity, high_water, count = _HEADER.unpack_from(self._buf, 0)
+            _HEADER.pack_into(self._buf, 0, capacity, high_water, count - 1)
+            return True
+
+    def _slot(self, vm_id):
+        slot = self._index.get(vm_id)
+        if self.owner:
+            return slot
+        if slot is None or self._read(slot)[2] != vm_id:
+            self._reindex()
+            slot = self._index.get(vm_id)
+        return slot
+
+    def _reindex(self):
+        self._index = {record[2]: slot for slot, record in enumerate(self._records())
+                       if record[1] != 0}
+
+    def _records(self):
+        """
+        Copies all used slots out in one slice and unpacks them, re-reading any
+        record that was caught mid-write or rewritten while it was copied.
+        """
+        high_water = _HEADER.unpack_from(self._buf, 0)[1]
+        end = _HEADER.size + high_water * _RECORD.size
+        data = bytes(self._buf[_HEADER.size:end])
+        records = list(_RECORD.iter_unpack(data))
+        for slot, record in enumerate(records):
+            offset = _HEADER.size + slot * _RECORD.size
+            if record[0] & 1 or _SEQ.unpack_from(self._buf, offset)[0] != record[0]:
+                records[slot] = self._read(slot)
+        return records
+
+    def _read(self, slot):
+        offset = _HEADER.size + slot * _RECORD.size
+        while True:
+            record = _RECORD.unpack_from(self._buf, offset)
+            if record[0] & 1 == 0 and _SEQ.unpack_from(self._buf, offset)[0] == record[0]:
+                return record
+
+    def _write(self, slot, fields):
+        offset = _HEADER.size + slot * _RECORD.size
+        seq = _SEQ.unpack_from(self._buf, offset)[0]
+        _SEQ.pack_into(self._buf, offset, (seq + 1) & _SEQ_MASK)
+        _RECORD.pack_into(self._buf, offset, (seq + 1) & _SEQ_MASK, *fields)
+        _SEQ.pack_into(self._buf, offset, (seq + 2) & _SEQ_MASK)
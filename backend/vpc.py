@@ -0,0 +1,410 @@
+"""
+VPC Module
+
+This module simulates virtual private clouds. A VPC owns a CIDR block that is
+split into subnets, a set of security groups and a firewall. A VM attached to a
+VPC gets an address in one of its subnets, from the subnet's AddressPool, and
+belongs to one or more of its security groups.
+
+A flow from one VM to another is allowed when:
+    - both VMs are attached to the same VPC,
+    - the VPC's firewall allows it: ordered allow and deny rules with a default
+      action, like a network ACL,
+    - one of the source VM's security groups allows it out, and
+    - one of the destination VM's security groups allows it in.
+Security groups hold allow rules only and are stateful, so only the direction
+that opens a flow is checked; its replies are always allowed. Every VPC has a
+"default" group that allows all traffic out and all traffic in from the VPC's
+own block, and VMs attached without groups join it.
+
+Every rule list is compiled into a firewall.RuleSet when it is set, so checking
+a flow costs a few dictionary lookups however many rules there are.
+
+Classes:
+    SecurityGroup: Named ingress and egress allow rules.
+    VPC: A CIDR block with subnets, security groups, a firewall and attached VMs.
+
+Functions:
+    create_vpc(name, cidr=DEFAULT_CIDR): Creates a VPC.
+    delete_vpc(name): Deletes a VPC and detaches its VMs.
+    get_vpc(name): Returns a VPC.
+    list_vpcs(): Returns the status of every VPC.
+    attach_to_vpc(vpc_name, vm_id, subnet, groups=None): Attaches a VM to a VPC.
+    detach_from_vpc(vm_id): Detaches a VM from its VPC.
+    detach_from_vpcs(vm_ids): Detaches several VMs from their VPCs.
+    check_flow(source_vm, destination_vm, protocol, port=0): Decides a flow between VMs.
+
+Global Variables:
+    vpcs (dict): Every VPC by name.
+    vm_vpcs (dict): The name of the VPC each attached VM belongs to.
+    DEFAULT_CIDR (str): The block of a VPC created without one.
+    DEFAULT_GROUP (str): The name of every VPC's default security group.
+    registry_lock (RLock): Held while reading or changing any VPC.
+"""
+
+import ipaddress
+import threading
+from firewall import PROTOCOLS, MAX_PORT, Rule, RuleSet, parse_ports, parse_rule
+from ip_assignment import AddressPool, ip_to_int
+
+DEFAULT_CIDR = "172.16.0.0/16"
+DEFAULT_GROUP = "default"
+
+vpcs = {}
+vm_vpcs = {}
+registry_lock = threading.RLock()
+
+class SecurityGroup:
+    """
+    Named ingress and egress allow rules. An ingress rule gives the CIDR of the
+    peers that may open flows to members, an egress rule the CIDR of the peers
+    members may open flows to; both take a protocol and destination ports.
+    """
+
+    def __init__(self, name, ingress=(), egress=()):
+        """
+        Args:
+            name (str): The name of the group.
+            ingress (list): The ingress rules, such as
+                {"protocol": "tcp", "ports": "22", "cidr": "10.0.0.0/8"}.
+            egress (list): The egress rules, in the same form.
+        Raises:
+            ValueError: If a rule is invalid.
+        """
+        self.name = name
+        self.ingress = RuleSet([_group_rule(spec, "source") for spec in ingress])
+        self.egress = RuleSet([_group_rule(spec, "destination") for spec in egress])
+
+    def allows_out(self, source, destination, protocol, port):
+        """
+        Returns True if the group lets a member open the flow.
+        """
+        return self.egress.match(source, destination, protocol, port) is not None
+
+    def allows_in(self, source, destination, protocol, port):
+        """
+        Returns True if the group lets a peer open the flow to a member.
+        """
+        return self.ingress.match(source, destination, protocol, port) is not None
+
+    def to_dict(self):
+        """
+        Returns the JSON description of the group.
+        """
+        return {"name": self.name,
+                "ingress": [_group_rule_dict(rule, rule.source) for rule in self.ingress.rules],
+                "egress": [_group_rule_dict(rule, rule.destination)
+                           for rule in self.egress.rules]}
+
+def _group_rule(spec, peer):
+    try:
+        return Rule("allow", spec.get("protocol", "any"), ports=parse_ports(spec.get("ports")),
+                    **{peer: spec.get("cidr", "0.0.0.0/0")})
+    except (AttributeError, TypeError) as e:
+        raise ValueError(f"Invalid rule: {e}") from e
+
+def _group_rule_dict(rule, peer):
+    return {"protocol": rule.protocol, "ports": list(rule.ports), "cidr": str(peer)}
+
+class VPC:
+    """
+    A CIDR block with subnets, security groups, a firewall and attached VMs.
+    Callers hold registry_lock.
+    """
+
+    def __init__(self, name, cidr=DEFAULT_CIDR):
+        """
+        Args:
+            name (str): The name of the VPC.
+            cidr (str): The VPC's block.
+        Raises:
+            ValueError: If the CIDR is invalid.
+        """
+        self.name = name
+        self.cidr = ipaddress.IPv4Network(cidr)
+        self.subnets = {}
+        self.security_groups = {DEFAULT_GROUP: SecurityGroup(
+            DEFAULT_GROUP, [{"cidr": str(self.cidr)}], [{}])}
+        self.firewall = RuleSet(default="allow")
+        self.vms = {}
+
+    def add_subnet(self, name, cidr):
+        """
+        Adds a subnet.
+        Args:
+            name (str): The name of the subnet.
+            cidr (str): The subnet's block, inside the VPC's and overlapping no
+                other subnet.
+        Raises:
+            ValueError: If the subnet exists or the CIDR is invalid.
+        """
+        if name in self.subnets:
+            raise ValueError(f"Subnet {name} already exists.")
+        subnet = ipaddress.IPv4Network(cidr)
+        if not subnet.subnet_of(self.cidr):
+            raise ValueError(f"{subnet} is outside the VPC's block {self.cidr}.")
+        for other, pool in self.subnets.items():
+            if subnet.overlaps(ipaddress.IPv4Network(pool.cidr)):
+                raise ValueError(f"{subnet} overlaps subnet {other}.")
+        self.subnets[name] = AddressPool(str(subnet))
+
+    def remove_subnet(self, name):
+        """
+        Removes a subnet that has no VMs.
+        Raises:
+            KeyError: If the subnet does not exist.
+            ValueError: If VMs are attached to the subnet.
+        """
+        if name not in self.subnets:
+            raise KeyError(f"Subnet {name}")
+        if any(vm["subnet"] == name for vm in self.vms.values()):
+            raise ValueError(f"Subnet {name} still has VMs.")
+        del self.subnets[name]
+
+    def set_security_group(self, name, ingress, egress):
+        """
+        Creates or replaces a security group. Members of a replaced group keep
+        their membership.
+        Raises:
+            ValueError: If a rule is invalid.
+        """
+        self.security_groups[name] = SecurityGroup(name, ingress, egress)
+
+    def remove_security_group(self, name):
+        """
+        Removes a security group that has no members.
+        Raises:
+            KeyError: If the group does not exist.
+            ValueError: If the group is the default group or has members.
+        """
+        if name not in self.security_groups:
+            raise KeyError(f"Security group {name}")
+        if name == DEFAULT_GROUP:
+            raise ValueError("The default security group cannot be removed.")
+        if any(name in vm["groups"] for vm in self.vms.values()):
+            raise ValueError(f"Security group {name} still has members.")
+        del self.security_groups[name]
+
+    def set_firewall(self, rules, default="allow"):
+        """
+        Replaces the firewall rules.
+        Args:
+            rules (list): The rule descriptions, see firewall.parse_rule.
+            default (str): The action for flows that match no rule.
+        Raises:
+            ValueError: If a rule or the default action is invalid.
+        """
+        self.firewall = RuleSet([parse_rule(spec) for spec in rules], default)
+
+    def attach(self, vm_id, subnet, groups):
+        """
+        Gives a VM an address in a subnet and makes it a member of security
+        groups. A VM that is already attached moves and its old address is released.
+        Returns:
+            str: The VM's address.
+        Raises:
+            KeyError: If the subnet or a group does not exist.
+            ValueError: If the subnet is full, or the subnet or groups are not
+                given by name.
+        """
+        if not isinstance(subnet, str):
+            raise ValueError("The subnet must be given by name.")
+        if not isinstance(groups, (list, tuple)) or not all(
+                isinstance(group, str) for group in groups):
+            raise ValueError("The security groups must be a list of names.")
+        if subnet not in self.subnets:
+            raise KeyError(f"Subnet {subnet}")
+        pool = self.subnets[subnet]
+        groups = tuple(dict.fromkeys(groups))
+        for group in groups:
+            if group not in self.security_groups:
+                raise KeyError(f"Security group {group}")
+        # The old address is released first, so a VM can move within a full subnet.
+        old = self.vms.get(vm_id)
+        if old is not None:
+            self.detach(vm_id)
+        ip = pool.allocate()
+        if ip is None:
+            if old is not None:
+                self.subnets[old["subnet"]].reserve([old["ip"]])
+                self.vms[vm_id] = old
+            raise ValueError(f"Subnet {subnet} is full.")
+        self.vms[vm_id] = {"subnet": subnet, "ip": ip, "address": ip_to_int(ip),
+                           "groups": groups}
+        return ip
+
+    def detach(self, vm_id):
+        """
+        Releases a VM's address and membership.
+        """
+        vm = self.vms.pop(vm_id)
+        self.subnets[vm["subnet"]].release(vm["ip"])
+
+    def check(self, source, destination, protocol, port):
+        """
+        Decides a flow between two of the VPC's VMs.
+        Args:
+            source (dict): The attachment of the VM that opens the flow.
+            destination (dict): The attachment of the VM it opens the flow to.
+            protocol (str): The protocol of the flow.
+            port (int): The destination port.
+        Returns:
+            dict: Whether the flow is allowed and why.
+        """
+        src, dst = source["address"], destination["address"]
+        rule = self.firewall.match(src, dst, protocol, port)
+        if rule is not None and rule.action == "deny":
+            return {"allowed": False, "reason": "denied by firewall rule",
+                    "rule": rule.to_dict()}
+        if rule is None and self.firewall.default == "deny":
+            return {"allowed": False, "reason": "denied by the firewall's default action"}
+        if not any(self.security_groups[group].allows_out(src, dst, protocol, port)
+                   for group in source["groups"]):
+            return {"allowed": False, "reason": "no egress rule of the source's security "
+                                                "groups allows it"}
+        if not any(self.security_groups[group].allows_in(src, dst, protocol, port)
+                   for group in destination["groups"]):
+            return {"allowed": False, "reason": "no ingress rule of the destination's "
+                                                "security groups allows it"}
+        return {"allowed": True}
+
+    def status(self):
+        """
+        Returns the VPC's subnets, security groups, firewall and VMs.
+        """
+        return {"name": self.name, "cidr": str(self.cidr),
+                "subnets": {name: {"cidr": pool.cidr, "used": pool.used, "size": pool.size}
+                            for name, pool in self.subnets.items()},
+                "security_groups": [group.to_dict() for group in self.security_groups.values()],
+                "firewall": self.firewall.to_dict(),
+                "vms": {vm_id: {"subnet": vm["subnet"], "ip": vm["ip"],
+                                "groups": list(vm["groups"])}
+                        for vm_id, vm in self.vms.items()}}
+
+def create_vpc(name, cidr=DEFAULT_CIDR):
+    """
+    Creates a VPC.
+    Args:
+        name (str): The name of the VPC.
+        cidr (str): The VPC's block.
+    Returns:
+        VPC: The new VPC.
+    Raises:
+        ValueError: If the VPC exists or the CIDR is invalid.
+    """
+    with registry_lock:
+        if name in vpcs:
+            raise ValueError(f"VPC {name} already exists.")
+        vpcs[name] = VPC(name, cidr)
+        return vpcs[name]
+
+def delete_vpc(name):
+    """
+    Deletes a VPC and detaches its VMs.
+    Args:
+        name (str): The name of the VPC.
+    Returns:
+        bool: False if the VPC does not exist.
+    """
+    with registry_lock:
+        vpc = vpcs.pop(name, None)
+        if vpc is None:
+            return False
+        for vm_id in vpc.vms:
+            del vm_vpcs[vm_id]
+        return True
+
+def get_vpc(name):
+    """
+    Returns a VPC.
+    Raises:
+        KeyError: If the VPC does not exist.
+    """
+    if name not in vpcs:
+        raise KeyError(f"VPC {name}")
+    return vpcs[name]
+
+def list_vpcs():
+    """
+    Returns the status of every VPC.
+    """
+    with registry_lock:
+        return [vpc.status() for vpc in vpcs.values()]
+
+def attach_to_vpc(vpc_name, vm_id, subnet, groups=None):
+    """
+    Attaches a VM to a VPC. A VM belongs to at most one VPC; attaching it again
+    moves it.
+    Args:
+        vpc_name (str): The name of the VPC.
+        vm_id (int): The ID of the VM.
+        subnet (str): The subnet the VM gets its address in.
+        groups (list): The VM's security groups. Defaults to the default group.
+    Returns:
+        str: The VM's address.
+    Raises:
+        KeyError: If the VPC, subnet or a group does not exist.
+        ValueError: If the subnet is full, or the subnet or groups are not given
+            by name.
+    """
+    with registry_lock:
+        vpc = get_vpc(vpc_name)
+        ip = vpc.attach(vm_id, subnet, groups or [DEFAULT_GROUP])
+        previous = vm_vpcs.get(vm_id)
+        if previous not in (None, vpc_name):
+            vpcs[previous].detach(vm_id)
+        vm_vpcs[vm_id] = vpc_name
+        return ip
+
+def detach_from_vpc(vm_id):
+    """
+    Detaches a VM from its VPC, releasing its address.
+    Args:
+        vm_id (int): The ID of the VM.
+    Returns:
+        bool: False if the VM is not attached to a VPC.
+    """
+    with registry_lock:
+        vpc_name = vm_vpcs.pop(vm_id, None)
+        if vpc_name is None:
+            return False
+        vpcs[vpc_name].detach(vm_id)
+        return True
+
+def detach_from_vpcs(vm_ids):
+    """
+    Detaches several VMs from their VPCs under one registry lock.
+    Args:
+        vm_ids (list): The IDs of the VMs.
+    """
+    with registry_lock:
+        for vm_id in vm_ids:
+            detach_from_vpc(vm_id)
+
+def check_flow(source_vm, destination_vm, protocol, port=0):
+    """
+    Decides whether a VM may open a flow to another VM.
+    Args:
+        source_vm (int): The ID of the VM that opens the flow.
+        destination_vm (int): The ID of the VM it opens the flow to.
+        protocol (str): "tcp", "udp" or "icmp".
+        port (int): The destination port; 0 for ICMP.
+    Returns:
+        dict: Whether the flow is allowed and, if not, why.
+    Raises:
+        KeyError: If a VM is not attached to a VPC.
+        ValueError: If the protocol or port is invalid.
+    """
+    if protocol not in PROTOCOLS:
+        raise ValueError(f"The protocol must be one of {', '.join(PROTOCOLS)}.")
+    if not 0 <= port <= MAX_PORT:
+        raise ValueError(f"Invalid port {port}.")
+    with registry_lock:
+        for vm_id in (source_vm, destination_vm):
+            if vm_id not in vm_vpcs:
+                raise KeyError(f"VPC attachment of VM {vm_id}")
+        source_vpc, destination_vpc = vm_vpcs[source_vm], vm_vpcs[destination_vm]
+        if source_vpc != destination_vpc:
+            return {"allowed": False, "reason": "the VMs are in different VPCs"}
+        vpc = vpcs[source_vpc]
+        return vpc.check(vpc.vms[source_vm], vpc.vms[destination_vm], protocol, port)